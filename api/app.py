@@ -1,14 +1,15 @@
 import os
-import subprocess
+import time
+import atexit
 import logging
 import base64
 import secrets
 import zipfile
+import threading
 from datetime import datetime
-from contextlib import contextmanager
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
 
-from flask import Flask, request, render_template, send_from_directory, redirect, url_for, abort, session
+from flask import Flask, Request, Response, request, render_template, send_from_directory, redirect, url_for, abort, session, jsonify
 from flask_wtf.csrf import CSRFProtect, validate_csrf
 from flask_wtf import FlaskForm
 from wtforms import FileField, SubmitField
@@ -16,14 +17,38 @@ from wtforms.validators import DataRequired
 from werkzeug.utils import secure_filename
 from functools import wraps
 
-from gdrive_manager import GDriveManager
-import psutil
+from gdrive_manager import drive_service
+from drive_catalog import DriveCatalog
+from drive_downloads import DownloadManager, FAILED as DOWNLOAD_FAILED, remove_partial_downloads
+from blend_reader import BlendReadError, blend_info, estimate_render, open_blend_stream, parse_header
+from blend_scanner import scan_file
+from upload_ingest import IngestStream, remove_stale_uploads
+from output_catalog import OutputCatalog, mark_used, trim_directory
+from render_queue import RenderJob, RenderQueue, JobCancelled, FINAL_STATES, PRIORITY_BATCH, PRIORITY_PREVIEW
+from job_snapshots import JobSnapshots
+from leases import LOCK_SUFFIX, is_held, reclaim, share, try_acquire
+from render_progress import event_stream
+from render_cache import RenderCache, cache_key, file_digest
+from log_pipeline import install as install_log_pipeline
+from log_tail import GZIP_SUFFIX, JobLogs, read_since, tail_lines
+import metrics
+from blender_runner import BlenderBackend, RenderError, blender_version, quality_scene, DRAFT, FINAL
+from frame_ranges import retarget_manifest
+from tiles import parse_tiles
+from job_runner import job_type, render_job
+from farm import Farm, FarmError
+from blender_pool import WarmWorkerPool
+from device_slots import DeviceScheduler, inventory_from_env, GPU, CPU, ANY
 
 # --- configuration ---
 
 class Config:
-    WORKDIR = "/workspace"
+    WORKDIR = os.environ.get("WORKDIR", "/workspace")
     LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "debug.log")
+    # Log records waiting for the logging thread; beyond this they are dropped and counted
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+    # debug.log is rotated past this size; 0 leaves rotation to logrotate (several processes)
+    LOG_ROTATE_MB = int(os.environ.get("LOG_ROTATE_MB", "5"))
     # Use environment variable or generate secure token for auth
     AUTH_TOKEN = os.environ.get("AUTH_TOKEN")
     if not AUTH_TOKEN:
@@ -35,9 +60,96 @@ class Config:
     
     # Security settings
     MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+    # Whole request body, refused before it is read; leaves room for the form fields
+    MAX_CONTENT_LENGTH = MAX_FILE_SIZE + 1024 * 1024
     ALLOWED_EXTENSIONS = {'.blend'}
 
+    # Seconds a Google Drive listing is reused before asking Drive for changes
+    GDRIVE_CATALOG_TTL = int(os.environ.get("GDRIVE_CATALOG_TTL", "60"))
+    DRIVE_DOWNLOAD_WORKERS = int(os.environ.get("DRIVE_DOWNLOAD_WORKERS", "4"))
+    DRIVE_DOWNLOAD_CHUNK_MB = int(os.environ.get("DRIVE_DOWNLOAD_CHUNK_MB", "8"))
+
+    # Render settings
+    BLENDER_BIN = os.environ.get("BLENDER_BIN", "blender")
+    # Device slots: "0,1,2" renders on each GPU separately, "0+1,2" groups GPUs 0 and 1.
+    # Defaults to CUDA_VISIBLE_DEVICES, or a single slot using every GPU.
+    RENDER_DEVICES = os.environ.get("RENDER_DEVICES")
+    RENDER_CPU_SLOT = os.environ.get("RENDER_CPU_SLOT", "true").lower() == "true"
+    CYCLES_DEVICE_TYPE = os.environ.get("CYCLES_DEVICE_TYPE", "CUDA")
+    # Concurrent render jobs, defaults to one per device slot
+    RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "0"))
+    RENDER_TIMEOUT = int(os.environ.get("RENDER_TIMEOUT", "300"))  # 5 minutes, per frame
+    # Animation jobs: frames per parallel chunk (0 = spread evenly over the device slots)
+    RENDER_CHUNK_FRAMES = int(os.environ.get("RENDER_CHUNK_FRAMES", "0"))
+    RENDER_CHUNK_RETRIES = int(os.environ.get("RENDER_CHUNK_RETRIES", "1"))
+    # Keep Blender processes alive between renders instead of one cold start per job
+    RENDER_WARM_WORKERS = os.environ.get("RENDER_WARM_WORKERS", "false").lower() == "true"
+    WARM_WORKER_MAX_JOBS = int(os.environ.get("WARM_WORKER_MAX_JOBS", "20"))
+    WARM_WORKER_MAX_RSS_MB = int(os.environ.get("WARM_WORKER_MAX_RSS_MB", "8192"))
+    # Jobs are refused up front when the .blend file asks for more than this
+    MAX_RENDER_RESOLUTION = int(os.environ.get("MAX_RENDER_RESOLUTION", "16384"))  # pixels per side
+    MAX_RENDER_FRAMES = int(os.environ.get("MAX_RENDER_FRAMES", "10000"))
+    # Most jobs accepted in one /render_batch request
+    MAX_BATCH_JOBS = int(os.environ.get("MAX_BATCH_JOBS", "500"))
+    # Jobs without ?device= costing at most this (pixels x samples x frames) may also use
+    # the CPU slot, 0 keeps them on the GPUs
+    RENDER_CPU_MAX_COST = int(os.environ.get("RENDER_CPU_MAX_COST", "0"))
+    # Finished render outputs kept for identical jobs (same .blend content and settings), 0 disables
+    RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join(WORKDIR, "render-cache"))
+    RENDER_CACHE_MB = int(os.environ.get("RENDER_CACHE_MB", "2048"))
+    # Bearer token accepted by /metrics besides a logged-in session, unset: session only
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+    # Seconds between two samples of the Blender processes' CPU and memory use
+    METRICS_SAMPLE_INTERVAL = float(os.environ.get("METRICS_SAMPLE_INTERVAL", "5"))
+    # Seconds between keep-alive comments on idle job event streams
+    SSE_HEARTBEAT = int(os.environ.get("SSE_HEARTBEAT", "15"))
+    # Blender's output of each job goes to its own file here, the most recent JOB_LOG_KEEP are kept
+    JOB_LOG_DIR = os.environ.get("JOB_LOG_DIR", os.path.join(WORKDIR, "logs", "jobs"))
+    JOB_LOG_KEEP = int(os.environ.get("JOB_LOG_KEEP", "200"))
+    # Lines returned by /debug_log and the job logs when read without a cursor
+    LOG_TAIL_LINES = 300
+    # "coordinator": jobs are rendered by farm workers (farm_worker.py) instead of this machine
+    FARM_MODE = os.environ.get("FARM_MODE", "local")
+    # Bearer token of the farm workers, required in coordinator mode
+    FARM_TOKEN = os.environ.get("FARM_TOKEN")
+    # Seconds without a heartbeat before a worker's jobs go to another worker, and leases per job
+    FARM_WORKER_TIMEOUT = int(os.environ.get("FARM_WORKER_TIMEOUT", "30"))
+    FARM_MAX_ATTEMPTS = int(os.environ.get("FARM_MAX_ATTEMPTS", "3"))
+    # Jobs handed to the farm at once in coordinator mode
+    FARM_MAX_JOBS = int(os.environ.get("FARM_MAX_JOBS", "64"))
+    # Leases of the device slots, shared by the processes of the app (gunicorn workers)
+    LEASE_DIR = os.environ.get("LEASE_DIR", os.path.join(WORKDIR, "leases"))
+    # Job and batch state readable by every process, the most recent JOB_STATE_KEEP jobs are kept
+    JOB_STATE_DIR = os.environ.get("JOB_STATE_DIR", os.path.join(WORKDIR, "jobs"))
+    JOB_STATE_KEEP = int(os.environ.get("JOB_STATE_KEEP", "1000"))
+    # Gallery thumbnails, at most THUMBNAIL_SIZE pixels per side, made by THUMBNAIL_WORKERS threads
+    THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", os.path.join(WORKDIR, "thumbnails"))
+    THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", "320"))
+    THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", "2"))
+    # Rendered images per page of the gallery and of /outputs
+    OUTPUT_PAGE_SIZE = int(os.environ.get("OUTPUT_PAGE_SIZE", "24"))
+    # The least recently used rendered images and uploads are removed beyond these sizes, 0 keeps them all
+    OUTPUT_MAX_MB = int(os.environ.get("OUTPUT_MAX_MB", "0"))
+    UPLOAD_MAX_MB = int(os.environ.get("UPLOAD_MAX_MB", "0"))
+
+class UploadRequest(Request):
+    """Streams files posted to the upload route through ``IngestStream``."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint != "upload":
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        stream = IngestStream(os.path.join(app.config["WORKDIR"], "uploads"), app.config["MAX_FILE_SIZE"])
+        self.__dict__.setdefault("_ingest_streams", []).append(stream)
+        return stream
+
+    def close(self):
+        super().close()
+        # Also covers requests whose form parsing failed half way
+        for stream in self.__dict__.get("_ingest_streams", ()):
+            stream.close()
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config.from_object(Config)
 
 # Enable CSRF protection
@@ -49,10 +161,6 @@ if not app.config.get('SECRET_KEY') or app.config['SECRET_KEY'] == 'change-this-
     app.config['SECRET_KEY'] = secrets.token_hex(16)
     print("WARNING: Using auto-generated SECRET_KEY. Set SECRET_KEY environment variable for production.")
 
-# Debug: Print configuration on startup
-print(f"AUTH_TOKEN configured: '{app.config['AUTH_TOKEN']}'")
-print(f"Environment AUTH_TOKEN: '{os.environ.get('AUTH_TOKEN', 'NOT SET')}'")
-
 # Session-based auth decorator
 def require_auth(f):
     @wraps(f)
@@ -68,17 +176,26 @@ def require_auth(f):
 
 formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
 
-file_handler = RotatingFileHandler(app.config["LOG_PATH"], maxBytes=5 * 1024 * 1024, backupCount=3)
+if app.config["LOG_ROTATE_MB"] > 0:
+    file_handler = RotatingFileHandler(
+        app.config["LOG_PATH"], maxBytes=app.config["LOG_ROTATE_MB"] * 1024 * 1024, backupCount=3)
+else:
+    # Several processes write the file: it is reopened once logrotate moved it
+    file_handler = WatchedFileHandler(app.config["LOG_PATH"])
 file_handler.setLevel(logging.INFO)
 file_handler.setFormatter(formatter)
 
 stream_handler = logging.StreamHandler()
 stream_handler.setFormatter(formatter)
 
+# Handlers live on the root logger so that the helper modules (render queue,
+# Blender runner, GDrive manager) end up in the same log as the app itself.
+# Records go through a bounded queue and are written by a background thread,
+# so request threads never wait on the file or stderr.
+log_listener = install_log_pipeline(file_handler, stream_handler, queue_size=app.config["LOG_QUEUE_SIZE"])
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+logger.info(f"AUTH_TOKEN {'from the environment' if os.environ.get('AUTH_TOKEN') else 'generated for this session'}")
 
 # --- auth ---
 # Token-based authentication - see require_auth decorator above
@@ -92,11 +209,13 @@ class UploadForm(FlaskForm):
 def validate_blend_file(file_path):
     """Valide la structure d'un fichier .blend"""
     try:
-        # Vérifier la signature du fichier .blend
-        with open(file_path, 'rb') as f:
-            header = f.read(12)
-            if not header.startswith(b'BLENDER'):
-                return False, "Invalid .blend file signature"
+        # Vérifier la signature du fichier .blend (éventuellement compressé gzip/zstd)
+        try:
+            stream, _ = open_blend_stream(file_path)
+            with stream:
+                parse_header(stream)
+        except BlendReadError:
+            return False, "Invalid .blend file signature"
         
         # Vérifier la taille du fichier
         file_size = os.path.getsize(file_path)
@@ -110,103 +229,374 @@ def validate_blend_file(file_path):
 def scan_blend_for_scripts(file_path):
     """Scanne un fichier .blend pour détecter des scripts Python suspects"""
     try:
-        with open(file_path, 'rb') as f:
-            content = f.read()
-            # Rechercher des patterns suspects
-            suspicious_patterns = [
-                b'import os',
-                b'subprocess',
-                b'exec(',
-                b'eval(',
-                b'__import__',
-                b'open(',
-                b'file(',
-                b'input(',
-                b'raw_input',
-                b'system(',
-                b'popen('
-            ]
-            
-            for pattern in suspicious_patterns:
-                if pattern in content:
-                    return True, f"Suspicious pattern found: {pattern.decode('utf-8', errors='ignore')}"
-        
-        return False, "No suspicious scripts detected"
+        return scan_file(file_path)
     except Exception as e:
         return True, f"Error scanning file: {str(e)}"
 
+# New or modified Drive files are downloaded to the uploads in the background
+drive_downloads = DownloadManager(
+    drive_service,
+    os.path.join(app.config["WORKDIR"], "uploads"),
+    workers=app.config["DRIVE_DOWNLOAD_WORKERS"],
+    chunk_size=app.config["DRIVE_DOWNLOAD_CHUNK_MB"] * 1024 * 1024,
+)
+atexit.register(drive_downloads.shutdown)
+
+drive_catalog = DriveCatalog(
+    drive_service,
+    ttl=app.config["GDRIVE_CATALOG_TTL"],
+    on_change=drive_downloads.request_all,
+)
+
 def get_blend_files():
-    try:
-        return [f for f in GDriveManager().list_files() if f["name"].endswith(".blend")]
-    except Exception as e:
-        logger.error(f"Failed to fetch GDrive files: {e}")
-        return []
+    return drive_catalog.files()
 
-def get_rendered_images():
-    output_dir = os.path.join(app.config["WORKDIR"], "output")
-    try:
-        return sorted([f for f in os.listdir(output_dir) if f.endswith(".png")])
-    except Exception:
-        return []
+# Rendered images, indexed as renders finish instead of listed on each page
+output_catalog = OutputCatalog(
+    os.path.join(app.config["WORKDIR"], "output"),
+    app.config["THUMBNAIL_DIR"],
+    max_bytes=app.config["OUTPUT_MAX_MB"] * 1024 * 1024,
+    thumbnail_size=app.config["THUMBNAIL_SIZE"],
+    workers=app.config["THUMBNAIL_WORKERS"],
+)
+atexit.register(output_catalog.shutdown)
+
+def get_rendered_images(offset=0, limit=None):
+    """``(images, total)``: dicts of a page of rendered images, newest first."""
+    outputs, total = output_catalog.page(offset, limit or app.config["OUTPUT_PAGE_SIZE"])
+    images = []
+    for output in outputs:
+        images.append(dict(
+            output.to_dict(),
+            url=url_for("download", filename=output.name),
+            # Versioned by modification time: the thumbnail of a file rendered again changes
+            thumbnail_url=url_for("thumbnail", filename=output.name, v=int(output.modified_at)),
+        ))
+    return images, total
 
 def render_index(error=None, job=None, img_b64=None):
+    rendered_images, rendered_total = get_rendered_images()
     return render_template(
         "index.html",
         error=error,
         job=job,
         img_b64=img_b64,
         gdrive_files=get_blend_files(),
-        rendered_images=get_rendered_images(),
+        rendered_images=rendered_images,
+        rendered_total=rendered_total,
+        output_page_size=app.config["OUTPUT_PAGE_SIZE"],
         logout_url=url_for("logout")
     )
 
+def trim_uploads(keep=None):
+    """Apply UPLOAD_MAX_MB to the uploads, sparing the files of queued or running jobs."""
+    if not app.config["UPLOAD_MAX_MB"]:
+        return
+    busy = {job.blend_path for job in render_queue.jobs() if job.state not in FINAL_STATES}
+    busy.add(keep)
+    trim_directory(
+        os.path.join(app.config["WORKDIR"], "uploads"),
+        app.config["UPLOAD_MAX_MB"] * 1024 * 1024,
+        tuple(app.config["ALLOWED_EXTENSIONS"]),
+        in_use=lambda path: path in busy or is_locked(path),
+    )
+
 def is_locked(path):
-    return os.path.exists(path + ".lock")
+    return is_held(path + LOCK_SUFFIX)
 
-def create_lock(path):
-    with open(path + ".lock", "w") as f:
-        f.write("locked")
+def render_lock(path):
+    """Lease of the file while it is rendered, released if its process dies.
+
+    Renders of the file share it, an upload replacing the file takes it alone.
+    """
+    return share(path + LOCK_SUFFIX, name="render")
+
+# --- render jobs ---
+
+device_scheduler = DeviceScheduler(
+    inventory_from_env(app.config["RENDER_DEVICES"], cpu_slot=app.config["RENDER_CPU_SLOT"]),
+    lease_dir=app.config["LEASE_DIR"],
+)
+logger.info(f"Render device slots: {', '.join(s.name for s in device_scheduler.slots)}")
+
+# One warm worker per device slot, started with that slot's device environment
+warm_pools = {}
+if app.config["RENDER_WARM_WORKERS"]:
+    for slot in device_scheduler.slots:
+        server_args = ["--device-type", app.config["CYCLES_DEVICE_TYPE"], "--device", slot.cycles_device]
+        if slot.devices is not None:
+            server_args.append("--no-cpu")
+        warm_pools[slot.name] = WarmWorkerPool(
+            app.config["BLENDER_BIN"],
+            max_jobs=app.config["WARM_WORKER_MAX_JOBS"],
+            max_rss_mb=app.config["WARM_WORKER_MAX_RSS_MB"],
+            server_args=server_args,
+            env=slot.environ(),
+        )
+        atexit.register(warm_pools[slot.name].shutdown)
 
-def remove_lock(path):
+backend = BlenderBackend(
+    app.config["BLENDER_BIN"],
+    compute_device_type=app.config["CYCLES_DEVICE_TYPE"],
+    pools=warm_pools,
+    timeout=app.config["RENDER_TIMEOUT"],
+)
+
+render_cache = None
+if app.config["RENDER_CACHE_MB"] > 0:
+    render_cache = RenderCache(app.config["RENDER_CACHE_DIR"], app.config["RENDER_CACHE_MB"] * 1024 * 1024)
+
+job_logs = JobLogs(app.config["JOB_LOG_DIR"], keep=app.config["JOB_LOG_KEEP"])
+
+# In coordinator mode the queue's jobs are rendered by farm workers
+farm = None
+if app.config["FARM_MODE"] == "coordinator":
+    if not app.config["FARM_TOKEN"]:
+        raise RuntimeError("FARM_TOKEN must be set in coordinator mode")
+    farm = Farm(
+        os.path.join(app.config["WORKDIR"], "output"),
+        worker_timeout=app.config["FARM_WORKER_TIMEOUT"],
+        max_attempts=app.config["FARM_MAX_ATTEMPTS"],
+    )
+    logger.info("Farm mode: jobs are rendered by the farm workers")
+
+def render_cache_key(job):
+    """Cache key of ``job``: .blend content, effective settings and Blender version."""
+    return cache_key(
+        file_digest(job.blend_path),
+        job.settings,
+        blender_version(app.config["BLENDER_BIN"]),
+        device_type=app.config["CYCLES_DEVICE_TYPE"],
+        scene=job.estimate,
+    )
+
+def serve_from_cache(job):
+    """Restore the outputs of an identical earlier render, returns True on a hit."""
+    if render_cache is None:
+        return False
     try:
-        os.remove(path + ".lock")
-    except FileNotFoundError:
-        pass
+        job.cache_key = render_cache_key(job)
+    except OSError as e:
+        logger.warning(f"Render cache skipped for {job.filename}: {e}")
+        return False
+    outputs = render_cache.lookup(job.cache_key, job.output_base)
+    if outputs is None:
+        return False
+    if job.settings.get("animation"):
+        retarget_manifest(job)
+    job.outputs = outputs
+    job.cached = True
+    output_catalog.add(outputs)
+    logger.info(f"Render of {job.filename} served from the render cache")
+    return True
 
-@contextmanager
-def render_lock(path):
-    if is_locked(path):
-        raise RuntimeError("File is currently being rendered.")
-    create_lock(path)
+def run_render_job(job):
+    metrics.QUEUE_WAIT_SECONDS.observe(job.started_at - job.created_at)
+    # Render the file once its pending Drive download, if any, is complete
+    download = drive_downloads.wait(job.filename, cancel_event=job.cancel_event)
+    if job.cancel_event.is_set():
+        raise JobCancelled()
+    if download is not None and download.state == DOWNLOAD_FAILED and not os.path.isfile(job.blend_path):
+        raise RenderError(f"Download from Drive failed: {download.error}")
+    # Jobs with a key already missed the cache when they were submitted
+    if job.cache_key is None and serve_from_cache(job):
+        return
+    kind = job_type(job)
+    mark_used(job.blend_path)
+    job.log = job_logs.open(job.id)
+    logger.info(f"Job {job.id}: Blender output in {job.log.path}")
+    started, outcome = time.perf_counter(), "failed"
     try:
-        yield
+        if farm is not None:
+            # No local lease: the workers render their copy of the file, fetched by its digest
+            farm.execute(job, file_digest(job.blend_path))
+            if kind == "animation":
+                # The worker's manifest names its own job and paths
+                retarget_manifest(job)
+        else:
+            with render_lock(job.blend_path):
+                render_job(
+                    backend, device_scheduler, job,
+                    retries=app.config["RENDER_CHUNK_RETRIES"],
+                    chunk_frames=app.config["RENDER_CHUNK_FRAMES"] or None,
+                )
+        outcome = "done"
+    except JobCancelled:
+        outcome = "cancelled"
+        raise
     finally:
-        remove_lock(path)
+        metrics.RENDER_SECONDS.observe(time.perf_counter() - started, type=kind, outcome=outcome)
+        job.log.close()
+    output_catalog.add(job.outputs)
+    if render_cache is not None and job.cache_key is not None:
+        try:
+            render_cache.store(job.cache_key, job.output_base, job.outputs)
+        except OSError as e:
+            logger.warning(f"Could not store {job.filename} in the render cache: {e}")
+    # Drive downloads grow the uploads too
+    trim_uploads()
+
+# State of the jobs for the other processes of the app (gunicorn workers)
+job_snapshots = JobSnapshots(app.config["JOB_STATE_DIR"], keep=app.config["JOB_STATE_KEEP"])
+snapshot_thread = None
+
+def snapshot_job(job):
+    # Called by the queue on each state change, with its lock held
+    global snapshot_thread
+    job_snapshots.save(job)
+    if snapshot_thread is None:
+        snapshot_thread = threading.Thread(target=sync_job_snapshots, name="job-snapshots", daemon=True)
+        snapshot_thread.start()
+
+def sync_job_snapshots(interval=1.0):
+    """Publish the progress of this process's jobs and apply cancellations asked elsewhere."""
+    saved, last_prune = {}, 0.0
+    while True:
+        time.sleep(interval)
+        try:
+            for job in render_queue.jobs():
+                if job.finished:
+                    saved.pop(job.id, None)
+                    continue
+                if job_snapshots.take_cancel(job.id):
+                    render_queue.cancel(job.id)
+                updated = (job.progress or {}).get("updated_at")
+                if updated is not None and saved.get(job.id) != updated:
+                    job_snapshots.save(job)
+                    saved[job.id] = updated
+            if time.time() - last_prune > 60:
+                job_snapshots.prune()
+                last_prune = time.time()
+        except Exception as e:
+            logger.error(f"Could not sync the job snapshots: {e}")
+
+render_queue = RenderQueue(
+    run_render_job,
+    workers=app.config["RENDER_WORKERS"] or (app.config["FARM_MAX_JOBS"] if farm else len(device_scheduler.slots)),
+    on_finish=lambda job: metrics.RENDER_JOBS.inc(outcome="cached" if job.cached else job.state),
+    on_change=snapshot_job,
+)
+
+# Values kept by the components themselves, read when /metrics is scraped
+metrics.PROCESSES.interval = app.config["METRICS_SAMPLE_INTERVAL"]
+if render_cache is not None:
+    metrics.REGISTRY.collected(
+        "render_cache_lookups", "Render cache lookups by result", "counter",
+        lambda: {("hit",): render_cache.stats["hits"], ("miss",): render_cache.stats["misses"]}, labels=("result",))
+    metrics.REGISTRY.collected(
+        "render_cache_evictions", "Render cache entries evicted", "counter",
+        lambda: {(): render_cache.stats["evictions"]})
+    metrics.REGISTRY.collected(
+        "render_cache_bytes", "Size of the render cache", "gauge",
+        lambda: {(): render_cache.status()["bytes"]})
+metrics.REGISTRY.collected(
+    "render_jobs_active", "Render jobs queued or running", "gauge",
+    lambda: {(state,): sum(1 for j in render_queue.jobs() if j.state == state) for state in ("queued", "running")},
+    labels=("state",))
+metrics.REGISTRY.collected(
+    "drive_downloads", "Drive downloads by state", "gauge",
+    lambda: _count_states(drive_downloads.status()), labels=("state",))
+metrics.REGISTRY.collected(
+    "drive_catalog_refresh_errors", "Failed Drive catalog refreshes", "counter",
+    lambda: {(): drive_catalog.stats["errors"]})
+
+def _count_states(items):
+    counts = {}
+    for item in items:
+        counts[(item["state"],)] = counts.get((item["state"],), 0) + 1
+    return counts
+
+def wants_json():
+    return request.accept_mimetypes.best == "application/json"
+
+def render_settings(args):
+    """Render settings from query arguments, raises ValueError when invalid."""
+    settings = {"device": args.get("device", GPU)}
+    if settings["device"] not in (GPU, CPU, ANY):
+        raise ValueError(f"Unknown device: {settings['device']}")
+    quality = args.get("quality", FINAL)
+    if quality not in (DRAFT, FINAL):
+        raise ValueError(f"Unknown quality: {quality}")
+    if quality != FINAL:
+        # Only set when not final, so final renders keep their cache keys
+        settings["quality"] = quality
+    frame_args = {"start": "frame_start", "end": "frame_end", "step": "frame_step"}
+    if args.get("animation") or any(a in args for a in frame_args):
+        settings["animation"] = True
+        for arg, key in frame_args.items():
+            if arg in args:
+                try:
+                    settings[key] = int(args[arg])
+                except ValueError:
+                    raise ValueError(f"Invalid {arg} frame: {args[arg]}")
+        if settings.get("frame_step", 1) < 1:
+            raise ValueError("Frame step must be at least 1")
+    else:
+        if "frame" in args:
+            try:
+                settings["frame"] = int(args["frame"])
+            except ValueError:
+                raise ValueError(f"Invalid frame: {args['frame']}")
+        if args.get("tiles"):
+            settings["tiles"] = parse_tiles(args["tiles"])
+    return settings
+
+def estimate_job(blend_path, settings):
+    """Size and cost of a job read from its .blend file, without starting Blender.
+
+    Raises ValueError for jobs that cannot or should not run. Returns None
+    when the file cannot be parsed, Blender then gets the final word.
+    """
+    try:
+        info = blend_info(blend_path)
+    except (BlendReadError, OSError) as e:
+        logger.warning(f"Could not read scene settings of {blend_path}: {e}")
+        return None
+    scene = info["scene"]
+    if scene is None:
+        raise ValueError("The .blend file has no scene to render.")
+
+    frames = 1
+    if settings.get("animation"):
+        start = settings.get("frame_start", scene["frame_start"])
+        end = settings.get("frame_end", scene["frame_end"])
+        step = settings.get("frame_step", scene["frame_step"] or 1)
+        if end < start:
+            raise ValueError(f"Frame range end {end} is before its start {start}")
+        frames = len(range(start, end + 1, step))
+        if frames > app.config["MAX_RENDER_FRAMES"]:
+            raise ValueError(f"{frames} frames requested, the limit is {app.config['MAX_RENDER_FRAMES']}")
+
+    estimate = estimate_render(quality_scene(scene, settings.get("quality")), frames)
+    width, height = estimate["width"], estimate["height"]
+    limit = app.config["MAX_RENDER_RESOLUTION"]
+    if width < 1 or height < 1:
+        raise ValueError(f"Scene {scene['name']} has an empty output resolution")
+    if width > limit or height > limit:
+        raise ValueError(f"Output resolution {width}x{height} exceeds the limit of {limit} pixels per side")
+    if settings.get("tiles"):
+        cols, rows = settings["tiles"]
+        if cols > width or rows > height:
+            raise ValueError(f"Cannot split a {width}x{height} image into {cols}x{rows} tiles")
+    estimate["scene"] = scene["name"]
+    estimate["engine"] = scene["engine"]
+    return estimate
 
 # --- routes ---
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
-    print(f"Login route called - Method: {request.method}")
-    
     if request.method == "POST":
         token = request.form.get("token")
-        expected_token = app.config["AUTH_TOKEN"]        
-        print(f"Token received: '{token}'")
-        print(f"Expected token: '{expected_token}'")
-        print(f"Tokens match: {token == expected_token}")
-        
-        if token == expected_token:
+        if token is not None and secrets.compare_digest(token.encode(), app.config["AUTH_TOKEN"].encode()):
             session["authenticated"] = True
-            print("Login successful - session set")
             next_url = request.args.get("next") or url_for("index")
-            print(f"Redirecting to: {next_url}")
+            logger.info(f"Login from {request.remote_addr}")
             return redirect(next_url)
         else:
-            print("Login failed - invalid token")
+            logger.warning(f"Failed login from {request.remote_addr}")
             return render_template("login.html", error="Invalid token")
-    
-    print("Showing login form")
+
     return render_template("login.html")
 
 @app.route("/logout")
@@ -247,35 +637,49 @@ def upload():
     filename = secure_filename(f.filename)
     blend_path = os.path.join(upload_dir, filename)
 
-    if is_locked(blend_path):
+    lease = try_acquire(blend_path + LOCK_SUFFIX, name="upload")
+    if lease is None:
         return render_index(error="File is currently being rendered.")
+    with lease:
+        # Header, size and scripts were checked while the file was received
+        ingest = f.stream
+        is_valid, message = ingest.check()
+        metrics.UPLOAD_SCAN_SECONDS.observe(ingest.scan_seconds)
+        metrics.UPLOAD_BYTES.inc(ingest.size)
+        if not is_valid:
+            metrics.UPLOADS.inc(result="rejected")
+            logger.warning(f"Upload of {filename} refused: {message}")
+            return render_index(error=message)
+        metrics.UPLOADS.inc(result="accepted")
 
-    f.save(blend_path)
-    
-    # Valider le fichier .blend
-    is_valid, message = validate_blend_file(blend_path)
-    if not is_valid:
-        os.remove(blend_path)  # Supprimer le fichier invalide
-        return render_index(error=f"Invalid file: {message}")
-    
-    # Scanner pour des scripts suspects
-    has_scripts, script_message = scan_blend_for_scripts(blend_path)
-    if has_scripts:
-        os.remove(blend_path)  # Supprimer le fichier suspect
-        logger.warning(f"Suspicious file uploaded: {filename} - {script_message}")
-        return render_index(error=f"File rejected: {script_message}")
-    
-    logger.info(f"Saved and validated uploaded file: {blend_path}")
+        ingest.publish(blend_path)
+    logger.info(f"Saved and validated uploaded file: {blend_path} ({ingest.size} bytes, sha256 {ingest.sha256})")
+    trim_uploads(keep=blend_path)
     return render_index()
 
+@app.errorhandler(413)
+def request_too_large(e):
+    error = f"File too large (max {app.config['MAX_FILE_SIZE'] // (1024 * 1024)}MB)"
+    if wants_json() or "authenticated" not in session:
+        return jsonify(error=error), 413
+    return render_index(error=error), 413
+
 @app.route("/refresh_gdrive")
 @require_auth
 def refresh_gdrive():
+    drive_catalog.refresh()
     return render_index()
 
-@app.route("/render_gdrive/<filename>")
-@require_auth
-def render_gdrive(filename):
+# Suffix of the output base of draft renders
+DRAFT_SUFFIX = "_draft"
+
+def build_job(filename, args, **job_args):
+    """A render job of ``filename`` with settings from ``args``, not queued yet.
+
+    ``args`` are the render query arguments (or a batch item). Raises
+    FileNotFoundError when the file is neither uploaded nor on Drive, and
+    ValueError for invalid or refused settings.
+    """
     upload_dir = os.path.join(app.config["WORKDIR"], "uploads")
     output_dir = os.path.join(app.config["WORKDIR"], "output")
     os.makedirs(output_dir, exist_ok=True)
@@ -283,95 +687,460 @@ def render_gdrive(filename):
     blend_path   = os.path.join(upload_dir, filename)
     base, _      = os.path.splitext(filename)
     output_base  = os.path.join(output_dir, base)
-    output_image = f"{output_base}0001.png"
 
-    if not os.path.isfile(blend_path):
+    if drive_catalog.find(filename) is None and not os.path.isfile(blend_path):
         logger.error(f"File not found: {blend_path}")
-        return render_index(error="File not found in uploads.")
+        raise FileNotFoundError("File not found in uploads.")
+
+    settings = render_settings(args)
+    if settings.get("quality") == DRAFT:
+        # Drafts never overwrite the full-quality outputs
+        output_base += DRAFT_SUFFIX
+    try:
+        estimate = estimate_job(blend_path, settings)
+    except ValueError as e:
+        logger.warning(f"Refused render of {filename}: {e}")
+        raise
+    if estimate and "device" not in args and estimate["cost"] <= app.config["RENDER_CPU_MAX_COST"]:
+        settings["device"] = ANY
+
+    job = RenderJob(filename, blend_path, output_base, settings=settings, **job_args)
+    job.estimate = estimate
+    return job
+
+def start_download(job):
+    """Request the Drive download of the job's file, then look the job up in the render cache.
+
+    Returns True when the outputs were restored from the cache.
+    """
+    drive_file = drive_catalog.find(job.filename)
+    if drive_file is not None:
+        # No-op when the local copy is current, the job waits for it otherwise
+        drive_downloads.request(drive_file)
+    download = drive_downloads.get(job.filename)
+    return (download is None or download.finished) and serve_from_cache(job)
+
+def build_preview(filename, args):
+    """Draft of a progressive render: the same frames at draft quality, untiled."""
+    args = {k: v for k, v in args.items() if k != "tiles"}
+    return build_job(filename, dict(args, quality=DRAFT), priority=PRIORITY_PREVIEW)
+
+@app.route("/render_gdrive/<filename>")
+@require_auth
+def render_gdrive(filename):
+    """Queue a render of ``filename``.
 
+    With ``?progressive=1`` a draft is rendered first, its outputs are
+    listed in the job's ``preview`` and the full render follows; rendering
+    the same frames of the file again, at either quality, cancels both.
+    """
+    progressive = request.args.get("progressive") and request.args.get("quality", FINAL) == FINAL
     try:
-        with render_lock(blend_path):
-            logger.info(f"Rendering file: {blend_path}")
-            result = subprocess.run(
-                [
-                    "blender", "-b", blend_path,
-                    "--disable-autoexec",  # Désactive l'auto-exécution des scripts
-                    "--python-expr",
-                    (
-                        "import bpy;"
-                        "bpy.context.scene.render.engine='CYCLES';"
-                        "bpy.context.scene.cycles.device='GPU';"
-                        "prefs=bpy.context.preferences.addons['cycles'].preferences;"
-                        "prefs.compute_device_type='CUDA';"
-                        "prefs.get_devices();"
-                        "[setattr(d, 'use', True) for d in prefs.devices];"
-                    ),
-                    "-o", output_base,
-                    "-f", "1"
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                timeout=300  # Timeout de 5 minutes
-            )
-
-            logger.info(f"Blender output:\n{result.stdout}")
-
-            if result.returncode != 0:
-                errors = "\n".join([line for line in result.stdout.splitlines() if "Error:" in line]) or "Render failed. See logs for details."
-                logger.error(errors)
-                return render_index(error=errors)
-
-            if os.path.isfile(output_image):
-                logger.info(f"Render succeeded: {output_image}")
-                return render_index(job=base)
-            else:
-                logger.error("Render succeeded but output image not found.")
-                return render_index(error="Render succeeded but output image not found.")
-    except RuntimeError as e:
+        job = build_job(filename, request.args)
+        preview = build_preview(filename, request.args) if progressive else None
+    except FileNotFoundError as e:
+        if wants_json():
+            return jsonify(error=str(e)), 404
+        return render_index(error=str(e))
+    except ValueError as e:
+        if wants_json():
+            return jsonify(error=str(e)), 400
         return render_index(error=str(e))
 
+    if start_download(job):
+        # Identical render done before: no queueing, no device slot
+        job = render_queue.add_finished(job)
+        if wants_json():
+            return jsonify(job.to_dict()), 200
+        return render_index(job=job)
+    if preview is not None:
+        start_download(preview)
+    job = render_queue.submit(job, preview=preview)
+    if wants_json():
+        return jsonify(job.to_dict()), 202
+    return render_index(job=job)
+
+# Keys of a batch item that are render settings, as in the query arguments of /render_gdrive
+BATCH_SETTINGS = ("frame", "animation", "start", "end", "step", "tiles", "device", "quality")
+
+def parse_deadline(value):
+    """UNIX timestamp of a deadline given as a timestamp or an ISO 8601 date."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        deadline = float(value)
+    else:
+        try:
+            deadline = datetime.fromisoformat(str(value)).timestamp()
+        except ValueError:
+            raise ValueError(f"Invalid deadline: {value}")
+    if deadline <= time.time():
+        raise ValueError(f"Deadline {value} has already passed")
+    return deadline
+
+def batch_job(item, defaults):
+    """Job of one batch item, raises FileNotFoundError or ValueError."""
+    if not isinstance(item, dict) or not isinstance(item.get("filename"), str):
+        raise ValueError("Each job needs a filename")
+    filename = secure_filename(item["filename"])
+    if not filename:
+        raise ValueError(f"Invalid filename: {item['filename']}")
+    priority = item.get("priority", defaults.get("priority", PRIORITY_BATCH))
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        raise ValueError(f"Invalid priority: {priority}")
+    key = item.get("idempotency_key")
+    # Query arguments are strings, and absent rather than false
+    args = {k: str(item[k]) for k in BATCH_SETTINGS if item.get(k) not in (None, False)}
+    return build_job(
+        filename, args,
+        priority=priority,
+        idempotency_key=str(key) if key is not None else None,
+        deadline=parse_deadline(item.get("deadline", defaults.get("deadline"))),
+    )
+
+@app.route("/render_batch", methods=["POST"])
+@require_auth
+def render_batch():
+    """Queue several renders in one call.
+
+    The JSON body is ``{"jobs": [{"filename": ..., "frame": ..., ...}],
+    "priority": ..., "deadline": ...}``; items take the settings of the
+    /render_gdrive query arguments and may override the batch's priority
+    and deadline or carry their own idempotency key. A request repeated
+    with the same ``Idempotency-Key`` header returns the first batch.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("jobs"), list) or not body["jobs"]:
+        return jsonify(error="Expected a JSON object with a non-empty jobs list"), 400
+    if len(body["jobs"]) > app.config["MAX_BATCH_JOBS"]:
+        return jsonify(error=f"At most {app.config['MAX_BATCH_JOBS']} jobs per batch"), 400
+    key = request.headers.get("Idempotency-Key") or body.get("idempotency_key")
+    batch = render_queue.batch_for_key(key) if key else None
+    if batch is not None:
+        return jsonify(render_queue.batch_status(batch)), 200
+    # Submitted to another process
+    batch_id = job_snapshots.batch_for_key(key) if key else None
+    status = job_snapshots.batch_status(batch_id) if batch_id else None
+    if status is not None:
+        return jsonify(status), 200
+
+    jobs = []
+    for i, item in enumerate(body["jobs"]):
+        try:
+            jobs.append(batch_job(item, body))
+        except FileNotFoundError as e:
+            return jsonify(error=f"Job {i} ({item.get('filename')}): {e}", index=i), 404
+        except ValueError as e:
+            return jsonify(error=f"Job {i}: {e}", index=i), 400
+    for job in jobs:
+        start_download(job)
+    batch, created = render_queue.submit_batch(jobs, idempotency_key=key)
+    if created:
+        job_snapshots.save_batch(batch)
+    return jsonify(render_queue.batch_status(batch)), 202 if created else 200
+
+def find_batch_status(batch_id):
+    """Status of a batch of this process, or of another one from the snapshots."""
+    batch = render_queue.batch(batch_id)
+    if batch is not None:
+        return render_queue.batch_status(batch)
+    return job_snapshots.batch_status(batch_id)
+
+@app.route("/batches/<batch_id>")
+@require_auth
+def batch_status(batch_id):
+    status = find_batch_status(batch_id)
+    if status is None:
+        return jsonify(error="Unknown batch"), 404
+    return jsonify(status)
+
+@app.route("/batches/<batch_id>/cancel", methods=["POST"])
+@require_auth
+def cancel_batch(batch_id):
+    status = find_batch_status(batch_id)
+    if status is None:
+        return jsonify(error="Unknown batch"), 404
+    for job in status["jobs"]:
+        cancel_any_job(job["id"])
+    return jsonify(find_batch_status(batch_id))
+
+@app.route("/blend_info/<filename>")
+@require_auth
+def blend_file_info(filename):
+    blend_path = os.path.join(app.config["WORKDIR"], "uploads", filename)
+    if not os.path.isfile(blend_path):
+        return jsonify(error="File not found in uploads."), 404
+    try:
+        info = blend_info(blend_path)
+    except BlendReadError as e:
+        return jsonify(error=str(e)), 422
+    estimate = estimate_render(info["scene"]) if info["scene"] else None
+    return jsonify(dict(info, estimate=estimate))
+
+@app.route("/downloads")
+@require_auth
+def downloads():
+    return jsonify(downloads=drive_downloads.status())
+
+@app.route("/jobs")
+@require_auth
+def list_jobs():
+    jobs = [job.to_dict() for job in render_queue.jobs()]
+    known = {job["id"] for job in jobs}
+    # Jobs of the other processes
+    jobs += [job for job in job_snapshots.recent(app.config["JOB_STATE_KEEP"]) if job["id"] not in known]
+    return jsonify(jobs=sorted(jobs, key=lambda job: job["created_at"]))
+
+def find_job(job_id):
+    """Dict of a job of this process, or of another one from its snapshot."""
+    job = render_queue.get(job_id)
+    return job.to_dict() if job is not None else job_snapshots.load(job_id)
+
+def cancel_any_job(job_id):
+    """Cancel a job of this process, or ask the process running it; returns its dict."""
+    job = render_queue.cancel(job_id)
+    if job is not None:
+        return job.to_dict()
+    job = job_snapshots.load(job_id)
+    if job is not None and job["state"] not in FINAL_STATES:
+        job_snapshots.request_cancel(job_id)
+    return job
+
+@app.route("/jobs/<job_id>")
+@require_auth
+def job_status(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/events")
+@require_auth
+def job_events(job_id):
+    """Server-Sent Events: the job's state changes and render progress."""
+    job = render_queue.get(job_id)
+    if job is None:
+        if job_snapshots.load(job_id) is None:
+            return jsonify(error="Unknown job"), 404
+        # Rendered by another process: follow its snapshot
+        stream = job_snapshots.follow(job_id, heartbeat=app.config["SSE_HEARTBEAT"])
+        return Response(stream, mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    last_id = request.headers.get("Last-Event-ID", request.args.get("last_event_id"))
+    try:
+        last_id = int(last_id) if last_id is not None else None
+    except ValueError:
+        last_id = None
+    stream = event_stream(job.events, snapshot=job.to_dict(), last_id=last_id,
+                          heartbeat=app.config["SSE_HEARTBEAT"])
+    return Response(stream, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/render_cache")
+@require_auth
+def render_cache_status():
+    if render_cache is None:
+        return jsonify(enabled=False)
+    return jsonify(dict(render_cache.status(), enabled=True))
+
+@app.route("/devices")
+@require_auth
+def devices():
+    return jsonify(slots=device_scheduler.status())
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+@require_auth
+def cancel_job(job_id):
+    job = cancel_any_job(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(job)
+
 @app.route("/output/<filename>")
 @require_auth
 def download(filename):
     output_dir = os.path.join(app.config["WORKDIR"], "output")
     logger.info(f"Download requested: {filename}")
+    output_catalog.touch(filename)
     return send_from_directory(output_dir, filename, as_attachment=True)
 
+@app.route("/thumbnails/<filename>")
+@require_auth
+def thumbnail(filename):
+    """Thumbnail of a rendered image, the image itself until its thumbnail is made."""
+    path = output_catalog.thumbnail_path(filename)
+    if path is None:
+        return send_from_directory(os.path.join(app.config["WORKDIR"], "output"), filename)
+    return send_from_directory(app.config["THUMBNAIL_DIR"], os.path.basename(path), max_age=86400)
+
+@app.route("/outputs")
+@require_auth
+def list_outputs():
+    """A page of the rendered images, newest first: ``?offset=`` and ``?limit=``."""
+    try:
+        offset = max(0, int(request.args.get("offset", 0)))
+        limit = min(max(1, int(request.args.get("limit", app.config["OUTPUT_PAGE_SIZE"]))), 500)
+    except ValueError:
+        return jsonify(error="offset and limit must be integers"), 400
+    images, total = get_rendered_images(offset, limit)
+    return jsonify(outputs=images, total=total, offset=offset, limit=limit)
+
+def log_response(path):
+    """The end of a log file as text, or with ``?cursor=`` what was added since.
+
+    JSON requests get ``{"text": ..., "cursor": ...}``; passing the cursor
+    back returns only the lines written in between.
+    """
+    cursor = request.args.get("cursor")
+    if cursor is None and not wants_json():
+        return tail_lines(path, app.config["LOG_TAIL_LINES"]), 200, {"Content-Type": "text/plain"}
+    text, cursor = read_since(path, cursor, initial_lines=app.config["LOG_TAIL_LINES"])
+    return jsonify(text=text, cursor=cursor)
+
 @app.route("/debug_log")
 @require_auth
 def debug_log():
     try:
-        with open(app.config["LOG_PATH"], "r") as f:
-            lines = f.readlines()
-        return "".join(lines[-300:]), 200, {"Content-Type": "text/plain"}
+        return log_response(app.config["LOG_PATH"])
     except Exception as e:
         return f"Error reading log: {e}", 500, {"Content-Type": "text/plain"}
 
+@app.route("/jobs/<job_id>/log")
+@require_auth
+def job_log(job_id):
+    """Blender's output for one job, same cursor protocol as /debug_log."""
+    path = job_logs.find(secure_filename(job_id))
+    if path is None:
+        if find_job(job_id) is None:
+            return jsonify(error="Unknown job"), 404
+        return jsonify(error="No log for this job yet"), 404
+    try:
+        return log_response(path)
+    except FileNotFoundError:
+        # Compressed in between
+        return log_response(path + GZIP_SUFFIX)
+
 @app.route("/blender_processes")
 @require_auth
 def blender_processes():
+    # Only the processes started by this app, as last sampled in the background
+    output = []
+    for p in metrics.PROCESSES.snapshot():
+        output.append(
+            f"PID: {p['pid']}, Kind: {p['kind']}, CPU: {p['cpu_percent']:.1f}%, "
+            f"Mem: {p['rss'] // (1024 * 1024)} MiB, Threads: {p['threads']}, "
+            f"Up: {int(time.time() - p['started_at'])}s, Cmd: {p['cmdline']}"
+        )
+    if not output:
+        output.append("No Blender processes running.")
+    return "\n".join(output), 200, {"Content-Type": "text/plain"}
+
+# --- render farm ---
+
+def require_farm_worker(f):
+    """Farm worker endpoints: coordinator mode and ``Authorization: Bearer FARM_TOKEN``."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if farm is None:
+            return jsonify(error="Not a farm coordinator"), 404
+        if not bearer_matches(app.config["FARM_TOKEN"]):
+            return jsonify(error="Unauthorized"), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+def worker_args(body):
+    """Worker identity sent with each farm request."""
+    worker_id = body.get("worker")
+    if not isinstance(worker_id, str) or not worker_id:
+        raise ValueError("Missing worker id")
+    return worker_id, str(body.get("name") or worker_id), int(body.get("slots") or 1)
+
+@app.route("/farm/lease", methods=["POST"])
+@csrf.exempt
+@require_farm_worker
+def farm_lease():
+    """Next task for a worker, waiting up to ``wait`` seconds; 204 when there is none."""
+    body = request.get_json(silent=True) or {}
     try:
-        output = []
-        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_info', 'cmdline', 'username']):
-            try:
-                # Check if process is blender (by name or command line)
-                if 'blender' in (proc.info['name'] or '').lower() or \
-                   any('blender' in (arg or '').lower() for arg in (proc.info.get('cmdline') or [])):
-                    mem_mb = proc.info['memory_info'].rss // (1024 * 1024)
-                    cmdline = proc.info.get('cmdline') or []
-                    output.append(
-                        f"PID: {proc.info['pid']}, User: {proc.info['username']}, "
-                        f"CPU: {proc.info['cpu_percent']}%, Mem: {mem_mb} MiB, "
-                        f"Cmd: {' '.join(cmdline)}"
-                    )
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
-        if not output:
-            output.append("No Blender processes found.")
-        return "\n".join(output), 200, {"Content-Type": "text/plain"}
-    except Exception as e:
-        return f"Error listing Blender processes: {e}", 500, {"Content-Type": "text/plain"}
+        worker_id, name, slots = worker_args(body)
+        wait = min(float(body.get("wait", 0)), 60)
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    task = farm.lease(worker_id, name, slots, wait=wait)
+    if task is None:
+        return "", 204
+    return jsonify(task)
+
+@app.route("/farm/heartbeat", methods=["POST"])
+@csrf.exempt
+@require_farm_worker
+def farm_heartbeat():
+    body = request.get_json(silent=True) or {}
+    try:
+        worker_id, name, slots = worker_args(body)
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    running = body.get("running") if isinstance(body.get("running"), dict) else {}
+    return jsonify(cancel=farm.heartbeat(worker_id, name, slots, running))
+
+@app.route("/farm/blobs/<blob>")
+@require_farm_worker
+def farm_blob(blob):
+    """Content of a task's .blend file, by SHA-256."""
+    path = farm.blob_path(blob)
+    if path is None:
+        return jsonify(error="Unknown blob"), 404
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), mimetype="application/octet-stream")
+
+@app.route("/farm/tasks/<task_id>/outputs/<name>", methods=["PUT"])
+@csrf.exempt
+@require_farm_worker
+def farm_output(task_id, name):
+    # Outputs are not uploads: the upload size limit does not apply
+    request.max_content_length = None
+    try:
+        attempt = int(request.args.get("attempt", ""))
+        farm.write_output(task_id, request.args.get("worker"), attempt, secure_filename(name), request.stream)
+    except ValueError:
+        return jsonify(error="Missing attempt"), 400
+    except FarmError as e:
+        return jsonify(error=str(e)), 409
+    return "", 204
+
+@app.route("/farm/tasks/<task_id>/complete", methods=["POST"])
+@csrf.exempt
+@require_farm_worker
+def farm_complete(task_id):
+    body = request.get_json(silent=True) or {}
+    outputs = [secure_filename(str(n)) for n in body.get("outputs") or []]
+    try:
+        farm.complete(task_id, body.get("worker"), body.get("attempt"), body.get("state"),
+                      error=body.get("error"), outputs=outputs)
+    except FarmError as e:
+        return jsonify(error=str(e)), 409
+    return "", 204
+
+@app.route("/farm")
+def farm_status():
+    """Workers and tasks of the farm, for a logged-in session or a farm worker."""
+    if 'authenticated' not in session and not bearer_matches(app.config["FARM_TOKEN"]):
+        return jsonify(error="Unauthorized"), 401
+    if farm is None:
+        return jsonify(enabled=False)
+    return jsonify(dict(farm.status(), enabled=True))
+
+def bearer_matches(token):
+    """Whether the request carries ``Authorization: Bearer <token>``."""
+    authorization = request.headers.get("Authorization", "")
+    bearer = authorization[7:] if authorization.startswith("Bearer ") else None
+    return bool(token and bearer and secrets.compare_digest(bearer.encode(), token.encode()))
+
+@app.route("/metrics")
+def metrics_page():
+    """Prometheus metrics, for a logged-in session or ``Authorization: Bearer METRICS_TOKEN``."""
+    if 'authenticated' not in session and not bearer_matches(app.config["METRICS_TOKEN"]):
+        return jsonify(error="Unauthorized"), 401
+    return metrics.REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
 @app.template_filter("datetimeformat")
 def datetimeformat(value):
@@ -381,18 +1150,11 @@ def datetimeformat(value):
     except Exception:
         return value
 
-def cleanup_locks():
-    uploads_dir = os.path.join(app.config["WORKDIR"], "uploads")
-    for f in os.listdir(uploads_dir):
-        if f.endswith(".lock"):
-            lock_path = os.path.join(uploads_dir, f)
-            try:
-                os.remove(lock_path)
-                logger.info(f"Removed stale lock: {lock_path}")
-            except Exception as e:
-                logger.warning(f"Could not remove lock {lock_path}: {e}")
-
 if __name__ == "__main__":
-    cleanup_locks()
+    # Under gunicorn, gunicorn.conf.py does this once before starting the workers
+    reclaim(os.path.join(app.config["WORKDIR"], "uploads"))
+    reclaim(app.config["LEASE_DIR"])
+    remove_stale_uploads(os.path.join(app.config["WORKDIR"], "uploads"))
+    remove_partial_downloads(os.path.join(app.config["WORKDIR"], "uploads"))
     logger.info("Starting Flask app...")
     app.run(host="0.0.0.0", port=80, debug=True)  # Debug désactivé pour la sécurité
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Measures request latency while other threads log heavily.
+
+A minimal Flask route logging a few lines, like the login route, is timed
+through the test client while ``--noise-threads`` threads log Blender-like
+lines at ``--noise-rate`` lines per second in total (a chatty render
+inlined in the shared log). The handlers are those of the app: a ``RotatingFileHandler`` and a stream
+handler, whose stream waits ``--sink-delay-us`` per write to stand for a
+terminal or a container log driver.
+
+* ``direct``: the handlers on the root logger, written from each thread
+* ``queued``: through ``log_pipeline`` (bounded queue, background writer)
+
+Each mode runs in a fresh interpreter.
+
+    python bench_logging.py --requests 2000 --noise-rate 20000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+BLENDER_LINE = "Fra:1 Mem:512.00M (Peak 1024.00M) | Time:00:12.34 | Remaining:00:45.67 | Mem:256.00M, Peak:512.00M | Scene, ViewLayer | Sample 64/128 " + "x" * 60
+
+
+class SlowStream:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def child(mode, requests, noise_threads, noise_rate, sink_delay, queue_size):
+    import logging
+    import threading
+    from logging.handlers import RotatingFileHandler
+    from flask import Flask
+
+    sys.path.insert(0, API_DIR)
+    directory = tempfile.mkdtemp(prefix="bench-logging-")
+    formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    file_handler = RotatingFileHandler(os.path.join(directory, "debug.log"), maxBytes=5 * 1024 * 1024, backupCount=3)
+    stream_handler = logging.StreamHandler(SlowStream(sink_delay))
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    dropped = lambda: 0
+    if mode == "queued":
+        import log_pipeline
+        log_pipeline.install(file_handler, stream_handler, queue_size=queue_size)
+        handler = next(h for h in logging.getLogger().handlers if isinstance(h, log_pipeline.DroppingQueueHandler))
+        dropped = lambda: handler.dropped
+    else:
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(file_handler)
+        root.addHandler(stream_handler)
+
+    logger = logging.getLogger("bench")
+    app = Flask(__name__)
+
+    @app.route("/")
+    def index():
+        logger.info("Login from 127.0.0.1")
+        logger.info("Redirecting to /")
+        return "ok"
+
+    stop = threading.Event()
+    noise = [0] * noise_threads
+
+    def chatter(i):
+        blender = logging.getLogger(f"blender.{i}")
+        rate = noise_rate / noise_threads
+        begin = time.perf_counter()
+        while not stop.is_set():
+            # Catch up with the target rate, then wait for the next millisecond
+            while noise[i] < (time.perf_counter() - begin) * rate and not stop.is_set():
+                blender.info(f"Blender[{i}]: {BLENDER_LINE}")
+                noise[i] += 1
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=chatter, args=(i,), daemon=True) for i in range(noise_threads)]
+    for t in threads:
+        t.start()
+    client = app.test_client()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        client.get("/")
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    print(json.dumps({
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "noise_per_s": sum(noise) / elapsed,
+        "dropped": dropped(),
+    }))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--noise-threads", type=int, default=4)
+    parser.add_argument("--noise-rate", type=float, default=5000, help="noise lines per second, all threads")
+    parser.add_argument("--sink-delay-us", type=float, default=50, help="time taken by each stream write")
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--child", choices=("direct", "queued"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.requests, args.noise_threads, args.noise_rate, args.sink_delay_us / 1e6, args.queue_size)
+        return
+
+    print(f"{'mode':<7} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7} {'noise lines/s':>14} {'dropped':>8}")
+    for mode in ("direct", "queued"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--requests", str(args.requests),
+             "--noise-threads", str(args.noise_threads), "--noise-rate", str(args.noise_rate),
+             "--sink-delay-us", str(args.sink_delay_us),
+             "--queue-size", str(args.queue_size)],
+            capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:<7} {r['p50_ms']:>7.2f} {r['p99_ms']:>7.2f} {r['max_ms']:>7.2f} "
+              f"{r['noise_per_s']:>14.0f} {r['dropped']:>8}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
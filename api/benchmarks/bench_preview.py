@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Measures the time to the first image of progressive renders.
+
+Starts the app with ``fake_blender.py`` (one device slot, ``--samples``
+samples per frame, ``--render`` seconds per full frame) and renders a frame
+``--runs`` times each way, reporting when the first image is available:
+
+* ``final``: a plain render, the first image is the full render
+* ``progressive``: ``?progressive=1``, the first image is the draft; the
+  full render after it is timed too
+
+    python bench_preview.py --runs 3 --render 4 --samples 128
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import statistics
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, BENCH_DIR)
+
+from farm_local import AUTH_TOKEN, Client, base_env, free_port, wait_for  # noqa: E402
+from synthetic_blend import write_blend_file  # noqa: E402
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+def render(client, path):
+    """Times of ``(first image, full render)`` of one render, in seconds."""
+    started = time.perf_counter()
+    job = client.json(path)
+    first = None
+    while job["state"] not in FINISHED:
+        time.sleep(0.02)
+        job = client.json(f"/jobs/{job['id']}")
+        preview = job.get("preview")
+        if first is None and preview and preview["state"] == "done":
+            first = time.perf_counter() - started
+    if job["state"] != "done":
+        raise RuntimeError(f"Render {job['id']} {job['state']}: {job.get('error')}")
+    total = time.perf_counter() - started
+    return first or total, total
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--render", type=float, default=4.0, help="fake render time of a full frame, seconds")
+    parser.add_argument("--samples", type=int, default=128, help="samples per full frame")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-preview-")
+    os.makedirs(os.path.join(workdir, "uploads"))
+    write_blend_file(os.path.join(workdir, "uploads", "scene.blend"))
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = base_env(WORKDIR=workdir, AUTH_TOKEN=AUTH_TOKEN, RENDER_CACHE_MB="0",
+                   FAKE_BLENDER_RENDER=str(args.render), FAKE_BLENDER_SAMPLES=str(args.samples),
+                   FAKE_BLENDER_STARTUP="0.1")
+    server = subprocess.Popen(
+        [sys.executable, "-c", f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(url)
+        client = Client(url)
+        print(f"{'mode':<12} {'first image':>12} {'full render':>12}")
+        results = {}
+        for mode, query in (("final", ""), ("progressive", "&progressive=1")):
+            times = [render(client, f"/render_gdrive/scene.blend?frame={run + 1}{query}") for run in range(args.runs)]
+            first = statistics.median(t[0] for t in times)
+            total = statistics.median(t[1] for t in times)
+            results[mode] = first
+            print(f"{mode:<12} {first:>11.2f}s {total:>11.2f}s")
+        print(f"first image {results['final'] / results['progressive']:.1f}x sooner")
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Measures the time-to-first-request of the Flask app and Drive client reuse.
+
+Each startup run is a fresh interpreter that imports ``app`` and answers
+one request through the test client; the time is measured from the
+launch of the process to the response.
+
+* ``lazy``: the app as it is, the Google libraries are imported on the
+  first Drive call
+* ``eager``: the Google libraries imported up front, as the app used to
+
+With ``--requests N`` it also starts a ``drive_stub`` and times N
+``files.get`` calls, through the per-thread service of ``drive_service``
+and through a service built for each call.
+
+    python bench_startup.py --runs 10 --requests 50
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+EAGER_IMPORTS = (
+    "import googleapiclient.discovery, googleapiclient.http, google.oauth2.service_account\n"
+)
+
+CHILD = """
+import sys
+{imports}
+from app import app
+response = app.test_client().get("/login")
+assert response.status_code == 200, response.status_code
+print("google loaded" if "googleapiclient" in sys.modules else "google not loaded")
+"""
+
+
+def first_request(mode):
+    env = dict(os.environ, AUTH_TOKEN=os.environ.get("AUTH_TOKEN", "benchmark"))
+    code = CHILD.format(imports=EAGER_IMPORTS if mode == "eager" else "")
+    started = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=API_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return time.perf_counter() - started, out.strip().splitlines()[-1]
+
+
+def client_reuse(count):
+    from drive_stub import DriveStub
+
+    stub = DriveStub()
+    file_id = stub.add_file("scene.blend", b"BLENDER-v300")["id"]
+    os.environ["GDRIVE_API_ENDPOINT"] = stub.start()
+    for name in [k for k in os.environ if k.startswith("GOOGLE_")]:
+        del os.environ[name]
+    import gdrive_manager
+
+    def per_call():
+        gdrive_manager._local.service = None
+        return gdrive_manager.drive_service()
+
+    results = {}
+    try:
+        for label, factory in (("per-thread", gdrive_manager.drive_service), ("per-call", per_call)):
+            started = time.perf_counter()
+            for _ in range(count):
+                factory().files().get(fileId=file_id).execute()
+            results[label] = time.perf_counter() - started
+    finally:
+        stub.stop()
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=0, help="Drive calls for the client reuse test")
+    args = parser.parse_args(argv)
+
+    print(f"{'mode':<6} {'median s':>9} {'min s':>7} {'max s':>7}  google stack")
+    for mode in ("lazy", "eager"):
+        times = []
+        for _ in range(args.runs):
+            seconds, loaded = first_request(mode)
+            times.append(seconds)
+        print(f"{mode:<6} {statistics.median(times):>9.3f} {min(times):>7.3f} {max(times):>7.3f}  {loaded}")
+
+    if args.requests:
+        print()
+        print(f"{'service':<10} {'calls':>6} {'seconds':>8} {'ms/call':>8}")
+        for label, seconds in client_reuse(args.requests).items():
+            print(f"{label:<10} {args.requests:>6} {seconds:>8.3f} {seconds / args.requests * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""Local stand-in for the parts of the Google Drive v3 HTTP API the app uses.
+
+Point the app at it with ``GDRIVE_API_ENDPOINT=http://127.0.0.1:8765/drive/v3/``;
+without Google credentials set the app then talks to it anonymously.
+
+Supported: ``files.list`` (with pagination and the ``trashed`` and
+``name contains`` filters), ``files.get`` with ``alt=media`` and ``Range``
+requests, ``changes.getStartPageToken`` and ``changes.list``. Files can be
+added, modified and removed through ``/stub/files`` and request counts are
+available at ``/stub/stats``. ``expire_changes`` makes the change log's
+older page tokens answer 410, as Drive does once they expired.
+
+    python drive_stub.py --port 8765 --blend-files 50 --file-size-mb 5
+
+It can also be used in-process::
+
+    stub = DriveStub(latency=0.05)
+    stub.add_file("scene.blend", data)
+    url = stub.start()
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubError(Exception):
+    """An error answered with its HTTP status, in Drive's error format."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def _timestamp():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+class DriveStub:
+    """In-memory Drive: file metadata, contents and a change log."""
+
+    def __init__(self, latency=0.0, rate=None):
+        # Seconds added to every request, bytes per second for media downloads
+        self.latency = latency
+        self.rate = rate
+        self.files = {}
+        self.contents = {}
+        self.changes = []
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        # Page tokens of the change log below this one have expired
+        self._oldest_token = 0
+        self._server = None
+
+    # --- state ---
+
+    def add_file(self, name, data, mime_type="application/octet-stream", file_id=None):
+        """Add a file, or replace the contents of ``file_id``. Returns its metadata."""
+        with self._lock:
+            if file_id is None:
+                file_id = f"stub{self._next_id:06d}"
+                self._next_id += 1
+            self.contents[file_id] = bytes(data)
+            self.files[file_id] = {
+                "kind": "drive#file",
+                "id": file_id,
+                "name": name,
+                "mimeType": mime_type,
+                "size": str(len(data)),
+                "md5Checksum": hashlib.md5(data).hexdigest(),
+                "modifiedTime": _timestamp(),
+                "trashed": False,
+            }
+            self.changes.append((file_id, False))
+            return dict(self.files[file_id])
+
+    def remove_file(self, file_id):
+        with self._lock:
+            self.files.pop(file_id, None)
+            self.contents.pop(file_id, None)
+            self.changes.append((file_id, True))
+
+    def trash_file(self, file_id):
+        """Move a file to the trash, the changes feed reports it as trashed."""
+        with self._lock:
+            self.files[file_id] = dict(self.files[file_id], trashed=True, modifiedTime=_timestamp())
+            self.changes.append((file_id, False))
+
+    def expire_changes(self):
+        """Expire the page tokens issued so far, ``changes.list`` answers 410 for them."""
+        with self._lock:
+            self._oldest_token = len(self.changes)
+
+    # --- API ---
+
+    def list_files(self, query):
+        q = query.get("q", "")
+        page_size = int(query.get("pageSize", 100))
+        offset = int(query.get("pageToken") or 0)
+        with self._lock:
+            files = sorted(self.files.values(), key=lambda f: f["modifiedTime"], reverse=True)
+        if "trashed=false" in q.replace(" ", ""):
+            files = [f for f in files if not f["trashed"]]
+        names = re.findall(r"name contains '([^']*)'", q)
+        mimes = re.findall(r"mimeType='([^']*)'", q)
+        if names or mimes:
+            files = [f for f in files if any(n in f["name"] for n in names) or f["mimeType"] in mimes]
+        page = files[offset:offset + page_size]
+        result = {"kind": "drive#fileList", "files": page}
+        if offset + page_size < len(files):
+            result["nextPageToken"] = str(offset + page_size)
+        return result
+
+    def start_page_token(self):
+        with self._lock:
+            return {"startPageToken": str(len(self.changes))}
+
+    def list_changes(self, query):
+        start = int(query["pageToken"])
+        page_size = int(query.get("pageSize", 100))
+        with self._lock:
+            if start < self._oldest_token:
+                raise StubError(410, "The page token is no longer valid.")
+            entries = self.changes[start:start + page_size]
+            result = {"kind": "drive#changeList", "changes": []}
+            for file_id, removed in entries:
+                change = {"fileId": file_id, "removed": removed or file_id not in self.files}
+                if not change["removed"]:
+                    change["file"] = dict(self.files[file_id])
+                result["changes"].append(change)
+            if start + page_size < len(self.changes):
+                result["nextPageToken"] = str(start + page_size)
+            else:
+                result["newStartPageToken"] = str(len(self.changes))
+        return result
+
+    # --- server ---
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve in a background thread, returns the API endpoint URL."""
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self._server.server_port}/drive/v3/"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes, keep-alive clients would wait for delayed ACKs
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, data, status=200):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            path = url.path.rstrip("/")
+            stub.requests[path if not path.startswith("/drive/v3/files/") else "/drive/v3/files/<id>"] += 1
+            if stub.latency:
+                time.sleep(stub.latency)
+            if path == "/stub/stats":
+                return self._json(dict(stub.requests))
+            if path == "/drive/v3/files":
+                return self._json(stub.list_files(query))
+            if path == "/drive/v3/changes/startPageToken":
+                return self._json(stub.start_page_token())
+            if path == "/drive/v3/changes":
+                try:
+                    return self._json(stub.list_changes(query))
+                except StubError as e:
+                    return self._json({"error": {"code": e.code, "message": str(e)}}, e.code)
+            if path.startswith("/drive/v3/files/"):
+                file_id = path.rsplit("/", 1)[1]
+                meta = stub.files.get(file_id)
+                if meta is None:
+                    return self._json({"error": {"code": 404, "message": "File not found"}}, 404)
+                if query.get("alt") == "media":
+                    return self._media(stub.contents[file_id])
+                return self._json(meta)
+            self._json({"error": {"code": 404, "message": "Not found"}}, 404)
+
+        def _media(self, data):
+            start, end = 0, len(data) - 1
+            m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if m:
+                start = int(m.group(1))
+                if m.group(2):
+                    end = min(end, int(m.group(2)))
+                if start >= len(data):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(data)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            view = memoryview(data)[start:end + 1]
+            step = 64 * 1024
+            for i in range(0, len(view), step):
+                self.wfile.write(view[i:i + step])
+                if stub.rate:
+                    time.sleep(step / stub.rate)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path.rstrip("/") != "/stub/files":
+                return self._json({"error": "Not found"}, 404)
+            spec = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            data = spec.get("content", "").encode() or os.urandom(int(spec.get("size", 1024)))
+            self._json(stub.add_file(spec["name"], data, file_id=spec.get("id")))
+
+        def do_DELETE(self):
+            url = urlparse(self.path)
+            if not url.path.startswith("/stub/files/"):
+                return self._json({"error": "Not found"}, 404)
+            stub.remove_file(url.path.rsplit("/", 1)[1])
+            self._json({})
+
+    return Handler
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dir", help="serve the files of this directory")
+    parser.add_argument("--blend-files", type=int, default=0, help="synthetic .blend files to add")
+    parser.add_argument("--other-files", type=int, default=0, help="non-.blend files to add")
+    parser.add_argument("--file-size-mb", type=float, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--rate-mb", type=float, help="media download speed limit in MB/s")
+    args = parser.parse_args(argv)
+
+    stub = DriveStub(latency=args.latency, rate=args.rate_mb * 1024 * 1024 if args.rate_mb else None)
+    if args.dir:
+        for name in sorted(os.listdir(args.dir)):
+            path = os.path.join(args.dir, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    stub.add_file(name, f.read())
+    if args.blend_files:
+        import io
+        from synthetic_blend import write_blend
+        for i in range(args.blend_files):
+            out = io.BytesIO()
+            write_blend(out, filler_bytes=int(args.file_size_mb * 1024 * 1024), seed=i)
+            stub.add_file(f"scene_{i:03d}.blend", out.getvalue())
+    for i in range(args.other_files):
+        stub.add_file(f"notes_{i:03d}.txt", b"not a blend file", mime_type="text/plain")
+
+    url = stub.start(args.host, args.port)
+    print(f"Drive stub serving {len(stub.files)} file(s) at {url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Stand-in for the ``blender`` executable, for tests and benchmarks.
+
+Point the app at it with ``BLENDER_BIN=/app/benchmarks/fake_blender.py``.
+It understands the command lines the app generates:
+
+* one-shot renders: ``-b FILE [--python-expr EXPR] -o BASE -f FRAME``
+  or ``... -o BASE -s START -e END [-j STEP] -a``
+* frame range probes: ``-b FILE --python-expr EXPR`` printing ``FRAME_RANGE``
+* warm workers: ``--background --python blender_server.py -- --connect SOCKET``,
+  serving the real ``blender_server`` protocol with a fake renderer
+
+Behaviour is tuned through environment variables:
+
+* ``FAKE_BLENDER_STARTUP``: seconds spent "starting up" (default 0.2)
+* ``FAKE_BLENDER_RENDER``: seconds spent per rendered frame (default 0.5)
+* ``FAKE_BLENDER_SIZE``: output resolution as ``WIDTHxHEIGHT`` (default 64x64)
+* ``FAKE_BLENDER_FAIL``: fail renders whose .blend path contains this string
+* ``FAKE_BLENDER_FRAMES``: scene frame range as ``START-END`` (default 1-24)
+* ``FAKE_BLENDER_SAMPLES``: samples per frame (default 16)
+
+Quality overrides of the setup script (resolution percentage, sample cap)
+shrink the image and the render time like they would in Blender.
+"""
+import os
+import re
+import sys
+import time
+import zlib
+import struct
+import importlib.util
+
+STARTUP = float(os.environ.get("FAKE_BLENDER_STARTUP", "0.2"))
+RENDER_TIME = float(os.environ.get("FAKE_BLENDER_RENDER", "0.5"))
+WIDTH, HEIGHT = (int(v) for v in os.environ.get("FAKE_BLENDER_SIZE", "64x64").lower().split("x"))
+FAIL = os.environ.get("FAKE_BLENDER_FAIL")
+SCENE_START, SCENE_END = (int(v) for v in os.environ.get("FAKE_BLENDER_FRAMES", "1-24").split("-"))
+SAMPLES = int(os.environ.get("FAKE_BLENDER_SAMPLES", "16"))
+
+
+def write_png(path, width, height, row):
+    """Write an 8-bit RGB PNG whose scanlines come from ``row(y)``."""
+    raw = zlib.compress(b"".join(b"\x00" + row(y) for y in range(height)))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", raw))
+        f.write(chunk(b"IEND", b""))
+
+
+def parse_border(script):
+    """Render border from a generated setup script, like Blender would apply it."""
+    values = dict(re.findall(r"border_(min_x|max_x|min_y|max_y)=([0-9.e-]+)", script or ""))
+    if "use_border=True" not in (script or "") or len(values) < 4:
+        return None
+    return tuple(float(values[k]) for k in ("min_x", "max_x", "min_y", "max_y"))
+
+
+def parse_quality(script):
+    """``(resolution scale, samples)`` after the quality overrides of a setup script."""
+    scale = re.search(r"resolution_percentage\*([0-9.]+)", script or "")
+    cap = re.search(r"cycles\.samples,(\d+)\)", script or "")
+    return float(scale.group(1)) if scale else 1.0, min(SAMPLES, int(cap.group(1))) if cap else SAMPLES
+
+
+def render_frame(blend_path, output_base, frame, border=None, quality=(1.0, SAMPLES)):
+    """Emit Blender-like progress lines and write ``<output_base><frame>.png``.
+
+    The image is a gradient in full-frame coordinates, so stitched tiles can
+    be compared against an untiled render. A ``border`` crops it the way
+    Blender does (origin bottom left, edges truncated to whole pixels).
+    """
+    if FAIL and FAIL in blend_path:
+        raise RuntimeError(f"Cannot read file '{blend_path}'")
+    print(f"Devices: CUDA_VISIBLE_DEVICES={os.environ.get('CUDA_VISIBLE_DEVICES', '<all>')}", flush=True)
+    scale, samples = quality
+    width, height = max(1, int(WIDTH * scale)), max(1, int(HEIGHT * scale))
+    # Render time grows with the pixels and the samples
+    render_time = RENDER_TIME * scale * scale * samples / SAMPLES
+    start = time.monotonic()
+    for sample in range(1, samples + 1):
+        time.sleep(render_time / samples)
+        elapsed = time.monotonic() - start
+        remaining = max(0.0, render_time - elapsed)
+        print(
+            f"Fra:{frame} Mem:12.00M (Peak 12.00M) | Time:00:{elapsed:05.2f} | Remaining:00:{remaining:05.2f} | "
+            f"Mem:8.00M, Peak:8.00M | Scene, ViewLayer | Sample {sample}/{samples}",
+            flush=True,
+        )
+    x0, x1, y0, y1 = 0, width, 0, height
+    if border:
+        x0, x1 = int(border[0] * width), int(border[1] * width)
+        y0, y1 = int(border[2] * height), int(border[3] * height)
+    top = height - y1
+
+    def row(y):
+        return b"".join(bytes((x % 256, (top + y) % 256, frame * 40 % 256)) for x in range(x0, x1))
+
+    path = f"{output_base}{frame:04d}.png"
+    write_png(path, x1 - x0, y1 - y0, row)
+    print(f"Saved: '{path}'", flush=True)
+    print(f" Time: 00:{time.monotonic() - start:05.2f} (Saving: 00:00.00)", flush=True)
+    return path
+
+
+class FakeRenderer:
+    version = "4.4.3 (fake)"
+
+    def render(self, request):
+        border = parse_border(request.get("script"))
+        quality = parse_quality(request.get("script"))
+        return [render_frame(request["blend_path"], request["output_base"], f, border, quality)
+                for f in requested_frames(request)]
+
+
+def requested_frames(request):
+    if request.get("animation"):
+        return range(int(request["frame_start"]), int(request["frame_end"]) + 1, int(request.get("frame_step", 1)))
+    return [int(request.get("frame", 1))]
+
+
+def option(args, flag, default=None):
+    return args[args.index(flag) + 1] if flag in args else default
+
+
+def serve_warm(script, argv):
+    spec = importlib.util.spec_from_file_location("blender_server", script)
+    server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(server)
+    args = server.parse_args(argv)
+    server.serve(args.connect, FakeRenderer())
+
+
+def main(argv):
+    print("Blender 4.4.3 (fake)", flush=True)
+    time.sleep(STARTUP)
+    args = argv[1:]
+
+    if "--python" in args:
+        serve_warm(option(args, "--python"), argv)
+        return 0
+
+    blend_path = option(args, "-b")
+    if "-o" not in args:
+        if "FRAME_RANGE" in option(args, "--python-expr", ""):
+            print(f"FRAME_RANGE {SCENE_START} {SCENE_END} 1", flush=True)
+        return 0
+
+    request = {"blend_path": blend_path, "output_base": option(args, "-o")}
+    if "-a" in args:
+        request.update(animation=True, frame_start=option(args, "-s", SCENE_START),
+                       frame_end=option(args, "-e", SCENE_END), frame_step=option(args, "-j", 1))
+    else:
+        request["frame"] = option(args, "-f", 1)
+    try:
+        border = parse_border(option(args, "--python-expr"))
+        quality = parse_quality(option(args, "--python-expr"))
+        for frame in requested_frames(request):
+            render_frame(blend_path, request["output_base"], frame, border, quality)
+    except RuntimeError as e:
+        print(f"Error: {e}", flush=True)
+        return 1
+    print("\nBlender quit", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Runs a render farm on this machine and measures how it scales.
+
+Starts the app as a farm coordinator and 1, 2, 4… ``farm_worker.py``
+processes with ``fake_blender.py`` (one device slot each), submits a batch
+of ``--jobs`` single-frame renders, ``--frames`` of each file, through
+``/render_batch`` and times it until every job is done. With ``--kill`` one worker is killed while it
+renders, to check that its job is given to another worker; this needs at
+least two workers per round. A batch not finished within ``--timeout``
+seconds is cancelled and its round reported as failed.
+
+    python farm_local.py --workers 1 2 4 --jobs 16 --frames 4 --render 1.0
+    python farm_local.py --workers 3 --jobs 9 --kill
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import subprocess
+import http.cookiejar
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_blend import write_blend_file  # noqa: E402
+
+AUTH_TOKEN = "farm-local"
+FARM_TOKEN = "farm-local-workers"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def base_env(**extra):
+    env = {k: v for k, v in os.environ.items() if not k.startswith("GOOGLE_")}
+    env.update(
+        BLENDER_BIN=os.path.join(BENCH_DIR, "fake_blender.py"),
+        RENDER_DEVICES="0",
+        RENDER_CPU_SLOT="false",
+        # No Drive: an unreachable endpoint fails fast
+        GDRIVE_API_ENDPOINT="http://127.0.0.1:9/drive/v3/",
+    )
+    env.update(extra)
+    return env
+
+
+class Client:
+    """Logged-in session of the coordinator's web API."""
+
+    def __init__(self, url):
+        self.url = url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        page = self.opener.open(f"{url}/login").read().decode()
+        self.csrf = re.search(r'name="csrf_token" value="([^"]+)"', page).group(1)
+        data = urllib.parse.urlencode({"token": AUTH_TOKEN, "csrf_token": self.csrf}).encode()
+        self.opener.open(urllib.request.Request(f"{url}/login", data=data))
+
+    def json(self, path, body=None):
+        headers = {"Accept": "application/json", "X-CSRFToken": self.csrf}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        with self.opener.open(urllib.request.Request(self.url + path, data=data, headers=headers)) as r:
+            return json.loads(r.read())
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/login", timeout=2).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Coordinator did not start at {url}")
+
+
+def start_worker(url, workdir, name, render_time):
+    env = base_env(FAKE_BLENDER_RENDER=str(render_time), FAKE_BLENDER_STARTUP="0.1")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(API_DIR, "farm_worker.py"), "--coordinator", url, "--token", FARM_TOKEN,
+         "--name", name, "--workdir", os.path.join(workdir, name), "--heartbeat", "1", "--poll", "5"],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for_workers(client, known, count, timeout=30):
+    """Wait until ``count`` workers not in ``known`` asked for work."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ids = {w["id"] for w in client.json("/farm")["workers"]}
+        if len(ids - known) >= count:
+            return ids
+        time.sleep(0.1)
+    raise RuntimeError(f"{count} workers did not join")
+
+
+def file_count(jobs, frames):
+    """Number of .blend files a batch of ``jobs`` renders, ``frames`` of each."""
+    return -(-jobs // frames)
+
+
+def run_batch(client, workers, jobs, frames=1, kill=None, timeout=300):
+    """Submit a batch and wait for it; returns ``(seconds, batch status)``.
+
+    A batch still unfinished after ``timeout`` seconds is cancelled and
+    returned as ``failed``.
+    """
+    body = {"jobs": [{"filename": f"farm{i // frames:03d}.blend", "frame": i % frames + 1} for i in range(jobs)]}
+    started = time.perf_counter()
+    batch = client.json("/render_batch", body)
+    killed = False
+    while batch["state"] in ("queued", "running"):
+        if time.perf_counter() - started > timeout:
+            batch = dict(client.json(f"/batches/{batch['id']}/cancel", {}), state="failed")
+            break
+        time.sleep(0.1)
+        batch = client.json(f"/batches/{batch['id']}")
+        if kill is not None and not killed and batch["counts"].get("running"):
+            # Kill a worker in the middle of a render
+            time.sleep(0.3)
+            workers[kill].send_signal(signal.SIGKILL)
+            killed = True
+    return time.perf_counter() - started, batch
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--frames", type=int, default=4, help="jobs per .blend file, one frame each")
+    parser.add_argument("--render", type=float, default=1.0, help="fake render time per frame, seconds")
+    parser.add_argument("--kill", action="store_true", help="kill a worker during each batch")
+    parser.add_argument("--timeout", type=float, default=300, help="longest wait for a batch, seconds")
+    args = parser.parse_args(argv)
+    if args.kill and min(args.workers) < 2:
+        parser.error("--kill needs at least 2 workers per round, to take over the killed worker's job")
+
+    workdir = tempfile.mkdtemp(prefix="farm-local-")
+    for sub in ("uploads", "output"):
+        os.makedirs(os.path.join(workdir, "coordinator", sub))
+    for i in range(file_count(args.jobs, args.frames)):
+        write_blend_file(os.path.join(workdir, "coordinator", "uploads", f"farm{i:03d}.blend"), seed=i)
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = base_env(
+        WORKDIR=os.path.join(workdir, "coordinator"),
+        JOB_LOG_DIR=os.path.join(workdir, "coordinator", "logs"),
+        FARM_MODE="coordinator", FARM_TOKEN=FARM_TOKEN, AUTH_TOKEN=AUTH_TOKEN,
+        FARM_WORKER_TIMEOUT="3", RENDER_CACHE_MB="0",
+    )
+    coordinator = subprocess.Popen(
+        [sys.executable, "-c", f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(url)
+        client = Client(url)
+        print(f"{'workers':>7} {'jobs':>5} {'seconds':>8} {'jobs/s':>7} {'speedup':>8}  result")
+        baseline = None
+        for count in args.workers:
+            known = {w["id"] for w in client.json("/farm")["workers"]}
+            workers = [start_worker(url, workdir, f"node{i}", args.render) for i in range(count)]
+            try:
+                wait_for_workers(client, known, count)
+                seconds, batch = run_batch(client, workers, args.jobs, args.frames,
+                                           kill=0 if args.kill else None, timeout=args.timeout)
+            finally:
+                for w in workers:
+                    w.terminate()
+                for w in workers:
+                    w.wait()
+            rate = args.jobs / seconds
+            if batch["state"] == "done":
+                baseline = baseline or rate / count
+            devices = sorted({job["device"] for job in batch["jobs"] if job.get("device")})
+            speedup = f"{rate / baseline:>8.2f}" if baseline else f"{'-':>8}"
+            print(f"{count:>7} {args.jobs:>5} {seconds:>8.2f} {rate:>7.2f} {speedup}  "
+                  f"{batch['state']} {batch['counts']} on {', '.join(devices)}")
+    finally:
+        coordinator.terminate()
+        coordinator.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
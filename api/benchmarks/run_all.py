@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""Runs the end-to-end benchmark scenarios and writes their results as JSON.
+
+The app runs in its own process with ``fake_blender.py`` as Blender and a
+``drive_stub`` as Google Drive, so no GPU, Blender or Google account is
+needed. Scenarios (``--scenarios``, all by default):
+
+* ``upload``: .blend files posted to ``/`` by ``--upload-clients``
+  sessions at once (scan and validation included), in MB/s
+* ``scan``: ``blend_scanner.scan_file`` on a synthetic .blend file, reading
+  its Text datablocks and every byte, in MB/s
+* ``render``: a ``/render_batch`` of ``--render-jobs`` single-frame jobs
+  on 1, 2, 4… device slots (``--slots``), in jobs per minute
+* ``index``: latency of the page (Drive listing and gallery) with
+  ``--drive-files`` files on Drive and ``--outputs`` rendered images,
+  requested by ``--index-clients`` sessions at once, p50 and p99 in ms
+* ``drive``: downloads from the Drive stub, through the app's
+  ``DownloadManager`` and through ``GDriveManager.download_file``, in MB/s
+
+    python run_all.py --output results.json
+    python run_all.py --scenarios render index --server gunicorn --compare results.json
+
+``--compare`` prints the headline numbers of an earlier results file next
+to the new ones.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, API_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from drive_stub import DriveStub  # noqa: E402
+from farm_local import AUTH_TOKEN, Client, base_env, free_port, wait_for  # noqa: E402
+from synthetic_blend import write_blend, write_blend_file  # noqa: E402
+
+SCENARIOS = ("upload", "scan", "render", "index", "drive")
+MB = 1024 * 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def blend_bytes(size_mb, seed=0):
+    out = io.BytesIO()
+    write_blend(out, filler_bytes=int(size_mb * MB), seed=seed)
+    return out.getvalue()
+
+
+class App:
+    """The app served from its own process, with a workspace of its own."""
+
+    def __init__(self, server="flask", **env):
+        self.workdir = tempfile.mkdtemp(prefix="bench-app-")
+        for sub in ("uploads", "output"):
+            os.makedirs(os.path.join(self.workdir, sub))
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = server
+        self.env = base_env(WORKDIR=self.workdir, AUTH_TOKEN=AUTH_TOKEN, RENDER_CACHE_MB="0",
+                            GUNICORN_PIDFILE=os.path.join(self.workdir, "gunicorn.pid"), **env)
+        self.process = None
+
+    def path(self, *parts):
+        return os.path.join(self.workdir, *parts)
+
+    def start(self):
+        if self.server == "gunicorn":
+            command = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{self.port}"]
+        else:
+            command = [sys.executable, "-c",
+                       f"from app import app; app.run(host='127.0.0.1', port={self.port}, threaded=True)"]
+        self.process = subprocess.Popen(command, cwd=API_DIR, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for(self.url, timeout=60)
+        return Client(self.url)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def post_file(client, name, data):
+    """Upload ``data`` as ``name`` through the page's form."""
+    boundary = uuid.uuid4().hex
+    body = b"".join([
+        f'--{boundary}\r\nContent-Disposition: form-data; name="csrf_token"\r\n\r\n{client.csrf}\r\n'.encode(),
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode(),
+        data,
+        f"\r\n--{boundary}--\r\n".encode(),
+    ])
+    request = urllib.request.Request(f"{client.url}/", data=body,
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    with client.opener.open(request) as r:
+        r.read()
+
+
+def run_clients(count, target):
+    """Run ``target(i)`` in ``count`` threads at once, re-raising the first error."""
+    errors = []
+
+    def run(i):
+        try:
+            target(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+
+# --- scenarios ---
+
+def bench_upload(args):
+    data = [blend_bytes(args.upload_mb, seed=i) for i in range(args.uploads)]
+    with App(args.server) as app:
+        clients = [app.start()] + [Client(app.url) for _ in range(args.upload_clients - 1)]
+        times = []
+        started = time.perf_counter()
+
+        def upload(i):
+            for n in range(i, args.uploads, args.upload_clients):
+                t = time.perf_counter()
+                post_file(clients[i], f"upload{n:03d}.blend", data[n])
+                times.append(time.perf_counter() - t)
+
+        run_clients(args.upload_clients, upload)
+        seconds = time.perf_counter() - started
+        stored = len([n for n in os.listdir(app.path("uploads")) if n.endswith(".blend")])
+    if stored != args.uploads:
+        raise RuntimeError(f"{stored} of {args.uploads} uploads were stored")
+    total_mb = sum(len(d) for d in data) / MB
+    return {"files": args.uploads, "clients": args.upload_clients, "mb": round(total_mb, 2),
+            "seconds": round(seconds, 3), "mb_per_s": round(total_mb / seconds, 2),
+            "p50_ms": round(percentile(times, 50) * 1000, 1)}
+
+
+def bench_scan(args):
+    from blend_scanner import scan_file
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "scan.blend")
+        write_blend_file(path, texts={"setup.py": "import bpy\n"}, filler_bytes=int(args.scan_mb * MB))
+        size_mb = os.path.getsize(path) / MB
+        result = {"mb": round(size_mb, 2)}
+        # "blocks" reads the Text datablocks only, "stream" every byte (files it cannot parse)
+        for mode, block_aware in (("blocks", True), ("stream", False)):
+            best = None
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                scan_file(path, block_aware=block_aware)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            result[f"{mode}_mb_per_s"] = round(size_mb / best, 1)
+    return result
+
+
+def bench_render(args):
+    results = []
+    for slots in args.slots:
+        env = dict(RENDER_DEVICES=",".join(str(i) for i in range(slots)),
+                   FAKE_BLENDER_RENDER=str(args.render_time), FAKE_BLENDER_STARTUP=str(args.startup_time))
+        with App(args.server, **env) as app:
+            # One file per job: renders of the same file never overlap
+            for i in range(args.render_jobs):
+                write_blend_file(app.path("uploads", f"render{i:03d}.blend"), seed=i)
+            client = app.start()
+            body = {"jobs": [{"filename": f"render{i:03d}.blend", "frame": 1} for i in range(args.render_jobs)]}
+            started = time.perf_counter()
+            batch = client.json("/render_batch", body)
+            while batch["state"] in ("queued", "running"):
+                time.sleep(0.05)
+                batch = client.json(f"/batches/{batch['id']}")
+            seconds = time.perf_counter() - started
+        if batch["state"] != "done":
+            raise RuntimeError(f"Render batch {batch['state']}: {batch['counts']}")
+        results.append({"slots": slots, "jobs": args.render_jobs, "seconds": round(seconds, 2),
+                        "jobs_per_minute": round(args.render_jobs / seconds * 60, 1)})
+    return results
+
+
+def bench_index(args):
+    stub = DriveStub()
+    for i in range(args.drive_files):
+        stub.add_file(f"scene_{i:04d}.blend", b"BLENDER-v300")
+    endpoint = stub.start()
+    try:
+        with App(args.server, GDRIVE_API_ENDPOINT=endpoint) as app:
+            image = os.path.join(app.workdir, "image.png")
+            write_png(image)
+            for i in range(args.outputs):
+                os.link(image, app.path("output", f"render{i:06d}.png"))
+            clients = [app.start()] + [Client(app.url) for _ in range(args.index_clients - 1)]
+            # First page: Drive listing and output index
+            started = time.perf_counter()
+            clients[0].opener.open(f"{app.url}/").read()
+            first = time.perf_counter() - started
+            times = []
+
+            def browse(i):
+                for _ in range(args.index_requests // args.index_clients):
+                    t = time.perf_counter()
+                    with clients[i].opener.open(f"{app.url}/") as r:
+                        r.read()
+                    times.append(time.perf_counter() - t)
+
+            run_clients(args.index_clients, browse)
+    finally:
+        stub.stop()
+    return {"drive_files": args.drive_files, "outputs": args.outputs, "clients": args.index_clients,
+            "requests": len(times), "first_ms": round(first * 1000, 1),
+            "p50_ms": round(percentile(times, 50) * 1000, 2), "p99_ms": round(percentile(times, 99) * 1000, 2)}
+
+
+def write_png(path):
+    from png_stream import PNGWriter
+
+    writer = PNGWriter(path, 64, 64, color_type=2)
+    for y in range(64):
+        writer.write_row(bytes([y * 4, 128, 255 - y * 4]) * 64)
+    writer.close()
+
+
+def bench_drive(args):
+    stub = DriveStub(rate=args.drive_rate_mb * MB if args.drive_rate_mb else None)
+    files = [stub.add_file(f"drive{i:03d}.blend", blend_bytes(args.drive_mb, seed=i)) for i in range(args.drive_count)]
+    os.environ["GDRIVE_API_ENDPOINT"] = stub.start()
+    for name in [k for k in os.environ if k.startswith("GOOGLE_")]:
+        del os.environ[name]
+    from gdrive_manager import GDriveManager, drive_service
+    from drive_downloads import DONE, DownloadManager
+
+    total_mb = sum(int(f["size"]) for f in files) / MB
+    results = {"files": args.drive_count, "mb": round(total_mb, 2)}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = DownloadManager(drive_service, os.path.join(tmp, "managed"), workers=4)
+            started = time.perf_counter()
+            downloads = [manager.request(f) for f in files]
+            for d in downloads:
+                manager.wait(d.name)
+            seconds = time.perf_counter() - started
+            manager.shutdown()
+            if any(d.state != DONE for d in downloads):
+                raise RuntimeError(f"Downloads failed: {[d.error for d in downloads if d.error]}")
+            results["download_manager_mb_per_s"] = round(total_mb / seconds, 1)
+
+            gdrive = GDriveManager()
+            started = time.perf_counter()
+            for f in files:
+                gdrive.download_file(f["id"], dest_dir=os.path.join(tmp, "gdrive_manager"))
+            seconds = time.perf_counter() - started
+            results["download_file_mb_per_s"] = round(total_mb / seconds, 1)
+    finally:
+        stub.stop()
+    return results
+
+
+BENCHMARKS = {"upload": bench_upload, "scan": bench_scan, "render": bench_render,
+              "index": bench_index, "drive": bench_drive}
+
+
+# --- results ---
+
+def headline(results):
+    """``{name: (value, higher is better)}`` of the numbers worth comparing between runs."""
+    numbers = {}
+    for scenario, result in results.items():
+        if scenario == "render":
+            for run in result:
+                numbers[f"render.slots={run['slots']}.jobs_per_minute"] = (run["jobs_per_minute"], True)
+            continue
+        for key, value in result.items():
+            if key.endswith("mb_per_s"):
+                numbers[f"{scenario}.{key}"] = (value, True)
+            elif key.endswith("_ms"):
+                numbers[f"{scenario}.{key}"] = (value, False)
+    return numbers
+
+
+def compare(previous, current):
+    before, after = headline(previous["results"]), headline(current["results"])
+    print(f"\n{'metric':<42} {'before':>10} {'after':>10} {'change':>8}")
+    for name, (value, higher_is_better) in after.items():
+        if name not in before:
+            continue
+        old = before[name][0]
+        change = (value - old) / old * 100 if old else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        print(f"{name:<42} {old:>10g} {value:>10g} {change:>+7.1f}%{'' if not change else ' better' if better else ' worse'}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare with")
+    parser.add_argument("--server", choices=["flask", "gunicorn"], default="flask",
+                        help="serve the app with the development server or gunicorn.conf.py")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--upload-mb", type=float, default=16)
+    parser.add_argument("--upload-clients", type=int, default=2)
+    parser.add_argument("--scan-mb", type=float, default=64)
+    parser.add_argument("--render-jobs", type=int, default=16)
+    parser.add_argument("--slots", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--render-time", type=float, default=0.5, help="fake render time per frame, seconds")
+    parser.add_argument("--startup-time", type=float, default=0.2, help="fake Blender startup, seconds")
+    parser.add_argument("--drive-files", type=int, default=200, help="files listed on Drive for the index page")
+    parser.add_argument("--outputs", type=int, default=2000, help="rendered images in the gallery")
+    parser.add_argument("--index-clients", type=int, default=4)
+    parser.add_argument("--index-requests", type=int, default=400)
+    parser.add_argument("--drive-count", type=int, default=4, help="files downloaded from the Drive stub")
+    parser.add_argument("--drive-mb", type=float, default=16)
+    parser.add_argument("--drive-rate-mb", type=float, help="Drive stub download speed limit in MB/s")
+    args = parser.parse_args(argv)
+
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "args": vars(args),
+        "results": {},
+    }
+    for scenario in args.scenarios:
+        print(f"{scenario}...", flush=True)
+        started = time.perf_counter()
+        report["results"][scenario] = result = BENCHMARKS[scenario](args)
+        print(f"  {json.dumps(result)} ({time.perf_counter() - started:.1f}s)", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
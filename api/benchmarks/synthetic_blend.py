@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Writes synthetic .blend files for tests and benchmarks.
+
+The files have a real BHead/SDNA structure (a reduced set of structs) so
+that ``blend_reader`` and the upload scanner can parse them: a scene with
+render settings, Text datablocks, and optional filler blocks of random
+binary data to reach a target size.
+
+    python synthetic_blend.py out.blend --size-mb 100 --compress zstd
+"""
+import os
+import sys
+import gzip
+import random
+import struct
+import argparse
+
+BASE_TYPES = [("char", 1), ("uchar", 1), ("short", 2), ("int", 4), ("float", 4), ("double", 8), ("void", 0)]
+
+# Reduced DNA: enough fields for blend_reader, laid out without padding
+STRUCTS = [
+    ("ListBase", [("void", "*first"), ("void", "*last")]),
+    ("ID", [("void", "*next"), ("void", "*prev"), ("char", "name[66]"), ("short", "flag"),
+            ("IDProperty", "*properties"), ("IDProperty", "*system_properties")]),
+    ("IDPropertyData", [("void", "*pointer"), ("ListBase", "group"), ("int", "val"), ("int", "val2")]),
+    ("IDProperty", [("IDProperty", "*next"), ("IDProperty", "*prev"), ("char", "type"), ("char", "subtype"),
+                    ("short", "flag"), ("char", "name[64]"), ("int", "saved"), ("IDPropertyData", "data"),
+                    ("int", "len"), ("int", "totallen")]),
+    ("RenderData", [("int", "cfra"), ("int", "sfra"), ("int", "efra"), ("int", "frame_step"),
+                    ("int", "xsch"), ("int", "ysch"), ("short", "size"), ("short", "frs_sec"),
+                    ("float", "frs_sec_base"), ("char", "engine[32]")]),
+    ("SceneEEVEE", [("int", "taa_render_samples"), ("int", "flag")]),
+    ("Scene", [("ID", "id"), ("RenderData", "r"), ("SceneEEVEE", "eevee")]),
+    ("TextLine", [("TextLine", "*next"), ("TextLine", "*prev"), ("char", "*line"), ("char", "*format"),
+                  ("int", "len"), ("int", "blen")]),
+    ("Text", [("ID", "id"), ("ListBase", "lines")]),
+    ("Global", [("Scene", "*curscene"), ("int", "fileflags"), ("int", "globalf")]),
+]
+
+
+class Writer:
+    def __init__(self, out, pointer_size=8):
+        self.out = out
+        self.ptr = pointer_size
+        self.next_address = 0x1000
+        self.types = [name for name, _ in BASE_TYPES] + [name for name, _ in STRUCTS]
+        self.sizes = dict(BASE_TYPES)
+        self.layouts = {}
+        for name, fields in STRUCTS:
+            layout, offset = [], 0
+            for ftype, fname in fields:
+                size = self._field_size(ftype, fname)
+                layout.append((ftype, fname, offset, size))
+                offset += size
+            self.layouts[name] = layout
+            self.sizes[name] = offset
+        self.struct_ids = {name: i for i, (name, _) in enumerate(STRUCTS)}
+
+    def _field_size(self, ftype, fname):
+        count = 1
+        for part in fname.split("[")[1:]:
+            count *= int(part.rstrip("]"))
+        return (self.ptr if fname.startswith("*") else self.sizes[ftype]) * count
+
+    def address(self):
+        self.next_address += 0x100
+        return self.next_address
+
+    def pack(self, struct_name, values, prefix=""):
+        data = bytearray(self.sizes[struct_name])
+        for ftype, fname, offset, size in self.layouts[struct_name]:
+            key = prefix + fname.lstrip("*").split("[")[0]
+            if ftype in self.layouts and not fname.startswith("*"):
+                data[offset:offset + size] = self.pack(ftype, values, key + ".")
+                continue
+            if key not in values:
+                continue
+            value = values[key]
+            if fname.startswith("*"):
+                data[offset:offset + size] = struct.pack("<Q" if self.ptr == 8 else "<I", value)
+            elif "[" in fname:
+                raw = value.encode() if isinstance(value, str) else value
+                data[offset:offset + len(raw)] = raw
+            else:
+                fmt = {"char": "b", "short": "h", "int": "i", "float": "f", "double": "d"}[ftype]
+                data[offset:offset + size] = struct.pack("<" + fmt, value)
+        return bytes(data)
+
+    def block(self, code, data, sdna=0, count=1, address=None):
+        address = address or self.address()
+        if self.ptr == 8:
+            head = struct.pack("<4siQii", code, len(data), address, sdna, count)
+        else:
+            head = struct.pack("<4siIii", code, len(data), address, sdna, count)
+        self.out.write(head)
+        self.out.write(data)
+        return address
+
+    def struct_block(self, code, struct_name, values, address=None):
+        return self.block(code, self.pack(struct_name, values), self.struct_ids[struct_name], address=address)
+
+    def sdna(self):
+        names = []
+        for _, fields in STRUCTS:
+            for _, fname in fields:
+                if fname not in names:
+                    names.append(fname)
+
+        def strings(items):
+            raw = b"".join(s.encode() + b"\x00" for s in items)
+            return raw + b"\x00" * (-len(raw) % 4)
+
+        data = b"SDNA"
+        data += b"NAME" + struct.pack("<i", len(names)) + strings(names)
+        data += b"TYPE" + struct.pack("<i", len(self.types)) + strings(self.types)
+        tlen = struct.pack(f"<{len(self.types)}H", *(self.sizes[t] for t in self.types))
+        data += b"TLEN" + tlen + b"\x00" * (-len(tlen) % 4)
+        data += b"STRC" + struct.pack("<i", len(STRUCTS))
+        for name, fields in STRUCTS:
+            data += struct.pack("<hh", self.types.index(name), len(fields))
+            for ftype, fname in fields:
+                data += struct.pack("<hh", self.types.index(ftype), names.index(fname))
+        return data
+
+
+def write_blend(out, scene=None, texts=None, filler_bytes=0, filler_text=b"", seed=0, pointer_size=8):
+    """Write a synthetic .blend to the binary file object ``out``."""
+    scene = dict({"name": "Scene", "engine": "CYCLES", "resolution_x": 1920, "resolution_y": 1080,
+                  "resolution_percentage": 100, "frame_start": 1, "frame_end": 250, "frame_step": 1,
+                  "fps": 24, "samples": 128}, **(scene or {}))
+    w = Writer(out, pointer_size)
+    out.write(b"BLENDER" + (b"-" if pointer_size == 8 else b"_") + b"v404")
+
+    scene_address = w.address()
+    w.struct_block(b"GLOB", "Global", {"curscene": scene_address})
+
+    # Scene with its Cycles settings stored as ID properties, like bpy does
+    group, cycles, samples = w.address(), w.address(), w.address()
+    w.struct_block(b"SC\x00\x00", "Scene", {
+        "id.name": "SC" + scene["name"], "id.properties": group,
+        "r.cfra": scene["frame_start"], "r.sfra": scene["frame_start"], "r.efra": scene["frame_end"],
+        "r.frame_step": scene["frame_step"], "r.xsch": scene["resolution_x"], "r.ysch": scene["resolution_y"],
+        "r.size": scene["resolution_percentage"], "r.frs_sec": scene["fps"], "r.frs_sec_base": 1.0,
+        "r.engine": scene["engine"], "eevee.taa_render_samples": 64,
+    }, address=scene_address)
+    w.struct_block(b"DATA", "IDProperty", {"type": 6, "name": "", "data.group.first": cycles,
+                                           "data.group.last": cycles}, address=group)
+    w.struct_block(b"DATA", "IDProperty", {"type": 6, "name": "cycles", "data.group.first": samples,
+                                           "data.group.last": samples}, address=cycles)
+    w.struct_block(b"DATA", "IDProperty", {"type": 1, "name": "samples", "data.val": scene["samples"]},
+                   address=samples)
+
+    rng = random.Random(seed)
+    chunk = 1024 * 1024
+    written = 0
+    while written < filler_bytes:
+        size = min(chunk, filler_bytes - written)
+        data = bytearray(rng.randbytes(size))
+        if filler_text and size > len(filler_text) * 2:
+            pos = rng.randrange(size - len(filler_text))
+            data[pos:pos + len(filler_text)] = filler_text
+        w.block(b"ME\x00\x00" if written == 0 else b"DATA", bytes(data))
+        written += size
+
+    for name, content in (texts or {}).items():
+        lines = content.split("\n")
+        addresses = [w.address() for _ in lines]
+        w.struct_block(b"TX\x00\x00", "Text", {"id.name": "TX" + name, "lines.first": addresses[0],
+                                               "lines.last": addresses[-1]})
+        for i, (line, address) in enumerate(zip(lines, addresses)):
+            chars = w.address()
+            w.struct_block(b"DATA", "TextLine", {
+                "next": addresses[i + 1] if i + 1 < len(addresses) else 0,
+                "prev": addresses[i - 1] if i else 0,
+                "line": chars, "len": len(line.encode()),
+            }, address=address)
+            w.block(b"DATA", line.encode() + b"\x00", address=chars)
+
+    w.block(b"DNA1", w.sdna())
+    w.block(b"ENDB", b"")
+
+
+def write_blend_file(path, compress=None, **kwargs):
+    """Write a synthetic .blend to ``path``, optionally gzip or zstd compressed."""
+    if compress == "gzip":
+        with gzip.open(path, "wb") as out:
+            write_blend(out, **kwargs)
+    elif compress == "zstd":
+        import zstandard
+        with open(path, "wb") as f, zstandard.ZstdCompressor().stream_writer(f) as out:
+            write_blend(out, **kwargs)
+    else:
+        with open(path, "wb") as out:
+            write_blend(out, **kwargs)
+    return path
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--size-mb", type=float, default=0, help="random filler data to add")
+    parser.add_argument("--compress", choices=["gzip", "zstd"])
+    parser.add_argument("--text", action="append", default=[], metavar="NAME=CONTENT",
+                        help="add a Text datablock")
+    args = parser.parse_args(argv)
+    texts = dict(t.split("=", 1) for t in args.text)
+    write_blend_file(args.path, compress=args.compress, texts=texts, filler_bytes=int(args.size_mb * 1024 * 1024))
+    print(f"Wrote {args.path} ({os.path.getsize(args.path)} bytes)")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,630 @@
+"""Metadata-only reader for .blend files.
+
+Walks the file-block (BHead) structure of a .blend file, optionally gzip
+or zstd compressed, without loading it into memory: only the blocks needed
+for scene settings and Text datablocks are kept, everything else is
+skipped. Struct layouts are taken from the file's own SDNA, so the reader
+does not depend on a particular Blender version.
+
+    info = read_blend_info("/workspace/uploads/scene.blend")
+    info["scene"]["resolution_x"], info["scene"]["frame_end"]
+"""
+import io
+import os
+import re
+import gzip
+import zlib
+import struct
+import functools
+
+BLEND_MAGIC = b"BLENDER"
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Blocks kept in memory, plus the DATA blocks that follow them
+KEEP_CODES = {b"GLOB", b"SC\x00\x00", b"TX\x00\x00"}
+
+# IDProperty types (DNA_ID.h)
+IDP_STRING = 0
+IDP_INT = 1
+IDP_FLOAT = 2
+IDP_GROUP = 6
+IDP_DOUBLE = 8
+IDP_BOOLEAN = 10
+
+_ARRAY_RE = re.compile(r"\[(\d+)\]")
+
+# struct formats of the DNA scalar types
+SCALAR_FORMATS = {
+    "char": "b", "uchar": "B", "short": "h", "ushort": "H", "int": "i", "uint": "I",
+    "float": "f", "double": "d", "int64_t": "q", "uint64_t": "Q", "int8_t": "b",
+    "int16_t": "h", "int32_t": "i", "uint8_t": "B", "uint16_t": "H", "uint32_t": "I",
+}
+
+
+class BlendReadError(Exception):
+    """Raised when a file is not a .blend file this reader understands."""
+
+
+def open_blend_stream(path):
+    """Open ``path`` and return ``(stream, compression)``.
+
+    Compressed files are decompressed on the fly; the returned stream is
+    only read forwards.
+    """
+    f = open(path, "rb")
+    magic = f.read(4)
+    f.seek(0)
+    if magic.startswith(BLEND_MAGIC[:4]):
+        return f, None
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=f, mode="rb"), "gzip"
+    if magic == ZSTD_MAGIC:
+        return _zstd_reader(f), "zstd"
+    f.close()
+    raise BlendReadError("Not a .blend file")
+
+
+def _zstd_decompressor():
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.ZstdDecompressor()
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise BlendReadError("zstd compressed .blend files need the 'zstandard' package")
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+class _FrameDecoder:
+    """Incremental decompression across concatenated gzip members or zstd frames."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = factory()
+
+    def decompress(self, data):
+        out = []
+        while data:
+            out.append(self._obj.decompress(data))
+            if not self._obj.eof:
+                break
+            data = self._obj.unused_data
+            self._obj = self._factory()
+        return b"".join(out)
+
+
+def _zstd_reader(f):
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.ZstdFile(f)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        f.close()
+        raise BlendReadError("zstd compressed .blend files need the 'zstandard' package")
+    # Blender writes one zstd frame per chunk of the file
+    return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True)
+
+
+def parse_header(stream):
+    """Read the file header.
+
+    Returns ``(pointer_size, endian, version, large_bhead)`` where
+    ``endian`` is a ``struct`` prefix and ``version`` is e.g. ``404``.
+
+    Handles the classic 12-byte header (``BLENDER-v404``) and the 17-byte
+    header of the large-BHead format (``BLENDER17-01v0500``).
+    """
+    head = stream.read(12)
+    if len(head) < 12 or not head.startswith(BLEND_MAGIC):
+        raise BlendReadError("Invalid .blend file signature")
+    if head[7:9] == b"17" and head[9:10] == b"-":
+        rest = stream.read(5)
+        fmt = int(head[10:12])
+        endian = "<" if rest[0:1] == b"v" else ">"
+        if fmt != 1:
+            raise BlendReadError(f"Unsupported .blend file format version {fmt}")
+        return 8, endian, int(rest[1:5]), True
+    pointer_size = {b"_": 4, b"-": 8}.get(head[7:8])
+    endian = {b"v": "<", b"V": ">"}.get(head[8:9])
+    if pointer_size is None or endian is None:
+        raise BlendReadError("Invalid .blend file header")
+    return pointer_size, endian, int(head[9:12]), False
+
+
+class SDNA:
+    """Struct layouts from a file's DNA1 block."""
+
+    def __init__(self, data, endian, pointer_size):
+        self.pointer_size = pointer_size
+        self.endian = endian
+        pos = 0
+
+        def expect(tag):
+            nonlocal pos
+            pos = (pos + 3) & ~3
+            if data[pos:pos + 4] != tag:
+                raise BlendReadError(f"Malformed SDNA: expected {tag!r}")
+            pos += 4
+
+        def read_int():
+            nonlocal pos
+            value = struct.unpack_from(endian + "i", data, pos)[0]
+            pos += 4
+            return value
+
+        def read_strings(count):
+            nonlocal pos
+            strings = []
+            for _ in range(count):
+                end = data.index(b"\x00", pos)
+                strings.append(data[pos:end].decode("latin-1"))
+                pos = end + 1
+            return strings
+
+        expect(b"SDNA")
+        expect(b"NAME")
+        names = read_strings(read_int())
+        expect(b"TYPE")
+        self.types = read_strings(read_int())
+        type_lookup = {name: i for i, name in enumerate(self.types)}
+        expect(b"TLEN")
+        self.type_sizes = list(struct.unpack_from(f"{endian}{len(self.types)}H", data, pos))
+        pos += 2 * len(self.types)
+        expect(b"STRC")
+        self.structs = []
+        self.struct_index = {}
+        for _ in range(read_int()):
+            type_index, field_count = struct.unpack_from(endian + "hh", data, pos)
+            pos += 4
+            fields = {}
+            offset = 0
+            for _ in range(field_count):
+                field_type, field_name = struct.unpack_from(endian + "hh", data, pos)
+                pos += 4
+                field = self._field(self.types[field_type], names[field_name], offset, type_lookup)
+                fields[field["name"]] = field
+                offset += field["size"]
+            self.struct_index[self.types[type_index]] = len(self.structs)
+            self.structs.append((self.types[type_index], fields))
+
+    def _field(self, type_name, raw_name, offset, type_lookup):
+        is_pointer = raw_name.startswith("*") or raw_name.startswith("(*")
+        count = 1
+        for dim in _ARRAY_RE.findall(raw_name):
+            count *= int(dim)
+        name = _ARRAY_RE.sub("", raw_name).replace("(*", "").replace(")()", "").lstrip("*")
+        if is_pointer:
+            item_size = self.pointer_size
+        else:
+            item_size = self.type_sizes[type_lookup[type_name]]
+        return {"name": name, "type": type_name, "offset": offset, "size": item_size * count,
+                "count": count, "pointer": is_pointer}
+
+    def fields(self, struct_name):
+        index = self.struct_index.get(struct_name)
+        return None if index is None else self.structs[index][1]
+
+    def has_field(self, struct_name, path):
+        try:
+            self.locate(struct_name, path)
+            return True
+        except KeyError:
+            return False
+
+    def locate(self, struct_name, path):
+        """Field description and absolute offset of a dotted ``path``."""
+        offset = 0
+        field = None
+        for part in path.split("."):
+            fields = self.fields(struct_name)
+            if fields is None or part not in fields:
+                raise KeyError(f"{struct_name}.{part}")
+            field = fields[part]
+            offset += field["offset"]
+            struct_name = field["type"]
+        return field, offset
+
+    def get(self, struct_name, data, path, default=None):
+        """Decode the field at dotted ``path`` from a struct's raw bytes."""
+        try:
+            field, offset = self.locate(struct_name, path)
+        except KeyError:
+            return default
+        if offset + field["size"] > len(data):
+            return default
+        if field["pointer"]:
+            fmt = "I" if self.pointer_size == 4 else "Q"
+            return struct.unpack_from(self.endian + fmt, data, offset)[0]
+        raw = data[offset:offset + field["size"]]
+        kind = field["type"]
+        if kind == "char" and field["count"] > 1:
+            return raw.split(b"\x00", 1)[0].decode("utf-8", errors="replace")
+        fmt = SCALAR_FORMATS.get(kind)
+        if fmt is None:
+            return raw
+        values = struct.unpack_from(f"{self.endian}{field['count']}{fmt}", raw)
+        return values[0] if field["count"] == 1 else list(values)
+
+
+class Block:
+    __slots__ = ("code", "sdna_index", "old", "count", "data")
+
+    def __init__(self, code, sdna_index, old, count, data):
+        self.code = code
+        self.sdna_index = sdna_index
+        self.old = old
+        self.count = count
+        self.data = data
+
+
+class BlendFile:
+    """Scenes and Text datablocks of a .blend file, read in one streaming pass.
+
+    Blocks larger than ``max_block_size``, and anything past ``max_kept``
+    bytes in total, are skipped even when they would be kept, which bounds
+    memory use on hostile or unusual files. ``truncated`` tells whether that
+    happened.
+    """
+
+    def __init__(self, path=None, max_block_size=16 * 1024 * 1024, max_kept=64 * 1024 * 1024):
+        self.path = path
+        self.max_block_size = max_block_size
+        self.max_kept = max_kept
+        self.blocks = []
+        self.by_address = {}
+        self.sdna = None
+        self.truncated = False
+        self._keeping = False
+        self._kept = 0
+        if path is None:
+            # Filled in by BlendFeeder
+            self.compression = None
+            return
+        stream, self.compression = open_blend_stream(path)
+        try:
+            self.pointer_size, self.endian, self.version, large_bhead = parse_header(stream)
+            self._read_blocks(stream, large_bhead)
+        finally:
+            stream.close()
+        if self.sdna is None:
+            raise BlendReadError("No DNA1 block found")
+
+    def _bhead_format(self, large_bhead):
+        e = self.endian
+        if large_bhead:
+            # code, SDNAnr, old, len, nr
+            return struct.Struct(e + "4siQqq"), (0, 1, 2, 3, 4)
+        if self.pointer_size == 8:
+            # code, len, old, SDNAnr, nr
+            return struct.Struct(e + "4siQii"), (0, 3, 2, 1, 4)
+        return struct.Struct(e + "4siIii"), (0, 3, 2, 1, 4)
+
+    def _wants(self, code, length):
+        """Whether the payload of the next block should be kept in memory."""
+        if code == b"DNA1":
+            if length > self.max_block_size:
+                raise BlendReadError("DNA1 block too large")
+            return True
+        if code != b"DATA":
+            self._keeping = code in KEEP_CODES
+        if not self._keeping:
+            return False
+        if length <= self.max_block_size and self._kept + length <= self.max_kept:
+            return True
+        self.truncated = True
+        return False
+
+    def _add_block(self, code, sdna_index, old, count, data):
+        if code == b"DNA1":
+            self.sdna = SDNA(data, self.endian, self.pointer_size)
+            return
+        self._kept += len(data)
+        block = Block(code, sdna_index, old, count, data)
+        self.blocks.append(block)
+        self.by_address[old] = block
+
+    def _read_blocks(self, stream, large_bhead):
+        bhead, order = self._bhead_format(large_bhead)
+        seekable = isinstance(stream, io.BufferedReader)
+        while True:
+            raw = stream.read(bhead.size)
+            if len(raw) < bhead.size:
+                break
+            values = bhead.unpack(raw)
+            code, sdna_index, old, length, count = (values[i] for i in order)
+            if code == b"ENDB":
+                break
+            if length < 0:
+                raise BlendReadError("Corrupt block header")
+
+            if self._wants(code, length):
+                data = stream.read(length)
+                if len(data) < length:
+                    raise BlendReadError("Truncated .blend file")
+                self._add_block(code, sdna_index, old, count, data)
+            elif seekable:
+                stream.seek(length, io.SEEK_CUR)
+            else:
+                while length > 0:
+                    skipped = len(stream.read(min(length, 1024 * 1024)))
+                    if not skipped:
+                        raise BlendReadError("Truncated .blend file")
+                    length -= skipped
+
+    # --- decoding helpers ---
+
+    def struct_name(self, block):
+        return self.sdna.structs[block.sdna_index][0]
+
+    def get(self, block, path, default=None):
+        return self.sdna.get(self.struct_name(block), block.data, path, default)
+
+    def deref(self, address):
+        return self.by_address.get(address) if address else None
+
+    def id_properties(self, block, field="properties"):
+        """Decode the ID property group stored in ``id.<field>`` of a block."""
+        if not self.sdna.has_field(self.struct_name(block), f"id.{field}"):
+            return {}
+        group = self.deref(self.get(block, f"id.{field}"))
+        if group is None:
+            return {}
+        value = self._idprop_value(group)
+        return value if isinstance(value, dict) else {}
+
+    def _idprop_value(self, block, depth=0):
+        kind = self.get(block, "type")
+        if kind == IDP_INT or kind == IDP_BOOLEAN:
+            value = self.get(block, "data.val")
+            return bool(value) if kind == IDP_BOOLEAN else value
+        if kind == IDP_FLOAT:
+            return struct.unpack(self.endian + "f", struct.pack(self.endian + "i", self.get(block, "data.val")))[0]
+        if kind == IDP_DOUBLE:
+            raw = struct.pack(self.endian + "ii", self.get(block, "data.val"), self.get(block, "data.val2"))
+            return struct.unpack(self.endian + "d", raw)[0]
+        if kind == IDP_STRING:
+            target = self.deref(self.get(block, "data.pointer"))
+            return target.data.split(b"\x00", 1)[0].decode("utf-8", errors="replace") if target else None
+        if kind == IDP_GROUP and depth < 16:
+            children = {}
+            child = self.deref(self.get(block, "data.group.first"))
+            seen = set()
+            while child is not None and child.old not in seen:
+                seen.add(child.old)
+                children[self.get(child, "name")] = self._idprop_value(child, depth + 1)
+                child = self.deref(self.get(child, "next"))
+            return children
+        return None
+
+    # --- public data ---
+
+    def scenes(self):
+        """Render-relevant settings of every scene in the file."""
+        scenes = []
+        for block in self.blocks:
+            if block.code != b"SC\x00\x00":
+                continue
+            props = self.id_properties(block, "system_properties") or self.id_properties(block)
+            engine = self.get(block, "r.engine")
+            samples = None
+            if engine == "CYCLES":
+                samples = (props.get("cycles") or {}).get("samples")
+            elif engine and engine.startswith("BLENDER_EEVEE"):
+                samples = self.get(block, "eevee.taa_render_samples")
+            fps_base = self.get(block, "r.frs_sec_base") or 1.0
+            scenes.append({
+                "name": (self.get(block, "id.name") or "")[2:],
+                "engine": engine,
+                "resolution_x": self.get(block, "r.xsch"),
+                "resolution_y": self.get(block, "r.ysch"),
+                "resolution_percentage": self.get(block, "r.size"),
+                "frame_start": self.get(block, "r.sfra"),
+                "frame_end": self.get(block, "r.efra"),
+                "frame_step": self.get(block, "r.frame_step"),
+                "frame_current": self.get(block, "r.cfra"),
+                "fps": round(self.get(block, "r.frs_sec", 0) / fps_base, 3),
+                "samples": samples,
+                "_address": block.old,
+            })
+        return scenes
+
+    def active_scene(self, scenes=None):
+        scenes = self.scenes() if scenes is None else scenes
+        glob = next((b for b in self.blocks if b.code == b"GLOB"), None)
+        current = self.get(glob, "curscene") if glob is not None else None
+        for scene in scenes:
+            if scene["_address"] == current:
+                return scene
+        return scenes[0] if scenes else None
+
+    def texts(self):
+        """Contents of the Text datablocks stored in the file, by name."""
+        texts = {}
+        for block in self.blocks:
+            if block.code != b"TX\x00\x00":
+                continue
+            lines = []
+            line = self.deref(self.get(block, "lines.first"))
+            seen = set()
+            while line is not None and line.old not in seen:
+                seen.add(line.old)
+                chars = self.deref(self.get(line, "line"))
+                if chars is not None:
+                    lines.append(chars.data.split(b"\x00", 1)[0].decode("utf-8", errors="replace"))
+                line = self.deref(self.get(line, "next"))
+            texts[(self.get(block, "id.name") or "")[2:]] = "\n".join(lines)
+        return texts
+
+
+class BlendFeeder:
+    """Push-mode counterpart of ``BlendFile`` for data arriving in chunks.
+
+    Used while a file is being received: ``feed`` every chunk as it comes,
+    ``close`` returns the ``BlendFile``. Only kept blocks are buffered.
+    """
+
+    def __init__(self, max_block_size=16 * 1024 * 1024, max_kept=64 * 1024 * 1024):
+        self.blend = BlendFile(None, max_block_size=max_block_size, max_kept=max_kept)
+        self.header_read = False
+        self.done = False
+        self._magic = b""
+        self._decoder = None
+        self._buffer = bytearray()
+        self._bhead = None
+        self._order = None
+        # Header of the block whose payload is being buffered, bytes left to skip
+        self._block = None
+        self._skip = 0
+
+    def feed(self, data):
+        """Parse the next chunk of the file, raises BlendReadError on bad data."""
+        if self.done:
+            return
+        if self._magic is not None:
+            self._magic += bytes(data)
+            if len(self._magic) < 4:
+                return
+            data, self._magic = self._magic, None
+            self._start_decoder(data[:4])
+        try:
+            if self._decoder is not None:
+                data = self._decoder.decompress(bytes(data))
+            self._parse(data)
+        except (struct.error, ValueError, IndexError, KeyError, zlib.error) as e:
+            raise BlendReadError(f"Corrupt .blend file: {e}")
+
+    def _start_decoder(self, magic):
+        if magic.startswith(BLEND_MAGIC[:4]):
+            return
+        if magic.startswith(GZIP_MAGIC):
+            self.blend.compression = "gzip"
+            self._decoder = _FrameDecoder(lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+        elif magic == ZSTD_MAGIC:
+            self.blend.compression = "zstd"
+            self._decoder = _FrameDecoder(_zstd_decompressor)
+        else:
+            raise BlendReadError("Not a .blend file")
+
+    def _parse(self, data):
+        buf = self._buffer
+        if self._skip and not buf:
+            # Common case of a large skipped block: no copy at all
+            if self._skip >= len(data):
+                self._skip -= len(data)
+                return
+            data = data[self._skip:]
+            self._skip = 0
+        buf += data
+        blend = self.blend
+        pos = 0
+        while not self.done:
+            available = len(buf) - pos
+            if self._skip:
+                n = min(self._skip, available)
+                pos += n
+                self._skip -= n
+                if self._skip:
+                    break
+                continue
+            if not self.header_read:
+                if available < 12:
+                    break
+                size = 17 if buf[pos + 7:pos + 9] == b"17" else 12
+                if available < size:
+                    break
+                header = parse_header(io.BytesIO(bytes(buf[pos:pos + size])))
+                blend.pointer_size, blend.endian, blend.version, large_bhead = header
+                self._bhead, self._order = blend._bhead_format(large_bhead)
+                self.header_read = True
+                pos += size
+                continue
+            if self._block is None:
+                if available < self._bhead.size:
+                    break
+                values = self._bhead.unpack_from(buf, pos)
+                pos += self._bhead.size
+                code, sdna_index, old, length, count = (values[i] for i in self._order)
+                if code == b"ENDB":
+                    self.done = True
+                    break
+                if length < 0:
+                    raise BlendReadError("Corrupt block header")
+                if blend._wants(code, length):
+                    self._block = (code, sdna_index, old, count, length)
+                else:
+                    self._skip = length
+                continue
+            code, sdna_index, old, count, length = self._block
+            if available < length:
+                break
+            blend._add_block(code, sdna_index, old, count, bytes(buf[pos:pos + length]))
+            pos += length
+            self._block = None
+        del buf[:pos]
+
+    def close(self):
+        """The parsed ``BlendFile``, raises BlendReadError when the data was incomplete."""
+        if not self.header_read:
+            raise BlendReadError("Invalid .blend file signature")
+        if self._block is not None or self._skip:
+            raise BlendReadError("Truncated .blend file")
+        if self.blend.sdna is None:
+            raise BlendReadError("No DNA1 block found")
+        return self.blend
+
+
+def read_blend_info(path):
+    """Summary of a .blend file for scheduling: version, active scene, texts."""
+    try:
+        blend = BlendFile(path)
+        scenes = blend.scenes()
+        active = blend.active_scene(scenes)
+    except (struct.error, ValueError, IndexError, KeyError, EOFError) as e:
+        raise BlendReadError(f"Corrupt .blend file: {e}")
+    for scene in scenes:
+        scene.pop("_address")
+    return {
+        "version": f"{blend.version // 100}.{blend.version % 100}",
+        "compression": blend.compression,
+        "scene": active,
+        "scenes": scenes,
+        "texts": sorted(blend.texts()),
+    }
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_info(path, mtime_ns, size):
+    return read_blend_info(path)
+
+
+def blend_info(path):
+    """``read_blend_info`` cached until the file changes (mtime or size).
+
+    The returned dict is shared between callers and must not be modified.
+    """
+    st = os.stat(path)
+    return _cached_info(path, st.st_mtime_ns, st.st_size)
+
+
+def estimate_render(scene, frames=None):
+    """Rough render cost of a scene: output pixels, frames and sample-pixels."""
+    percentage = (scene.get("resolution_percentage") or 100) / 100
+    width = int((scene.get("resolution_x") or 0) * percentage)
+    height = int((scene.get("resolution_y") or 0) * percentage)
+    if frames is None:
+        step = max(1, scene.get("frame_step") or 1)
+        frames = len(range(scene.get("frame_start") or 1, (scene.get("frame_end") or 1) + 1, step))
+    samples = scene.get("samples") or 1
+    return {
+        "width": width,
+        "height": height,
+        "frames": frames,
+        "samples": scene.get("samples"),
+        "cost": width * height * samples * frames,
+    }
@@ -0,0 +1,152 @@
+"""Single-pass scanner for suspicious Python code in uploaded .blend files.
+
+All patterns are compiled into one regular expression alternation, so the
+input is walked once in C whatever the number of patterns. Input is either
+a memory map of the file or a stream fed chunk by chunk; the last bytes of
+each chunk are kept so that matches crossing chunk boundaries are found.
+
+Python in a .blend file can only run from its Text datablocks, so when the
+file can be parsed only those are scanned. Matches in mesh, image or other
+binary data are not reported then.
+"""
+import re
+import mmap
+import struct
+import logging
+
+from blend_reader import BlendFile, BlendReadError, open_blend_stream
+
+logger = logging.getLogger(__name__)
+
+SUSPICIOUS_PATTERNS = (
+    b"import os",
+    b"subprocess",
+    b"exec(",
+    b"eval(",
+    b"__import__",
+    b"open(",
+    b"file(",
+    b"input(",
+    b"raw_input",
+    b"system(",
+    b"popen(",
+)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def compile_patterns(patterns):
+    """One regular expression matching any of the literal ``patterns``."""
+    return re.compile(b"|".join(re.escape(p) for p in sorted(patterns, key=len, reverse=True)))
+
+
+class StreamScanner:
+    """Finds the first suspicious pattern in data fed in arbitrary chunks."""
+
+    def __init__(self, patterns=SUSPICIOUS_PATTERNS):
+        self._regex = compile_patterns(patterns)
+        self._overlap = max(len(p) for p in patterns) - 1
+        self._tail = b""
+        # Bytes fed so far
+        self.position = 0
+        self.match = None
+        self.match_offset = None
+
+    def feed(self, data):
+        """Scan the next chunk, returns the matched pattern once one is found."""
+        if self.match is not None or not len(data):
+            return self.match
+        # Matches starting in the previous chunk's tail and ending in this one
+        boundary = self._tail + bytes(data[:self._overlap])
+        m = self._regex.search(boundary)
+        if m is not None and m.start() < len(self._tail):
+            self._found(m, self.position - len(self._tail))
+        else:
+            m = self._regex.search(data)
+            if m is not None:
+                self._found(m, self.position)
+        self._tail = (self._tail + bytes(data[-self._overlap:]))[-self._overlap:] if self._overlap else b""
+        self.position += len(data)
+        return self.match
+
+    def _found(self, m, base):
+        self.match = m.group()
+        self.match_offset = base + m.start()
+
+    def result(self):
+        """``(suspicious, message)`` in the form used by the upload checks."""
+        if self.match is None:
+            return False, "No suspicious scripts detected"
+        return True, f"Suspicious pattern found: {self.match.decode('utf-8', errors='ignore')}"
+
+
+def scan_stream(stream, patterns=SUSPICIOUS_PATTERNS, chunk_size=CHUNK_SIZE):
+    """Scan a binary stream, reading it into one reused buffer."""
+    scanner = StreamScanner(patterns)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        n = stream.readinto(buffer)
+        if not n:
+            break
+        if scanner.feed(view[:n]) is not None:
+            break
+    return scanner
+
+
+def scan_blend_texts(blend, patterns=SUSPICIOUS_PATTERNS):
+    """Scan the Text datablocks of a parsed ``BlendFile``.
+
+    Returns None when some blocks were not kept, the caller should then
+    scan the whole file.
+    """
+    if blend.truncated:
+        return None
+    regex = compile_patterns(patterns)
+    for name, content in blend.texts().items():
+        m = regex.search(content.encode("utf-8"))
+        if m is not None:
+            return True, f"Suspicious pattern found: {m.group().decode('utf-8', errors='ignore')} (text '{name}')"
+    return False, "No suspicious scripts detected"
+
+
+def scan_texts(path, patterns=SUSPICIOUS_PATTERNS):
+    """Scan only the Text datablocks of a .blend file.
+
+    Returns None when the file cannot be parsed completely, the caller
+    should then scan the whole file.
+    """
+    try:
+        return scan_blend_texts(BlendFile(path), patterns)
+    except (BlendReadError, OSError, struct.error, ValueError, IndexError, KeyError, EOFError) as e:
+        logger.info(f"Scanning all of {path}, its blocks could not be read: {e}")
+        return None
+
+
+def scan_file(path, patterns=SUSPICIOUS_PATTERNS, block_aware=True):
+    """Scan a .blend file, returns ``(suspicious, message)``.
+
+    With ``block_aware`` only Text datablocks are scanned when the file can
+    be parsed. Otherwise every byte is scanned in one pass: uncompressed
+    files through a memory map, compressed ones while decompressing.
+    """
+    if block_aware:
+        result = scan_texts(path, patterns)
+        if result is not None:
+            return result
+    try:
+        stream, compression = open_blend_stream(path)
+    except BlendReadError:
+        stream, compression = open(path, "rb"), None
+    with stream:
+        if compression is None:
+            try:
+                mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return StreamScanner(patterns).result()
+            with mapped:
+                scanner = StreamScanner(patterns)
+                scanner.feed(mapped)
+                return scanner.result()
+        return scan_stream(stream, patterns).result()
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import subprocess
+
+import psutil
+
+from blender_runner import RenderError
+from render_queue import JobCancelled
+from render_progress import BlenderOutput
+from metrics import PROCESSES
+
+logger = logging.getLogger(__name__)
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blender_server.py")
+
+# How often blocking reads wake up to check for cancellation
+POLL_INTERVAL = 0.25
+
+
+class WarmWorker:
+    """A running ``blender_server.py`` process and its socket."""
+
+    def __init__(self, proc, sock, tmpdir):
+        self.proc = proc
+        self.sock = sock
+        self.tmpdir = tmpdir
+        self.pid = proc.pid
+        self.version = None
+        self.jobs = 0
+        self.buffer = b""
+        # Handles the output of the current (or last) render
+        self.output = BlenderOutput(pid=proc.pid)
+        self._reader = threading.Thread(target=self._read_stdout, name=f"blender-{proc.pid}-stdout", daemon=True)
+        self._reader.start()
+
+    def _read_stdout(self):
+        for line in self.proc.stdout:
+            self.output.feed(line)
+
+    def send(self, message):
+        self.sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def rss_mb(self):
+        try:
+            return psutil.Process(self.proc.pid).memory_info().rss // (1024 * 1024)
+        except psutil.Error:
+            return 0
+
+    def close(self, graceful=True):
+        if graceful and self.proc.poll() is None:
+            try:
+                self.send({"cmd": "quit"})
+                self.proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        PROCESSES.untrack(self.proc.pid)
+        self.sock.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+class WarmWorkerPool:
+    """Pool of long-lived Blender processes that render jobs over a socket.
+
+    Workers are started lazily, reused between jobs and recycled after
+    ``max_jobs`` renders or once their resident memory exceeds
+    ``max_rss_mb``. A worker that fails, times out or is cancelled is
+    killed and replaced on the next render.
+    """
+
+    def __init__(self, blender_bin, size=1, max_jobs=20, max_rss_mb=None,
+                 startup_timeout=120, server_script=SERVER_SCRIPT, server_args=(), env=None):
+        self.blender_bin = blender_bin
+        self.server_args = list(server_args)
+        self.env = env
+        self.size = max(1, int(size))
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.startup_timeout = startup_timeout
+        self.server_script = server_script
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _spawn(self):
+        tmpdir = tempfile.mkdtemp(prefix="blender-worker-")
+        sock_path = os.path.join(tmpdir, "pool.sock")
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(sock_path)
+        listener.listen(1)
+        listener.settimeout(POLL_INTERVAL)
+
+        cmd = [self.blender_bin, "--background", "--python", self.server_script, "--", "--connect", sock_path]
+        cmd += self.server_args
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=self.env)
+        PROCESSES.track(proc.pid, "warm", cmd)
+        deadline = time.monotonic() + self.startup_timeout
+        try:
+            while True:
+                try:
+                    conn, _ = listener.accept()
+                    break
+                except socket.timeout:
+                    if proc.poll() is not None:
+                        raise RenderError(f"Blender worker exited during startup (code {proc.returncode})")
+                    if time.monotonic() > deadline:
+                        raise RenderError("Blender worker did not start in time")
+        except Exception:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            PROCESSES.untrack(proc.pid)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+        finally:
+            listener.close()
+
+        conn.settimeout(POLL_INTERVAL)
+        worker = WarmWorker(proc, conn, tmpdir)
+        try:
+            info = self._read_message(worker, None, self.startup_timeout)
+        except Exception:
+            worker.close(graceful=False)
+            raise
+        worker.pid = info.get("pid", proc.pid)
+        worker.version = info.get("version")
+        logger.info(f"Started warm Blender worker {worker.pid} ({worker.version})")
+        return worker
+
+    def _read_message(self, worker, job, timeout):
+        deadline = time.monotonic() + timeout if timeout else None
+        while b"\n" not in worker.buffer:
+            if job is not None and job.cancel_event.is_set():
+                raise JobCancelled()
+            if deadline is not None and time.monotonic() > deadline:
+                raise RenderError(f"Render timed out after {timeout} seconds")
+            try:
+                chunk = worker.sock.recv(65536)
+            except socket.timeout:
+                continue
+            if not chunk:
+                if job is not None and job.cancel_event.is_set():
+                    raise JobCancelled()
+                raise RenderError("Blender worker exited unexpectedly")
+            worker.buffer += chunk
+        line, _, worker.buffer = worker.buffer.partition(b"\n")
+        return json.loads(line)
+
+    def _checkout(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._spawn()
+
+    def _checkin(self, worker):
+        reason = None
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            reason = f"{worker.jobs} jobs"
+        elif self.max_rss_mb and worker.rss_mb() > self.max_rss_mb:
+            reason = f"{worker.rss_mb()} MiB resident"
+        if reason:
+            logger.info(f"Recycling warm Blender worker {worker.pid} after {reason}")
+            worker.close()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def render(self, job, request, timeout=None, source=None):
+        """Render ``request`` on a warm worker and return the written paths."""
+        with self._slots:
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            worker = self._checkout()
+            job.processes.add(worker.proc)
+            worker.output = BlenderOutput(job, source=source, pid=worker.pid)
+            try:
+                worker.send(dict(request, cmd="render"))
+                response = self._read_message(worker, job, timeout)
+            except Exception:
+                worker.close(graceful=False)
+                raise
+            finally:
+                # The output handler stays until the next render: the reader
+                # thread may still be busy with the last lines of this one
+                job.processes.discard(worker.proc)
+            worker.jobs += 1
+            self._checkin(worker)
+
+        if not response.get("ok"):
+            raise RenderError(response.get("error") or "Render failed. See logs for details.")
+        return response.get("outputs", [])
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
@@ -0,0 +1,267 @@
+import os
+import logging
+import functools
+import threading
+import subprocess
+
+from render_queue import JobCancelled
+from render_progress import BlenderOutput
+from metrics import PROCESSES
+
+logger = logging.getLogger(__name__)
+
+DRAFT = "draft"
+FINAL = "final"
+# Scene overrides of each render quality, the final quality keeps the file's settings:
+# a fraction of its resolution percentage, a cap on the Cycles samples, denoising
+QUALITY_PROFILES = {
+    DRAFT: {"resolution_scale": 0.25, "max_samples": 16, "denoise": True},
+    FINAL: {},
+}
+
+def device_setup_expr(cycles_device="GPU", compute_device_type="CUDA", use_cpu=True):
+    """Script run inside Blender before rendering to pick the Cycles devices.
+
+    Device isolation between concurrent renders is done by the environment
+    (``CUDA_VISIBLE_DEVICES``), so every visible GPU is enabled here.
+    """
+    if cycles_device == "CPU":
+        return (
+            "import bpy;"
+            "bpy.context.scene.render.engine='CYCLES';"
+            "bpy.context.scene.cycles.device='CPU';"
+        )
+    use = "True" if use_cpu else "d.type != 'CPU'"
+    return (
+        "import bpy;"
+        "bpy.context.scene.render.engine='CYCLES';"
+        "bpy.context.scene.cycles.device='GPU';"
+        "prefs=bpy.context.preferences.addons['cycles'].preferences;"
+        f"prefs.compute_device_type='{compute_device_type}';"
+        "prefs.get_devices();"
+        f"[setattr(d, 'use', {use}) for d in prefs.devices];"
+    )
+
+
+def scene_setup_expr(request, quality=None):
+    """Per-request scene adjustments, run after the device setup.
+
+    The same script is used by one-shot processes (``--python-expr``) and
+    by warm workers (the ``script`` field of the request).
+    """
+    expr = ""
+    profile = QUALITY_PROFILES.get(quality or FINAL)
+    if profile:
+        expr += "s=bpy.context.scene;"
+        if "resolution_scale" in profile:
+            expr += (
+                "s.render.resolution_percentage="
+                f"max(1,int(s.render.resolution_percentage*{profile['resolution_scale']!r}));"
+            )
+        if "max_samples" in profile:
+            expr += f"s.cycles.samples=min(s.cycles.samples,{profile['max_samples']});"
+        if profile.get("denoise"):
+            expr += "s.cycles.use_denoising=True;"
+    border = request.get("border")
+    if border:
+        xmin, xmax, ymin, ymax = border
+        # Tiles are always written as fast-to-decode PNGs for stitching
+        expr += (
+            "r=bpy.context.scene.render;"
+            "r.use_border=True;"
+            "r.use_crop_to_border=True;"
+            f"r.border_min_x={xmin!r};r.border_max_x={xmax!r};"
+            f"r.border_min_y={ymin!r};r.border_max_y={ymax!r};"
+            "r.image_settings.file_format='PNG';"
+            "r.image_settings.compression=0;"
+        )
+    return expr
+
+
+def quality_scene(scene, quality=None):
+    """Scene settings read from a .blend file, as rendered at ``quality``."""
+    profile = QUALITY_PROFILES.get(quality or FINAL)
+    scene = dict(scene)
+    if "resolution_scale" in profile:
+        percentage = scene.get("resolution_percentage") or 100
+        scene["resolution_percentage"] = max(1, int(percentage * profile["resolution_scale"]))
+    if "max_samples" in profile and scene.get("samples"):
+        scene["samples"] = min(scene["samples"], profile["max_samples"])
+    return scene
+
+
+class RenderError(Exception):
+    """Raised when Blender fails or does not produce the expected output."""
+
+
+def build_command(blender_bin, request, setup_expr=None):
+    """Command line for a one-shot Blender process serving ``request``."""
+    cmd = [
+        blender_bin, "-b", request["blend_path"],
+        "--disable-autoexec",  # Désactive l'auto-exécution des scripts
+        "--python-expr", setup_expr or device_setup_expr(),
+        "-o", request["output_base"],
+    ]
+    if request.get("animation"):
+        # -s/-e/-j must come before -a, which renders the range
+        cmd += [
+            "-s", str(request["frame_start"]),
+            "-e", str(request["frame_end"]),
+            "-j", str(request.get("frame_step", 1)),
+            "-a",
+        ]
+    else:
+        cmd += ["-f", str(request["frame"])]
+    return cmd
+
+
+def run_blender(cmd, job, timeout=None, env=None, source=None):
+    """Run a Blender command for ``job``, reading its output as it comes.
+
+    Progress lines update ``job.progress``, other lines are logged one by
+    one. The process handle is registered in ``job.processes`` so the queue
+    can terminate it on cancellation.
+    """
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env, bufsize=1)
+    output = BlenderOutput(job, source=source, pid=proc.pid)
+    timed_out = threading.Event()
+
+    def expire():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, expire) if timeout else None
+    job.processes.add(proc)
+    PROCESSES.track(proc.pid, "render", cmd)
+    try:
+        if job.cancel_event.is_set():
+            proc.terminate()
+        if timer is not None:
+            timer.start()
+        for line in proc.stdout:
+            output.feed(line)
+        proc.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        proc.stdout.close()
+        job.processes.discard(proc)
+        PROCESSES.untrack(proc.pid)
+
+    logger.info(f"Blender[{proc.pid}] exited with code {proc.returncode}")
+
+    if timed_out.is_set():
+        raise RenderError(f"Render timed out after {timeout} seconds")
+
+    if job.cancel_event.is_set():
+        raise JobCancelled()
+
+    if proc.returncode != 0:
+        raise RenderError(output.errors() or "Render failed. See logs for details.")
+    return output.tail()
+
+
+@functools.lru_cache(maxsize=8)
+def blender_version(blender_bin, timeout=60):
+    """First line of ``blender --version``, e.g. ``Blender 4.4.3``."""
+    try:
+        result = subprocess.run([blender_bin, "--version"], capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Could not read the Blender version: {e}")
+        return "unknown"
+    for line in result.stdout.splitlines():
+        if line.startswith("Blender"):
+            return line.strip()
+    return "unknown"
+
+
+def frame_path(output_base, frame):
+    """Path Blender writes for ``-o output_base`` and the given frame."""
+    return f"{output_base}{frame:04d}.png"
+
+
+class BlenderBackend:
+    """Runs render requests on a device slot.
+
+    Slots that have a warm worker pool in ``pools`` render on it, the others
+    start a fresh Blender process with the slot's device environment.
+    """
+
+    def __init__(self, blender_bin, compute_device_type="CUDA", pools=None, timeout=None):
+        self.blender_bin = blender_bin
+        self.compute_device_type = compute_device_type
+        self.pools = pools or {}
+        self.timeout = timeout
+
+    def run(self, job, request, slot, timeout=None):
+        timeout = timeout or self.timeout
+        script = scene_setup_expr(request, job.settings.get("quality"))
+        pool = self.pools.get(slot.name)
+        if pool is not None:
+            pool.render(job, dict(request, script=script), timeout=timeout, source=slot.name)
+            return
+        setup = device_setup_expr(slot.cycles_device, self.compute_device_type, use_cpu=slot.devices is None)
+        run_blender(build_command(self.blender_bin, request, setup + script), job,
+                    timeout=timeout, env=slot.environ(), source=slot.name)
+
+
+def render_on_slot(backend, scheduler, job, request, expected, retries=0, timeout=None, label="", record=None):
+    """Run ``request`` on a device slot, retrying until ``expected`` files exist.
+
+    Files in ``expected`` are removed first so that leftovers from an
+    earlier render are never mistaken for fresh output. The attempt count
+    and the slot used are stored in the ``record`` dict when one is given.
+    """
+    record = {} if record is None else record
+    for path in expected:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    record["attempts"] = 0
+    while True:
+        record["attempts"] += 1
+        try:
+            with scheduler.slot(job.settings.get("device"), cancel_event=job.cancel_event) as slot:
+                record["device"] = slot.name
+                logger.info(f"Rendering {label or job.filename} on {slot.name}")
+                backend.run(job, request, slot, timeout=timeout)
+            missing = [os.path.basename(p) for p in expected if not os.path.isfile(p)]
+            if missing:
+                raise RenderError(f"Output not written: {', '.join(missing)}")
+            record["error"] = None
+            return
+        except JobCancelled:
+            raise
+        except Exception as e:
+            record["error"] = str(e)
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            if record["attempts"] > retries:
+                raise
+            logger.warning(f"Rendering {label or job.filename} failed, retrying: {e}")
+
+
+def slot_names(records):
+    """The slots that ``render_on_slot`` calls recorded, for ``job.device``."""
+    return ", ".join(sorted({record["device"] for record in records if record.get("device")}))
+
+
+def render_still(backend, job, slot):
+    """Render a single frame of ``job.blend_path`` on a device slot."""
+    frame = int(job.settings.get("frame", 1))
+    request = {"blend_path": job.blend_path, "output_base": job.output_base, "frame": frame}
+    output_image = frame_path(job.output_base, frame)
+    # Never write into an older output, it may be shared with the render cache
+    try:
+        os.remove(output_image)
+    except FileNotFoundError:
+        pass
+    logger.info(f"Rendering file: {job.blend_path} on {slot.name}")
+    backend.run(job, request, slot)
+
+    if not os.path.isfile(output_image):
+        raise RenderError("Render succeeded but output image not found.")
+    logger.info(f"Render succeeded: {output_image}")
+    job.outputs = [os.path.basename(output_image)]
@@ -0,0 +1,130 @@
+"""Long-lived Blender render server.
+
+Started by ``blender_pool.WarmWorkerPool`` as::
+
+    blender --background --python blender_server.py -- --connect SOCKET
+
+The server connects back to the pool's Unix socket and exchanges one JSON
+object per line:
+
+* server -> pool on startup: ``{"event": "ready", "pid": ..., "version": ...}``
+* pool -> server: ``{"cmd": "render", "blend_path": ..., "output_base": ..., "frame": 1}``,
+  or with ``"animation": true, "frame_start": ..., "frame_end": ..., "frame_step": ...``;
+  an optional ``"script"`` adjusts the scene after loading
+* server -> pool: ``{"ok": true, "outputs": [...]}`` or ``{"ok": false, "error": ...}``
+* pool -> server: ``{"cmd": "quit"}``
+
+Cycles device preferences are initialised once at startup and reused by
+every render. This module must stay importable without ``bpy`` so that the
+fake Blender used for testing can serve the same protocol.
+"""
+import os
+import sys
+import json
+import socket
+import argparse
+import traceback
+
+
+class BpyRenderer:
+    """Renders requests with the real Blender Python API."""
+
+    def __init__(self, device_type="CUDA", cycles_device="GPU", use_cpu=True):
+        import bpy
+        self.bpy = bpy
+        self.cycles_device = cycles_device
+        if cycles_device == "GPU":
+            prefs = bpy.context.preferences.addons['cycles'].preferences
+            prefs.compute_device_type = device_type
+            prefs.get_devices()
+            for d in prefs.devices:
+                d.use = use_cpu or d.type != 'CPU'
+        # Same guarantee as --disable-autoexec for the cold path
+        bpy.context.preferences.filepaths.use_scripts_auto_execute = False
+
+    @property
+    def version(self):
+        return self.bpy.app.version_string
+
+    def render(self, request):
+        bpy = self.bpy
+        bpy.ops.wm.open_mainfile(filepath=request["blend_path"], load_ui=False, use_scripts=False)
+        scene = bpy.context.scene
+        scene.render.engine = 'CYCLES'
+        scene.cycles.device = self.cycles_device
+        if request.get("script"):
+            # Scene adjustments generated by blender_runner.scene_setup_expr
+            exec(request["script"], {"bpy": bpy})
+        scene.render.filepath = request["output_base"]
+
+        if request.get("animation"):
+            start, end = int(request["frame_start"]), int(request["frame_end"])
+            step = int(request.get("frame_step", 1))
+            scene.frame_start, scene.frame_end, scene.frame_step = start, end, step
+            bpy.ops.render.render(animation=True)
+            return [scene.render.frame_path(frame=f) for f in range(start, end + 1, step)]
+
+        frame = int(request.get("frame", 1))
+        scene.frame_set(frame)
+        bpy.ops.render.render(write_still=True)
+        return [scene.render.frame_path(frame=frame)]
+
+
+def send(sock_file, message):
+    sock_file.write(json.dumps(message) + "\n")
+    sock_file.flush()
+
+
+def serve(connect_path, renderer):
+    """Connect to the pool and handle requests until told to quit."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(connect_path)
+    sock_file = sock.makefile("rw", encoding="utf-8")
+    send(sock_file, {"event": "ready", "pid": os.getpid(), "version": renderer.version})
+
+    for line in sock_file:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            send(sock_file, {"ok": False, "error": "Malformed request"})
+            continue
+
+        cmd = request.get("cmd")
+        if cmd == "quit":
+            break
+        if cmd != "render":
+            send(sock_file, {"ok": False, "error": f"Unknown command: {cmd}"})
+            continue
+
+        try:
+            outputs = renderer.render(request)
+            response = {"ok": True, "outputs": outputs}
+        except Exception as e:
+            traceback.print_exc()
+            response = {"ok": False, "error": f"Error: {e}"}
+        # Blender's own progress output goes to stdout, flush it before replying
+        sys.stdout.flush()
+        send(sock_file, response)
+
+    sock_file.close()
+    sock.close()
+
+
+def parse_args(argv):
+    # Blender passes its own arguments through; ours come after "--"
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(prog="blender_server")
+    parser.add_argument("--connect", required=True, help="Unix socket of the worker pool")
+    parser.add_argument("--device-type", default="CUDA", help="Cycles compute device type")
+    parser.add_argument("--device", default="GPU", choices=["GPU", "CPU"], help="Cycles render device")
+    parser.add_argument("--no-cpu", action="store_true", help="Do not add the CPU to GPU renders")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    serve(args.connect, BpyRenderer(args.device_type, args.device, use_cpu=not args.no_cpu))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
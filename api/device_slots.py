@@ -0,0 +1,158 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+
+from leases import LOCK_SUFFIX, holder, try_acquire
+from render_queue import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+GPU = "gpu"
+CPU = "cpu"
+ANY = "any"
+
+
+class DeviceSlot:
+    """A group of devices that a single Blender process renders on.
+
+    GPU slots are isolated through ``CUDA_VISIBLE_DEVICES`` so that Blender
+    only sees the devices of its slot. A GPU slot without device ids uses
+    every visible device, which is the behaviour of a single-slot setup.
+    """
+
+    def __init__(self, name, kind, devices=None):
+        self.name = name
+        self.kind = kind
+        self.devices = tuple(devices) if devices else None
+        self.busy = False
+        # Lease held on the slot while it renders, when slots are shared between processes
+        self.lease = None
+
+    @property
+    def cycles_device(self):
+        return "GPU" if self.kind == GPU else "CPU"
+
+    def environ(self, base=None):
+        env = dict(os.environ if base is None else base)
+        if self.kind == CPU:
+            env["CUDA_VISIBLE_DEVICES"] = ""
+        elif self.devices is not None:
+            env["CUDA_VISIBLE_DEVICES"] = ",".join(self.devices)
+        return env
+
+    def __repr__(self):
+        return f"DeviceSlot({self.name!r}, {self.kind!r}, {self.devices!r})"
+
+
+def parse_inventory(spec, cpu_slot=True):
+    """Build slots from a device spec such as ``"0,1,2"`` or ``"0+1,2"``.
+
+    Commas separate slots, ``+`` groups several devices into one slot. An
+    empty spec yields a single slot using all visible GPUs.
+    """
+    slots = []
+    for group in (spec or "").split(","):
+        devices = [d.strip() for d in group.split("+") if d.strip()]
+        if devices:
+            slots.append(DeviceSlot(f"gpu{'+'.join(devices)}", GPU, devices))
+    if not slots and spec is None:
+        slots.append(DeviceSlot("gpu", GPU))
+    if cpu_slot:
+        slots.append(DeviceSlot("cpu", CPU))
+    return slots
+
+
+def inventory_from_env(spec=None, cpu_slot=True, environ=None):
+    """Slots from an explicit spec, falling back to ``CUDA_VISIBLE_DEVICES``."""
+    environ = os.environ if environ is None else environ
+    if not spec:
+        spec = environ.get("CUDA_VISIBLE_DEVICES")
+    return parse_inventory(spec, cpu_slot=cpu_slot)
+
+
+class DeviceScheduler:
+    """Hands out device slots so concurrent renders never share a device.
+
+    ``acquire`` takes a preference: ``"gpu"`` (falls back to the CPU slot
+    only when no GPU slot is configured), ``"cpu"``, or ``"any"`` (GPU slots
+    first, then the CPU slot).
+
+    With ``lease_dir`` each slot is also leased in that directory while it
+    is in use, so that processes sharing the devices (gunicorn workers)
+    never render on the same slot at the same time.
+    """
+
+    def __init__(self, slots, lease_dir=None):
+        self.slots = list(slots)
+        self.lease_dir = lease_dir
+        if lease_dir is not None:
+            os.makedirs(lease_dir, exist_ok=True)
+        self._cond = threading.Condition()
+
+    def _lease_path(self, slot):
+        return os.path.join(self.lease_dir, f"device-{slot.name}{LOCK_SUFFIX}")
+
+    def _take(self, slot):
+        # Called with the condition held
+        if slot.busy:
+            return False
+        if self.lease_dir is not None:
+            slot.lease = try_acquire(self._lease_path(slot), name=slot.name)
+            if slot.lease is None:
+                return False
+        slot.busy = True
+        return True
+
+    def candidates(self, preference):
+        """Slots a job with this device preference may run on, in order of preference."""
+        gpus = [s for s in self.slots if s.kind == GPU]
+        cpus = [s for s in self.slots if s.kind == CPU]
+        if preference == CPU:
+            return cpus
+        if preference == ANY:
+            return gpus + cpus
+        return gpus or cpus
+
+    def acquire(self, preference=GPU, cancel_event=None, timeout=None):
+        candidates = self.candidates(preference or GPU)
+        if not candidates:
+            raise ValueError(f"No device slot available for '{preference}'")
+        with self._cond:
+            waited = 0.0
+            while True:
+                for slot in candidates:
+                    if self._take(slot):
+                        return slot
+                if cancel_event is not None and cancel_event.is_set():
+                    raise JobCancelled()
+                if timeout is not None and waited >= timeout:
+                    raise TimeoutError("Timed out waiting for a device slot")
+                self._cond.wait(0.5)
+                waited += 0.5
+
+    def release(self, slot):
+        with self._cond:
+            slot.busy = False
+            if slot.lease is not None:
+                slot.lease.release()
+                slot.lease = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, preference=GPU, cancel_event=None, timeout=None):
+        slot = self.acquire(preference, cancel_event=cancel_event, timeout=timeout)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def status(self):
+        with self._cond:
+            slots = [{"name": s.name, "kind": s.kind, "devices": s.devices, "busy": s.busy} for s in self.slots]
+        if self.lease_dir is not None:
+            for slot, info in zip(self.slots, slots):
+                owner = holder(self._lease_path(slot))
+                info["pid"] = owner["pid"] if owner else None
+                info["busy"] = info["busy"] or owner is not None
+        return slots
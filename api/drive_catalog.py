@@ -0,0 +1,159 @@
+"""Process-wide cache of the .blend files available on Google Drive.
+
+The first refresh lists every matching file (all pages) and records a
+changes-feed page token; later refreshes only apply what changed since,
+through ``changes().list``. Pages read the cached list and only trigger a
+refresh once it is older than ``ttl``; while one thread refreshes, the
+others keep serving the previous list.
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+FILE_FIELDS = "id, name, mimeType, size, modifiedTime, md5Checksum, trashed"
+BLEND_MIME_TYPES = ("application/x-blender",)
+BLEND_QUERY = "trashed=false and (name contains '.blend' or mimeType='application/x-blender')"
+PAGE_SIZE = 1000
+
+
+def is_blend(file):
+    return not file.get("trashed") and (
+        file.get("name", "").lower().endswith(".blend") or file.get("mimeType") in BLEND_MIME_TYPES
+    )
+
+
+class DriveCatalog:
+    """Cached, incrementally refreshed listing of the .blend files on Drive.
+
+    ``service_factory`` returns a Drive v3 service usable by the calling
+    thread; it is called on each refresh, from whichever thread refreshes.
+    ``on_change`` is called with the added or modified files after each
+    refresh that found some.
+    """
+
+    def __init__(self, service_factory, ttl=60, on_change=None):
+        self._service_factory = service_factory
+        self._on_change = on_change
+        self.ttl = ttl
+        self._files = {}
+        self._page_token = None
+        self._refreshed_at = None
+        self._refresh_lock = threading.Lock()
+        self.last_error = None
+        self.stats = {"full_listings": 0, "incremental": 0, "api_calls": 0, "errors": 0}
+
+    def _execute(self, request):
+        self.stats["api_calls"] += 1
+        return request.execute()
+
+    def files(self, max_age=None):
+        """The cached files, newest first, refreshed when older than ``max_age``."""
+        max_age = self.ttl if max_age is None else max_age
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= max_age:
+            # Only wait for a refresh running elsewhere when there is nothing to serve yet
+            if self._refresh_lock.acquire(blocking=self._refreshed_at is None):
+                try:
+                    if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= max_age:
+                        self._refresh()
+                finally:
+                    self._refresh_lock.release()
+        return sorted(self._files.values(), key=lambda f: f.get("modifiedTime", ""), reverse=True)
+
+    def refresh(self):
+        """Refresh now, returns the list of added or modified files."""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def get(self, file_id):
+        return self._files.get(file_id)
+
+    def find(self, name):
+        """The most recently modified file called ``name``."""
+        matches = [f for f in self._files.values() if f["name"] == name]
+        return max(matches, key=lambda f: f.get("modifiedTime", ""), default=None)
+
+    def _refresh(self):
+        try:
+            service = self._service_factory()
+            if self._page_token is None:
+                changed = self._full_listing(service)
+            else:
+                changed = self._apply_changes(service)
+            self.last_error = None
+        except Exception as e:
+            # Keep serving the previous list, try again after another ttl
+            self.stats["errors"] += 1
+            self.last_error = str(e)
+            if getattr(getattr(e, "resp", None), "status", None) in (404, 410):
+                # Expired changes token, list everything again next time
+                self._page_token = None
+            logger.error(f"Failed to refresh the Drive catalog: {e}")
+            changed = []
+        self._refreshed_at = time.monotonic()
+        if changed and self._on_change is not None:
+            try:
+                self._on_change(changed)
+            except Exception as e:
+                logger.error(f"Drive catalog change handler failed: {e}")
+        return changed
+
+    def _full_listing(self, service):
+        # Token first, so changes made while listing are picked up next time
+        token = self._execute(service.changes().getStartPageToken())["startPageToken"]
+        files = {}
+        page_token = None
+        while True:
+            result = self._execute(service.files().list(
+                q=BLEND_QUERY,
+                pageSize=PAGE_SIZE,
+                pageToken=page_token,
+                orderBy="modifiedTime desc",
+                fields=f"nextPageToken, files({FILE_FIELDS})",
+            ))
+            for f in result.get("files", []):
+                if is_blend(f):
+                    files[f["id"]] = f
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                break
+        changed = [f for f in files.values() if self._files.get(f["id"]) != f]
+        self._files = files
+        self._page_token = token
+        self.stats["full_listings"] += 1
+        logger.info(f"Drive catalog: {len(files)} .blend file(s) listed")
+        return changed
+
+    def _apply_changes(self, service):
+        # Readers iterate the current dict without the lock, so work on a copy
+        files = dict(self._files)
+        changed = {}
+        removed = 0
+        page_token = self._page_token
+        while True:
+            result = self._execute(service.changes().list(
+                pageToken=page_token,
+                pageSize=PAGE_SIZE,
+                spaces="drive",
+                includeRemoved=True,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))",
+            ))
+            for change in result.get("changes", []):
+                f = change.get("file")
+                if change.get("removed") or f is None or not is_blend(f):
+                    if files.pop(change["fileId"], None) is not None:
+                        removed += 1
+                    changed.pop(change["fileId"], None)
+                elif files.get(f["id"]) != f:
+                    files[f["id"]] = f
+                    changed[f["id"]] = f
+            if "newStartPageToken" in result:
+                break
+            page_token = result["nextPageToken"]
+        self._files = files
+        self._page_token = result["newStartPageToken"]
+        self.stats["incremental"] += 1
+        if changed or removed:
+            logger.info(f"Drive catalog: {len(changed)} file(s) changed, {removed} removed")
+        return list(changed.values())
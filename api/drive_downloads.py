@@ -0,0 +1,329 @@
+"""Content-addressed, resumable downloads of Google Drive files.
+
+Downloaded contents are stored once per ``md5Checksum`` in a cache
+directory and hard linked into the uploads under the Drive file name, so a
+file is never downloaded again while its checksum is unchanged, even when
+renamed or duplicated on Drive. Downloads run on a bounded thread pool in
+``Range`` requests of ``chunk_size`` bytes, appended to a ``.part`` file
+that a later attempt resumes from. Finished files are renamed into place
+atomically. Processes sharing the uploads hold a lease on a content while
+they download it, so it is fetched once.
+
+Every requested file has a ``Download`` status; a render waits on the one
+of its own file with ``wait``.
+"""
+import os
+import re
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from leases import LOCK_SUFFIX, acquire
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+DONE = "done"
+FAILED = "failed"
+
+CACHE_DIRNAME = ".drive-cache"
+PUBLISH_PREFIX = ".drive-"
+
+
+class DownloadError(Exception):
+    """Raised when a Drive download fails or its content does not match."""
+
+
+class Download:
+    """Status of the download of one Drive file to one local name."""
+
+    def __init__(self, file, name, key):
+        self.file_id = file["id"]
+        self.name = name
+        self.key = key
+        self.md5 = file.get("md5Checksum")
+        self.size = int(file["size"]) if file.get("size") else None
+        self.modified_time = file.get("modifiedTime")
+        self.state = QUEUED
+        self.bytes_done = 0
+        # True when no byte had to be downloaded
+        self.cached = False
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.state in (DONE, FAILED)
+
+    def to_dict(self):
+        return {
+            "file_id": self.file_id,
+            "name": self.name,
+            "md5": self.md5,
+            "state": self.state,
+            "size": self.size,
+            "bytes_done": self.bytes_done,
+            "cached": self.cached,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def local_name(name):
+    """Name of a Drive file in the uploads, None when it cannot be stored."""
+    name = os.path.basename(name.replace("\\", "/"))
+    if not name or name.startswith("."):
+        return None
+    return name
+
+
+def content_key(file):
+    if file.get("md5Checksum"):
+        return file["md5Checksum"]
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", f"{file['id']}-{file.get('modifiedTime', '')}")
+
+
+class DownloadManager:
+    """Downloads Drive files to ``dest_dir`` through a content-addressed cache.
+
+    ``service_factory`` returns a Drive service owned by the calling thread
+    (the HTTP client is not thread-safe). Up to ``max_orphan_bytes``
+    of cached contents no longer linked from ``dest_dir`` are kept.
+    """
+
+    def __init__(self, service_factory, dest_dir, workers=4, chunk_size=8 * 1024 * 1024,
+                 max_orphan_bytes=2 * 1024 * 1024 * 1024):
+        self._service_factory = service_factory
+        self.dest_dir = dest_dir
+        self.cache_dir = os.path.join(dest_dir, CACHE_DIRNAME)
+        self.chunk_size = chunk_size
+        self.max_orphan_bytes = max_orphan_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="drive-download")
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._downloads = {}
+
+    # --- public API ---
+
+    def request(self, file):
+        """Make sure ``file`` (Drive metadata) is in the uploads, returns its ``Download``.
+
+        A download already queued or running for the same content is
+        shared; a file whose content is already in place is not queued.
+        """
+        name = local_name(file["name"])
+        if name is None:
+            logger.warning(f"Not downloading Drive file with unusable name: {file['name']!r}")
+            return None
+        key = content_key(file)
+        with self._lock:
+            current = self._downloads.get(name)
+            if current is not None and current.key == key and (not current.finished or current.state == DONE):
+                if not current.finished or self._is_linked(name, key):
+                    return current
+            download = Download(file, name, key)
+            self._downloads[name] = download
+            if self._is_linked(name, key):
+                download.cached = True
+                download.bytes_done = download.size or 0
+                self._finish(download, DONE)
+                return download
+        self._executor.submit(self._run, download)
+        return download
+
+    def request_all(self, files):
+        return [self.request(f) for f in files]
+
+    def get(self, name):
+        return self._downloads.get(name)
+
+    def status(self):
+        return [d.to_dict() for d in sorted(self._downloads.values(), key=lambda d: d.created_at, reverse=True)]
+
+    def wait(self, name, timeout=None, cancel_event=None, poll=0.25):
+        """Wait until the download of ``name`` (if any) is finished.
+
+        Returns the ``Download``, or None when no download was requested for
+        that name. Stops early when ``cancel_event`` is set.
+        """
+        download = self._downloads.get(name)
+        if download is None:
+            return None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not download.event.wait(poll):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return download
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def cleanup(self):
+        """Remove temporary links left by an interrupted process (partial contents are kept)."""
+        remove_partial_downloads(self.dest_dir)
+
+    # --- internals ---
+
+    def _blob_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _is_linked(self, name, key):
+        """Whether the uploads file ``name`` is the cached content ``key``."""
+        try:
+            return os.path.samefile(os.path.join(self.dest_dir, name), self._blob_path(key))
+        except OSError:
+            return False
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _finish(self, download, state, error=None):
+        download.state = state
+        download.error = error
+        download.finished_at = time.time()
+        download.event.set()
+
+    def _run(self, download):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            blob = self._blob_path(download.key)
+            # Same content requested under several names, or by several
+            # processes of the app: fetched only once
+            with self._key_lock(download.key), acquire(blob + LOCK_SUFFIX, name="download"):
+                if not os.path.exists(blob) and not self._adopt(download, blob):
+                    download.state = DOWNLOADING
+                    self._fetch(download, blob)
+                else:
+                    download.cached = True
+                    download.bytes_done = download.size or os.path.getsize(blob)
+            self._publish(blob, download.name)
+            self._finish(download, DONE)
+            logger.info(
+                f"Drive file {download.name} ready"
+                f" ({'cached' if download.cached else f'{download.bytes_done} bytes downloaded'})"
+            )
+            self._prune()
+        except Exception as e:
+            logger.error(f"Failed to download {download.name} from Drive: {e}")
+            self._finish(download, FAILED, str(e))
+
+    def _adopt(self, download, blob):
+        """Reuse an identical file already in the uploads (e.g. from an older version)."""
+        dest = os.path.join(self.dest_dir, download.name)
+        if not download.md5 or not os.path.isfile(dest) or os.path.getsize(dest) != download.size:
+            return False
+        if _hash_file(dest, hashlib.md5()).hexdigest() != download.md5:
+            return False
+        try:
+            os.link(dest, blob)
+        except OSError:
+            shutil.copyfile(dest, blob)
+        return True
+
+    def _fetch(self, download, blob):
+        part = f"{blob}.part"
+        md5 = hashlib.md5()
+        offset = 0
+        if os.path.exists(part):
+            offset = os.path.getsize(part)
+            if download.size is not None and offset > download.size:
+                os.remove(part)
+                offset = 0
+            elif offset:
+                md5 = _hash_file(part, hashlib.md5())
+                logger.info(f"Resuming download of {download.name} at {offset} bytes")
+        download.bytes_done = offset
+
+        request = self._service_factory().files().get_media(fileId=download.file_id)
+        with open(part, "ab") as out:
+            while download.size is None or offset < download.size:
+                headers = dict(request.headers)
+                headers["range"] = f"bytes={offset}-{offset + self.chunk_size - 1}"
+                resp, content = request.http.request(request.uri, "GET", headers=headers)
+                if resp.status == 416:
+                    break
+                if resp.status not in (200, 206):
+                    raise DownloadError(f"HTTP {resp.status} downloading {download.name}")
+                if resp.status == 200 and offset:
+                    # Range ignored, the whole file was sent again
+                    out.seek(0)
+                    out.truncate()
+                    md5 = hashlib.md5()
+                    offset = 0
+                out.write(content)
+                md5.update(content)
+                offset += len(content)
+                download.bytes_done = offset
+                if resp.status == 200 or len(content) < self.chunk_size:
+                    break
+        if download.md5 and md5.hexdigest() != download.md5:
+            os.remove(part)
+            raise DownloadError(f"Checksum mismatch for {download.name}")
+        os.replace(part, blob)
+
+    def _publish(self, blob, name):
+        dest = os.path.join(self.dest_dir, name)
+        if os.path.exists(dest) and os.path.samefile(dest, blob):
+            # rename() between two links of the same file would do nothing
+            return
+        tmp = os.path.join(self.dest_dir, f"{PUBLISH_PREFIX}{uuid.uuid4().hex[:12]}.part")
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, dest)
+
+    def _prune(self):
+        """Delete the oldest unlinked contents beyond ``max_orphan_bytes``."""
+        orphans = []
+        try:
+            entries = list(os.scandir(self.cache_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.endswith((".part", LOCK_SUFFIX)):
+                continue
+            st = entry.stat()
+            if st.st_nlink == 1:
+                orphans.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in orphans)
+        for _, size, path in sorted(orphans):
+            if total <= self.max_orphan_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def remove_partial_downloads(directory):
+    """Remove the temporary links of ``directory`` left by an interrupted process."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith(PUBLISH_PREFIX) and name.endswith(".part"):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def _hash_file(path, digest):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest
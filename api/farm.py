@@ -0,0 +1,344 @@
+"""Render farm coordination: render nodes pull the app's jobs over HTTP.
+
+With ``FARM_MODE=coordinator`` the render queue hands each job to
+``Farm.execute`` instead of rendering it here. The job becomes a task that
+a worker (``farm_worker.py``) leases, then:
+
+* fetches the .blend by its SHA-256 (``blob_path``), keeping a local copy
+  per content so each node downloads a file once,
+* renders it on its own device slots and heartbeats with its progress,
+* uploads the outputs (``write_output``) and reports the result
+  (``complete``).
+
+A worker silent for ``worker_timeout`` seconds is considered dead and its
+tasks are leased again, at most ``max_attempts`` times in total. Each
+lease is numbered (``attempt``): reports of an older lease are refused, so
+a worker that comes back late cannot overwrite the result of its
+replacement.
+"""
+import os
+import time
+import uuid
+import heapq
+import logging
+import itertools
+import threading
+
+from blender_runner import RenderError
+from render_cache import file_digest
+from render_queue import JobCancelled, DONE, FAILED, CANCELLED, FINAL_STATES
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+
+
+class FarmError(Exception):
+    """A worker's request does not match the task's current lease."""
+
+
+class FarmTask:
+    """A render job waiting for, or leased to, a worker."""
+
+    def __init__(self, job, blob):
+        self.id = uuid.uuid4().hex[:12]
+        self.job = job
+        self.blob = blob
+        self.state = PENDING
+        self.worker = None
+        # Number of the current lease, 0 before the first one
+        self.attempt = 0
+        self.error = None
+        self.outputs = []
+        self.finished = threading.Event()
+
+    def lease_dict(self):
+        """What a worker needs to render the task."""
+        return {
+            "id": self.id,
+            "attempt": self.attempt,
+            "job_id": self.job.id,
+            "filename": self.job.filename,
+            "blob": self.blob,
+            "settings": dict(self.job.settings),
+            "estimate": self.job.estimate,
+        }
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "job_id": self.job.id,
+            "filename": self.job.filename,
+            "state": self.state,
+            "worker": self.worker,
+            "attempt": self.attempt,
+        }
+
+
+class FarmWorker:
+    """The coordinator's view of a worker node."""
+
+    def __init__(self, worker_id, name, slots):
+        self.id = worker_id
+        self.name = name
+        self.slots = slots
+        self.last_seen = time.time()
+        self.tasks = set()
+        self.completed = 0
+        self.dead = False
+        # Lease requests of the worker waiting for a task: it is alive meanwhile
+        self.waiting = 0
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "slots": self.slots,
+            "last_seen": self.last_seen,
+            "alive": not self.dead,
+            "tasks": sorted(self.tasks),
+            "completed": self.completed,
+        }
+
+
+class Farm:
+    """Tasks waiting for workers, the workers seen, and their leases."""
+
+    def __init__(self, output_dir, worker_timeout=30, max_attempts=3):
+        self.output_dir = output_dir
+        self.worker_timeout = worker_timeout
+        self.max_attempts = max_attempts
+        self._tasks = {}
+        # (-priority, sequence, task id): highest priority, then oldest first
+        self._pending = []
+        self._sequence = itertools.count()
+        self._workers = {}
+        # SHA-256 -> path of the .blend files of the current tasks
+        self._blobs = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+
+    # --- coordinator side ---
+
+    def execute(self, job, blob):
+        """Render ``job`` on a worker and wait for the result.
+
+        Sets ``job.outputs`` on success, raises ``JobCancelled`` once the
+        job is cancelled and ``RenderError`` when the render failed.
+        """
+        task = FarmTask(job, blob)
+        with self._lock:
+            self._blobs[blob] = job.blend_path
+            self._tasks[task.id] = task
+            self._push(task)
+        logger.info(f"Farm task {task.id} waiting for a worker: job {job.id} ({job.filename})")
+        try:
+            # Waking up regularly to notice cancellations and dead workers
+            while not task.finished.wait(0.5):
+                if job.cancel_event.is_set():
+                    with self._lock:
+                        self._finish(task, CANCELLED)
+                    break
+                self.reap()
+        finally:
+            with self._lock:
+                # A worker still rendering it learns on its next heartbeat
+                self._tasks.pop(task.id, None)
+                if not any(t.blob == blob for t in self._tasks.values()):
+                    self._blobs.pop(blob, None)
+        if task.state == CANCELLED:
+            raise JobCancelled()
+        if task.state == FAILED:
+            raise RenderError(task.error or "Render failed on the farm")
+        job.outputs = list(task.outputs)
+
+    def _push(self, task):
+        # Called with the lock held
+        heapq.heappush(self._pending, (-task.job.priority, next(self._sequence), task.id))
+        self._ready.notify()
+
+    def _pop(self):
+        # Called with the lock held; skips tasks cancelled while pending
+        while self._pending:
+            _, _, task_id = heapq.heappop(self._pending)
+            task = self._tasks.get(task_id)
+            if task is not None and task.state == PENDING:
+                return task
+        return None
+
+    def _finish(self, task, state, error=None):
+        # Called with the lock held
+        if task.state in FINAL_STATES:
+            return
+        worker = self._workers.get(task.worker)
+        if worker is not None:
+            worker.tasks.discard(task.id)
+            if state == DONE:
+                worker.completed += 1
+        task.state = state
+        task.error = error
+        task.finished.set()
+
+    def reap(self):
+        """Lease again the tasks of workers not heard from in ``worker_timeout`` seconds."""
+        with self._lock:
+            self._reap()
+
+    def _reap(self):
+        # Called with the lock held
+        now = time.time()
+        for worker in list(self._workers.values()):
+            silent = now - worker.last_seen
+            if silent > 10 * self.worker_timeout and not worker.waiting:
+                del self._workers[worker.id]
+            if worker.dead or worker.waiting or silent <= self.worker_timeout:
+                continue
+            worker.dead = True
+            logger.warning(f"Farm worker {worker.name} ({worker.id}) silent for {silent:.0f}s, "
+                           f"reassigning {len(worker.tasks)} task(s)")
+            for task_id in list(worker.tasks):
+                task = self._tasks.get(task_id)
+                worker.tasks.discard(task_id)
+                if task is None or task.state != LEASED:
+                    continue
+                if task.attempt >= self.max_attempts:
+                    self._finish(task, FAILED, f"Worker lost {task.attempt} time(s)")
+                    continue
+                task.state = PENDING
+                task.worker = None
+                self._push(task)
+
+    # --- worker side ---
+
+    def _seen(self, worker_id, name, slots):
+        # Called with the lock held
+        worker = self._workers.get(worker_id)
+        if worker is None:
+            worker = self._workers[worker_id] = FarmWorker(worker_id, name or worker_id, slots)
+            logger.info(f"Farm worker {worker.name} ({worker_id}) joined with {slots} slot(s)")
+        elif worker.dead:
+            worker.dead = False
+            logger.info(f"Farm worker {worker.name} ({worker_id}) is back")
+        worker.last_seen = time.time()
+        worker.slots = slots
+        return worker
+
+    def lease(self, worker_id, name=None, slots=1, wait=0):
+        """Lease the next task to a worker, waiting up to ``wait`` seconds for one.
+
+        Returns the task description, or None.
+        """
+        deadline = time.monotonic() + wait
+        with self._lock:
+            worker = self._seen(worker_id, name, slots)
+            while True:
+                self._reap()
+                task = self._pop()
+                remaining = deadline - time.monotonic()
+                if task is not None or remaining <= 0:
+                    break
+                # Waiting counts as being alive
+                worker.waiting += 1
+                try:
+                    self._ready.wait(remaining)
+                finally:
+                    worker.waiting -= 1
+                worker.last_seen = time.time()
+            if task is None:
+                return None
+            task.state = LEASED
+            task.worker = worker_id
+            task.attempt += 1
+            worker.tasks.add(task.id)
+            task.job.device = worker.name
+            lease = task.lease_dict()
+        logger.info(f"Farm task {task.id} leased to {worker.name} (attempt {task.attempt})")
+        return lease
+
+    def heartbeat(self, worker_id, name=None, slots=1, running=None):
+        """Record that a worker is alive and the progress of its tasks.
+
+        ``running`` maps task ids to ``{"attempt": n, "progress": {...}}``.
+        Returns the ids of the tasks the worker must stop: cancelled,
+        finished or leased to another worker.
+        """
+        running = running or {}
+        cancel, updates = [], []
+        with self._lock:
+            worker = self._seen(worker_id, name, slots)
+            for task_id, report in running.items():
+                task = self._tasks.get(task_id)
+                if task is None or task.worker != worker_id or task.state != LEASED \
+                        or task.attempt != report.get("attempt"):
+                    cancel.append(task_id)
+                elif report.get("progress"):
+                    updates.append((task.job, report["progress"]))
+        for job, progress in updates:
+            if progress.get("updated_at") != (job.progress or {}).get("updated_at"):
+                source = f"{worker.name}/{progress['source']}" if progress.get("source") else worker.name
+                job.progress = dict(progress, source=source)
+                job.events.publish("progress", job.progress)
+        return cancel
+
+    def _leased(self, task_id, worker_id, attempt):
+        # Called with the lock held: the task, if this lease is still current
+        task = self._tasks.get(task_id)
+        if task is None or task.worker != worker_id or task.attempt != attempt or task.state != LEASED:
+            raise FarmError(f"Task {task_id} is not leased to this worker")
+        return task
+
+    def blob_path(self, blob):
+        """Path of the .blend with this SHA-256, if a current task uses it."""
+        with self._lock:
+            path = self._blobs.get(blob)
+        if path is None:
+            return None
+        try:
+            return path if file_digest(path) == blob else None
+        except OSError:
+            return None
+
+    def write_output(self, task_id, worker_id, attempt, name, stream, chunk_size=1024 * 1024):
+        """Store an output file uploaded by the worker next to the job's output base."""
+        with self._lock:
+            task = self._leased(task_id, worker_id, attempt)
+            base = os.path.basename(task.job.output_base)
+        if not name.startswith(base) or os.path.basename(name) != name:
+            raise FarmError(f"Unexpected output name {name}")
+        dest = os.path.join(self.output_dir, name)
+        tmp = os.path.join(self.output_dir, f".{name}.{task_id}-{attempt}.part")
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in iter(lambda: stream.read(chunk_size), b""):
+                    f.write(chunk)
+            # Never written in place: the previous output may be linked in the render cache
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def complete(self, task_id, worker_id, attempt, state, error=None, outputs=()):
+        """Record the result of a task reported by the worker holding its lease."""
+        with self._lock:
+            task = self._leased(task_id, worker_id, attempt)
+            if state == DONE:
+                missing = [n for n in outputs if not os.path.isfile(os.path.join(self.output_dir, n))]
+                if missing:
+                    state, error = FAILED, f"Outputs not uploaded: {', '.join(missing)}"
+                task.outputs = list(outputs)
+            elif state not in (FAILED, CANCELLED):
+                raise FarmError(f"Unknown task state {state}")
+            self._finish(task, state, error)
+        logger.info(f"Farm task {task_id} {state} on worker {worker_id}")
+
+    def status(self):
+        with self._lock:
+            self._reap()
+            tasks = [task.to_dict() for task in self._tasks.values()]
+            return {
+                "workers": [worker.to_dict() for worker in self._workers.values()],
+                "pending": sum(1 for t in tasks if t["state"] == PENDING),
+                "leased": sum(1 for t in tasks if t["state"] == LEASED),
+                "tasks": tasks,
+            }
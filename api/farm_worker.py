@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""Render farm worker: leases jobs from a coordinator and renders them here.
+
+    FARM_TOKEN=... python farm_worker.py --coordinator http://coordinator
+
+The coordinator is the app started with ``FARM_MODE=coordinator`` (see
+``farm.py``). The node renders with the same environment variables as the
+app (``BLENDER_BIN``, ``RENDER_DEVICES``, ``RENDER_CPU_SLOT``,
+``CYCLES_DEVICE_TYPE``, ``RENDER_TIMEOUT``, ``RENDER_CHUNK_RETRIES``,
+``RENDER_CHUNK_FRAMES``) and leases one job per device slot at a time.
+
+Input .blend files are kept in ``<workdir>/blobs`` by SHA-256, so a file is
+downloaded once per node whatever its name; outputs are rendered in a
+per-task directory, uploaded, then removed.
+"""
+import os
+import sys
+import json
+import uuid
+import shutil
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from blender_runner import BlenderBackend
+from device_slots import DeviceScheduler, inventory_from_env
+from job_runner import render_job
+from render_queue import RenderJob, JobCancelled, DONE, FAILED, CANCELLED
+
+logger = logging.getLogger(__name__)
+
+BLOB_SUFFIX = ".blend"
+
+
+class CoordinatorError(Exception):
+    """The coordinator answered with an HTTP error."""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class Coordinator:
+    """Client of the coordinator's ``/farm`` endpoints."""
+
+    def __init__(self, url, token, worker_id, name, slots, timeout=30):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.identity = {"worker": worker_id, "name": name, "slots": slots}
+        self.timeout = timeout
+
+    def _open(self, method, path, body=None, data=None, params=None, headers=None, timeout=None):
+        headers = dict(headers or {}, Authorization=f"Bearer {self.token}")
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        url = self.url + path + (f"?{urllib.parse.urlencode(params)}" if params else "")
+        request = urllib.request.Request(url, data=data, method=method, headers=headers)
+        try:
+            return urllib.request.urlopen(request, timeout=timeout or self.timeout)
+        except urllib.error.HTTPError as e:
+            raise CoordinatorError(e.code, e.read().decode("utf-8", errors="replace")[:200])
+
+    def _json(self, method, path, body=None, timeout=None):
+        with self._open(method, path, body=body, timeout=timeout) as response:
+            payload = response.read()
+        return json.loads(payload) if payload else None
+
+    def lease(self, wait):
+        """The next task, waiting up to ``wait`` seconds for one; None if there is none."""
+        return self._json("POST", "/farm/lease", dict(self.identity, wait=wait), timeout=wait + self.timeout)
+
+    def heartbeat(self, running):
+        """Report the running tasks; returns the ids of those to stop."""
+        return self._json("POST", "/farm/heartbeat", dict(self.identity, running=running))["cancel"]
+
+    def fetch_blob(self, blob, dest):
+        """Download the .blend with this SHA-256 to ``dest``, checking its content."""
+        tmp = f"{dest}.{uuid.uuid4().hex[:8]}.part"
+        digest = hashlib.sha256()
+        try:
+            with self._open("GET", f"/farm/blobs/{blob}") as response, open(tmp, "wb") as f:
+                for chunk in iter(lambda: response.read(1024 * 1024), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            if digest.hexdigest() != blob:
+                raise ValueError(f"Downloaded blob {blob} has SHA-256 {digest.hexdigest()}")
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def upload(self, task, path, name):
+        params = {"worker": self.identity["worker"], "attempt": task["attempt"]}
+        headers = {"Content-Type": "application/octet-stream", "Content-Length": str(os.path.getsize(path))}
+        with open(path, "rb") as f:
+            self._open("PUT", f"/farm/tasks/{task['id']}/outputs/{urllib.parse.quote(name)}",
+                       data=f, params=params, headers=headers).close()
+
+    def complete(self, task, state, error=None, outputs=()):
+        body = {"worker": self.identity["worker"], "attempt": task["attempt"],
+                "state": state, "error": error, "outputs": list(outputs)}
+        self._json("POST", f"/farm/tasks/{task['id']}/complete", body)
+
+
+class FarmWorker:
+    """Lease loops, one per slot, and a heartbeat loop reporting their progress."""
+
+    def __init__(self, coordinator, backend, scheduler, workdir, concurrency=1, heartbeat=5,
+                 poll=20, retries=1, chunk_frames=None, blob_cache_bytes=10 * 1024 ** 3):
+        self.coordinator = coordinator
+        self.backend = backend
+        self.scheduler = scheduler
+        self.workdir = workdir
+        self.concurrency = concurrency
+        self.heartbeat_interval = heartbeat
+        self.poll = poll
+        self.retries = retries
+        self.chunk_frames = chunk_frames
+        self.blob_cache_bytes = blob_cache_bytes
+        # task id -> (task, local RenderJob)
+        self._running = {}
+        self._blob_locks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        os.makedirs(os.path.join(workdir, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(workdir, "output"), exist_ok=True)
+
+    def run(self):
+        threads = [threading.Thread(target=self._heartbeat_loop, name="farm-heartbeat", daemon=True)]
+        threads += [threading.Thread(target=self._lease_loop, name=f"farm-lease-{i}", daemon=True)
+                    for i in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        logger.info(f"Farm worker {self.coordinator.identity['name']} leasing {self.concurrency} job(s) "
+                    f"at a time from {self.coordinator.url}")
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            running = list(self._running)
+        for task_id in running:
+            self._cancel(task_id)
+
+    def _lease_loop(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                task = self.coordinator.lease(self.poll)
+                backoff = 1
+            except (CoordinatorError, OSError) as e:
+                logger.warning(f"Could not lease a task: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            if task is not None:
+                self._run_task(task)
+
+    def _run_task(self, task):
+        base, _ = os.path.splitext(task["filename"])
+        output_dir = os.path.join(self.workdir, "output", task["id"])
+        os.makedirs(output_dir, exist_ok=True)
+        job = None
+        try:
+            blend_path = self._blob(task["blob"])
+            job = RenderJob(task["filename"], blend_path, os.path.join(output_dir, base), settings=task["settings"])
+            job.id = task["job_id"]
+            job.estimate = task["estimate"]
+            with self._lock:
+                self._running[task["id"]] = (task, job)
+            logger.info(f"Rendering task {task['id']} ({task['filename']}, attempt {task['attempt']})")
+            state, error = DONE, None
+            try:
+                render_job(self.backend, self.scheduler, job, retries=self.retries, chunk_frames=self.chunk_frames)
+            except JobCancelled:
+                state = CANCELLED
+            except Exception as e:
+                logger.exception(f"Task {task['id']} failed")
+                state, error = FAILED, str(e)
+            if state == DONE:
+                for name in job.outputs:
+                    self.coordinator.upload(task, os.path.join(output_dir, name), name)
+            self.coordinator.complete(task, state, error, job.outputs if state == DONE else ())
+            logger.info(f"Task {task['id']} {state}")
+        except CoordinatorError as e:
+            # 409: the task was cancelled or given to another worker meanwhile
+            logger.warning(f"Task {task['id']} abandoned: {e}")
+        except Exception as e:
+            logger.exception(f"Task {task['id']} could not run")
+            try:
+                self.coordinator.complete(task, FAILED, f"Worker error: {e}")
+            except (CoordinatorError, OSError):
+                pass
+        finally:
+            with self._lock:
+                self._running.pop(task["id"], None)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def _blob(self, blob):
+        """Local path of the .blend with this SHA-256, downloaded on first use."""
+        path = os.path.join(self.workdir, "blobs", blob + BLOB_SUFFIX)
+        with self._lock:
+            lock = self._blob_locks.setdefault(blob, threading.Lock())
+        with lock:
+            if os.path.isfile(path):
+                os.utime(path)
+                return path
+            logger.info(f"Fetching blob {blob[:12]}")
+            self.coordinator.fetch_blob(blob, path)
+        self._prune_blobs(keep=path)
+        return path
+
+    def _prune_blobs(self, keep):
+        # Least recently used blobs beyond the cache size, never those being rendered
+        with self._lock:
+            in_use = {job.blend_path for _, job in self._running.values()} | {keep}
+        directory = os.path.join(self.workdir, "blobs")
+        entries = sorted((e for e in os.scandir(directory) if e.name.endswith(BLOB_SUFFIX)),
+                         key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if total <= self.blob_cache_bytes:
+                break
+            if entry.path in in_use:
+                continue
+            total -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _cancel(self, task_id):
+        with self._lock:
+            running = self._running.get(task_id)
+        if running is None:
+            return
+        _, job = running
+        job.cancel_event.set()
+        for process in list(job.processes):
+            if process.poll() is None:
+                process.terminate()
+        logger.info(f"Task {task_id} stopped at the coordinator's request")
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            with self._lock:
+                running = {task_id: {"attempt": task["attempt"], "progress": job.progress}
+                           for task_id, (task, job) in self._running.items()}
+            try:
+                cancel = self.coordinator.heartbeat(running)
+            except (CoordinatorError, OSError) as e:
+                logger.warning(f"Heartbeat failed: {e}")
+                continue
+            for task_id in cancel:
+                self._cancel(task_id)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--coordinator", default=os.environ.get("FARM_COORDINATOR"), help="URL of the coordinator")
+    parser.add_argument("--token", default=os.environ.get("FARM_TOKEN"), help="FARM_TOKEN of the coordinator")
+    parser.add_argument("--name", default=socket.gethostname())
+    parser.add_argument("--workdir", default=os.environ.get("FARM_WORKDIR", "/workspace/farm"))
+    parser.add_argument("--concurrency", type=int, default=0, help="jobs at a time (default: one per slot)")
+    parser.add_argument("--heartbeat", type=float, default=5, help="seconds between heartbeats")
+    parser.add_argument("--poll", type=float, default=20, help="seconds a lease request waits for a job")
+    parser.add_argument("--blob-cache-mb", type=int, default=10240)
+    args = parser.parse_args(argv)
+    if not args.coordinator or not args.token:
+        parser.error("--coordinator and --token (or FARM_COORDINATOR and FARM_TOKEN) are required")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    scheduler = DeviceScheduler(inventory_from_env(
+        os.environ.get("RENDER_DEVICES"),
+        cpu_slot=os.environ.get("RENDER_CPU_SLOT", "true").lower() == "true",
+    ))
+    backend = BlenderBackend(
+        os.environ.get("BLENDER_BIN", "blender"),
+        compute_device_type=os.environ.get("CYCLES_DEVICE_TYPE", "CUDA"),
+        timeout=int(os.environ.get("RENDER_TIMEOUT", "300")),
+    )
+    concurrency = args.concurrency or len(scheduler.slots)
+    coordinator = Coordinator(args.coordinator, args.token, f"{args.name}-{uuid.uuid4().hex[:6]}",
+                              args.name, len(scheduler.slots))
+    FarmWorker(
+        coordinator, backend, scheduler, args.workdir,
+        concurrency=concurrency,
+        heartbeat=args.heartbeat,
+        poll=args.poll,
+        retries=int(os.environ.get("RENDER_CHUNK_RETRIES", "1")),
+        chunk_frames=int(os.environ.get("RENDER_CHUNK_FRAMES", "0")) or None,
+        blob_cache_bytes=args.blob_cache_mb * 1024 * 1024,
+    ).run()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
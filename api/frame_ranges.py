@@ -0,0 +1,168 @@
+import os
+import json
+import math
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from blend_reader import BlendReadError, blend_info
+from blender_runner import RenderError, frame_path, render_on_slot, slot_names
+from render_queue import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+PROBE_EXPR = (
+    "import bpy;"
+    "s=bpy.context.scene;"
+    "print('FRAME_RANGE', s.frame_start, s.frame_end, s.frame_step, flush=True)"
+)
+
+
+def probe_frame_range(blender_bin, blend_path, timeout=60):
+    """Ask Blender for the scene's ``(start, end, step)`` without rendering."""
+    result = subprocess.run(
+        [blender_bin, "-b", blend_path, "--disable-autoexec", "--python-expr", PROBE_EXPR],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        timeout=timeout,
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("FRAME_RANGE "):
+            start, end, step = (int(v) for v in line.split()[1:4])
+            return start, end, step
+    raise RenderError("Could not read the frame range from the scene.")
+
+
+def scene_frame_range(blender_bin, blend_path, timeout=60):
+    """The scene's ``(start, end, step)``, read from the file when possible.
+
+    Falls back to starting Blender when the .blend file cannot be parsed.
+    """
+    try:
+        scene = blend_info(blend_path)["scene"]
+        if scene and scene["frame_start"] is not None and scene["frame_end"] is not None:
+            return scene["frame_start"], scene["frame_end"], scene["frame_step"] or 1
+    except (BlendReadError, OSError) as e:
+        logger.warning(f"Could not read the frame range of {blend_path}, asking Blender: {e}")
+    return probe_frame_range(blender_bin, blend_path, timeout)
+
+
+def split_frames(start, end, step=1, chunk_frames=None, chunks=1):
+    """Split ``start..end`` (inclusive, every ``step`` frames) into chunks.
+
+    Chunks hold ``chunk_frames`` frames each, or the range is divided into
+    ``chunks`` nearly equal parts when ``chunk_frames`` is not given. Every
+    chunk is returned as ``(start, end)`` and keeps the ``step`` alignment.
+    """
+    if step < 1:
+        raise ValueError("Frame step must be at least 1")
+    if end < start:
+        raise ValueError("Frame range end is before its start")
+    frames = list(range(start, end + 1, step))
+    if not chunk_frames:
+        chunk_frames = math.ceil(len(frames) / max(1, chunks))
+    return [(part[0], part[-1]) for part in (frames[i:i + chunk_frames] for i in range(0, len(frames), chunk_frames))]
+
+
+class Chunk:
+    def __init__(self, start, end, step):
+        self.start = start
+        self.end = end
+        self.step = step
+        # Attempts, device and last error, filled in by render_on_slot
+        self.record = {}
+
+    @property
+    def frames(self):
+        return list(range(self.start, self.end + 1, self.step))
+
+    def to_dict(self):
+        return dict(self.record, start=self.start, end=self.end)
+
+
+def render_chunk(backend, scheduler, job, chunk, retries, timeout):
+    request = {
+        "blend_path": job.blend_path,
+        "output_base": job.output_base,
+        "animation": True,
+        "frame_start": chunk.start,
+        "frame_end": chunk.end,
+        "frame_step": chunk.step,
+    }
+    expected = [frame_path(job.output_base, f) for f in chunk.frames]
+    render_on_slot(
+        backend, scheduler, job, request, expected, retries=retries, timeout=timeout,
+        label=f"frames {chunk.start}-{chunk.end} of {job.filename}", record=chunk.record,
+    )
+
+
+def retarget_manifest(job):
+    """Point a manifest restored from another render at ``job`` and its file names."""
+    manifest_path = f"{job.output_base}_manifest.json"
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest["job"] = job.id
+    manifest["file"] = job.filename
+    for entry in manifest["frames"]:
+        entry["file"] = os.path.basename(frame_path(job.output_base, entry["frame"]))
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def render_animation(backend, scheduler, job, retries=1, chunk_frames=None, probe_timeout=60):
+    """Render a frame range split into chunks running on parallel device slots.
+
+    Each chunk is retried up to ``retries`` times. A JSON manifest of the
+    rendered frames is written next to them as ``<base>_manifest.json``.
+    """
+    settings = job.settings
+    start, end, step = settings.get("frame_start"), settings.get("frame_end"), settings.get("frame_step")
+    if start is None or end is None or step is None:
+        scene_start, scene_end, scene_step = scene_frame_range(backend.blender_bin, job.blend_path, probe_timeout)
+        start = scene_start if start is None else start
+        end = scene_end if end is None else end
+        step = scene_step if step is None else step
+
+    parallel = len(scheduler.candidates(settings.get("device")))
+    chunks = [Chunk(s, e, step) for s, e in split_frames(start, end, step, chunk_frames, parallel)]
+    logger.info(f"Rendering {job.filename} frames {start}-{end} (step {step}) in {len(chunks)} chunk(s)")
+
+    # Per-chunk timeout scales with the number of frames it renders
+    timeouts = [backend.timeout * len(c.frames) if backend.timeout else None for c in chunks]
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(chunks))), thread_name_prefix=f"chunk-{job.id}") as executor:
+        futures = [
+            executor.submit(render_chunk, backend, scheduler, job, chunk, retries, timeout)
+            for chunk, timeout in zip(chunks, timeouts)
+        ]
+        errors = []
+        for chunk, future in zip(chunks, futures):
+            try:
+                future.result()
+            except JobCancelled:
+                raise
+            except Exception as e:
+                errors.append(f"frames {chunk.start}-{chunk.end}: {e}")
+                # Stop the remaining chunks, the job cannot succeed anymore
+                for other in futures:
+                    other.cancel()
+    job.device = slot_names(c.record for c in chunks) or job.device
+
+    frames = [f for c in chunks for f in c.frames if os.path.isfile(frame_path(job.output_base, f))]
+    manifest_path = f"{job.output_base}_manifest.json"
+    with open(manifest_path, "w") as f:
+        json.dump({
+            "job": job.id,
+            "file": job.filename,
+            "frame_start": start,
+            "frame_end": end,
+            "frame_step": step,
+            "frames": [{"frame": n, "file": os.path.basename(frame_path(job.output_base, n))} for n in frames],
+            "chunks": [c.to_dict() for c in chunks],
+        }, f, indent=2)
+
+    if errors:
+        raise RenderError("; ".join(errors))
+    job.outputs = [os.path.basename(frame_path(job.output_base, n)) for n in frames]
+    job.outputs.append(os.path.basename(manifest_path))
+    logger.info(f"Rendered {len(frames)} frame(s) of {job.filename}, manifest: {manifest_path}")
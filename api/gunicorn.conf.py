@@ -0,0 +1,55 @@
+"""Gunicorn settings, read when gunicorn is started from this directory:
+
+    gunicorn app:app
+
+Each worker process imports the app and runs its own render queue; the
+render locks, device slots, Drive downloads and job state are shared
+through files in the workspace (``leases.py``, ``job_snapshots.py``).
+"""
+import os
+import secrets
+import multiprocessing
+
+from drive_downloads import remove_partial_downloads
+from leases import reclaim
+from upload_ingest import remove_stale_uploads
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:80")
+# The farm coordinator keeps its workers and leases in memory: a single process
+if os.environ.get("FARM_MODE") == "coordinator":
+    workers = 1
+else:
+    # Each process starts its own warm Blenders (one per device slot) and keeps
+    # its own metrics, so a scrape sees one process at random: one process by
+    # default when either is used
+    per_process = (os.environ.get("RENDER_WARM_WORKERS", "false").lower() == "true"
+                   or bool(os.environ.get("METRICS_TOKEN")))
+    default = 1 if per_process else min(multiprocessing.cpu_count(), 4)
+    workers = int(os.environ.get("GUNICORN_WORKERS", str(default)))
+# Event streams and farm long polls each hold a thread for their whole duration
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+timeout = 120
+graceful_timeout = 30
+pidfile = os.environ.get("GUNICORN_PIDFILE", "/run/gunicorn.pid")
+accesslog = "-"
+
+
+def on_starting(server):
+    # Sessions signed by one worker must be valid in the others
+    os.environ.setdefault("SECRET_KEY", secrets.token_hex(32))
+    if not os.environ.get("AUTH_TOKEN"):
+        os.environ["AUTH_TOKEN"] = secrets.token_urlsafe(32)
+        print("WARNING: No AUTH_TOKEN environment variable set. Generated random token for this session.")
+        print(f"Generated AUTH_TOKEN: {os.environ['AUTH_TOKEN']}")
+    if workers > 1:
+        # RotatingFileHandler cannot be shared between processes
+        os.environ.setdefault("LOG_ROTATE_MB", "0")
+
+    # Leftovers of a previous run, removed before any worker uses the workspace
+    workdir = os.environ.get("WORKDIR", "/workspace")
+    uploads = os.path.join(workdir, "uploads")
+    reclaim(uploads)
+    reclaim(os.environ.get("LEASE_DIR", os.path.join(workdir, "leases")))
+    remove_stale_uploads(uploads)
+    remove_partial_downloads(uploads)
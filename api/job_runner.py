@@ -0,0 +1,38 @@
+"""Renders a job on this machine's device slots, according to its settings.
+
+Used by the app for its own queue and by the render farm workers
+(``farm_worker.py``) for the jobs they lease.
+"""
+from blender_runner import render_still
+from device_slots import GPU
+from frame_ranges import render_animation
+from tiles import render_tiled
+
+
+def job_type(job):
+    """``animation``, ``tiles`` or ``still``."""
+    if job.settings.get("animation"):
+        return "animation"
+    return "tiles" if job.settings.get("tiles") else "still"
+
+
+def render_job(backend, scheduler, job, retries=1, chunk_frames=None):
+    """Render ``job`` and set ``job.outputs``; raises like the render functions.
+
+    Tiles only pay off on parallel slots: with a single slot for the job's
+    device the frame is rendered whole.
+    """
+    kind = job_type(job)
+    if kind == "tiles" and len(scheduler.candidates(job.settings.get("device"))) < 2:
+        kind = "still"
+    if kind != "still":
+        # The device class until the slots that rendered the parts are known
+        job.device = job.settings.get("device", GPU)
+    if kind == "animation":
+        render_animation(backend, scheduler, job, retries=retries, chunk_frames=chunk_frames)
+    elif kind == "tiles":
+        render_tiled(backend, scheduler, job, retries=retries)
+    else:
+        with scheduler.slot(job.settings.get("device", GPU), cancel_event=job.cancel_event) as slot:
+            job.device = slot.name
+            render_still(backend, job, slot)
@@ -0,0 +1,167 @@
+"""Job and batch state shared between the app's processes.
+
+Under gunicorn each worker process runs its own render queue, and a job is
+only known to the process that queued it. Its state is also written to
+``directory`` (``job-<id>.json``, on each state change and as its progress
+moves), along with the batches (``batch-<id>.json``) and their idempotency
+keys, so that any process can answer for it. Cancelling the job of another
+process leaves a ``job-<id>.cancel`` marker that its process picks up. A
+job left unfinished by a process that exited is reported as failed.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+
+from leases import current_process, is_running
+from render_progress import format_event
+from render_queue import FAILED, FINAL_STATES, batch_summary
+
+ID_PATTERN = re.compile(r"[0-9a-f]{1,32}")
+
+
+class JobSnapshots:
+    """Snapshots of jobs and batches in ``directory``, the ``keep`` most recent jobs are kept."""
+
+    def __init__(self, directory, keep=1000):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind, item_id, suffix=".json"):
+        if not ID_PATTERN.fullmatch(item_id):
+            return None
+        return os.path.join(self.directory, f"{kind}-{item_id}{suffix}")
+
+    def _write(self, path, data):
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def _read(self, path):
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, job):
+        self._write(self._path("job", job.id), dict(job.to_dict(), process=current_process()))
+
+    def load(self, job_id):
+        return self._job(self._read(self._path("job", job_id)))
+
+    def _job(self, job):
+        # The job's dict as its own process would return it
+        if job is None:
+            return None
+        process = job.pop("process")
+        if job["state"] not in FINAL_STATES and not is_running(process):
+            job.update(state=FAILED, error="The process running the job exited")
+        return job
+
+    def recent(self, limit):
+        """The ``limit`` most recently updated jobs, oldest first."""
+        names = self._names("job-", ".json")
+        jobs = [self._job(self._read(os.path.join(self.directory, name))) for _, name in names[-limit:]]
+        return [job for job in jobs if job is not None]
+
+    def save_batch(self, batch):
+        data = {"id": batch.id, "job_ids": batch.job_ids, "created_at": batch.created_at,
+                "idempotency_key": batch.idempotency_key}
+        self._write(self._path("batch", batch.id), data)
+        if batch.idempotency_key is not None:
+            self._write(self._key_path(batch.idempotency_key), {"batch_id": batch.id})
+
+    def _key_path(self, key):
+        return os.path.join(self.directory, f"key-{hashlib.sha256(key.encode()).hexdigest()[:32]}.json")
+
+    def batch_status(self, batch_id):
+        """Status of a batch from the snapshots of its jobs, None if unknown."""
+        batch = self._read(self._path("batch", batch_id))
+        if batch is None:
+            return None
+        jobs = [job for job in map(self.load, batch["job_ids"]) if job is not None]
+        return batch_summary(batch["id"], batch["created_at"], batch["job_ids"], jobs)
+
+    def batch_for_key(self, key):
+        """Id of the batch submitted with this idempotency key, if any."""
+        entry = self._read(self._key_path(key))
+        return entry["batch_id"] if entry else None
+
+    def request_cancel(self, job_id):
+        path = self._path("job", job_id, ".cancel")
+        if path is not None:
+            open(path, "a").close()
+
+    def take_cancel(self, job_id):
+        """Whether another process asked to cancel the job; the request is consumed."""
+        try:
+            os.remove(self._path("job", job_id, ".cancel"))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def prune(self):
+        """Forget the oldest jobs and batches beyond ``keep`` of each."""
+        for prefix in ("job-", "batch-"):
+            names = self._names(prefix, ".json")
+            for _, name in names[:max(0, len(names) - self.keep)]:
+                for path in (os.path.join(self.directory, name),
+                             os.path.join(self.directory, name[:-len(".json")] + ".cancel")):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        keys = self._names("key-", ".json")
+        for _, name in keys[:max(0, len(keys) - self.keep)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def _names(self, prefix, suffix):
+        # (mtime, name) of the files with this prefix, oldest first
+        names = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix) and entry.name.endswith(suffix):
+                    try:
+                        names.append((entry.stat().st_mtime, entry.name))
+                    except FileNotFoundError:
+                        pass
+        return sorted(names)
+
+    def follow(self, job_id, interval=0.5, heartbeat=15):
+        """Server-Sent Events of a job run by another process, read from its snapshot.
+
+        Sends the current state, then a ``state`` or ``progress`` event each
+        time the snapshot changes, until the job is over.
+        """
+        path = self._path("job", job_id)
+        yield "retry: 3000\n\n"
+        event_id, last, quiet = 0, None, 0.0
+        while True:
+            job = self._job(self._read(path))
+            if job is None:
+                # Forgotten since
+                return
+            if job != last:
+                event_id += 1
+                if last is not None and job["state"] == last["state"] and job["progress"] != last["progress"]:
+                    yield format_event(event_id, "progress", job["progress"])
+                else:
+                    yield format_event(event_id, "state", job)
+                last, quiet = job, 0.0
+                if job["state"] in FINAL_STATES:
+                    return
+            elif quiet >= heartbeat:
+                yield ": keep-alive\n\n"
+                quiet = 0.0
+            time.sleep(interval)
+            quiet += interval
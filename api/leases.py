@@ -0,0 +1,191 @@
+"""Leases on lock files, shared by every process of the app.
+
+A lease is a lock file held with ``flock``: creating or opening the file
+and locking it is atomic, and the kernel releases the lock when its
+process exits, so a crashed render never leaves a lease behind. The file
+records the owner (PID, process start time, host) for the other
+processes; ``holder`` trusts it only while that process is still running,
+and a file left by a dead owner is taken over by the next ``try_acquire``
+or removed by ``reclaim``.
+
+A lease taken with ``share`` is held by any number of processes at once
+and only keeps out an exclusive holder; it records no owner.
+"""
+import os
+import json
+import time
+import fcntl
+import socket
+import logging
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+LOCK_SUFFIX = ".lock"
+
+# pid -> start time of this process, computed again after a fork
+_started = {}
+
+
+def process_started(pid):
+    """Start time of process ``pid``, None if it is not running."""
+    try:
+        return psutil.Process(pid).create_time()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+
+def current_process():
+    """This process as recorded in leases: PID, start time and host."""
+    pid = os.getpid()
+    if pid not in _started:
+        _started.clear()
+        _started[pid] = process_started(pid)
+    return {"pid": pid, "started": _started[pid], "host": socket.gethostname()}
+
+
+def _read_owner(path):
+    try:
+        with open(path) as f:
+            owner = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return owner if isinstance(owner, dict) and "pid" in owner else None
+
+
+def is_running(owner):
+    """Whether the process described by ``owner`` (see ``current_process``) still runs."""
+    if owner.get("host") != socket.gethostname():
+        # Another machine sharing the directory: it cannot be checked from here
+        return True
+    started = process_started(owner["pid"])
+    # A different start time means the PID was reused by another process
+    return started is not None and (owner.get("started") is None or abs(started - owner["started"]) < 1)
+
+
+class Lease:
+    """A held lock file; release it, or use it as a context manager."""
+
+    def __init__(self, path, fd, owner):
+        self.path = path
+        self.owner = owner
+        self._fd = fd
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            # Removed by its last holder only, a shared lease may have others
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Only our own file: waiters check that they locked the current one
+            if os.path.samestat(os.stat(self.path), os.fstat(self._fd)):
+                os.remove(self.path)
+        except (BlockingIOError, FileNotFoundError):
+            pass
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _lock(path, operation):
+    """Descriptor of the lock file ``path`` locked with ``operation``, None if it is held."""
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, operation)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        # The previous holder may have removed the file between open and flock
+        try:
+            current = os.path.samestat(os.stat(path), os.fstat(fd))
+        except FileNotFoundError:
+            current = False
+        if current:
+            return fd
+        os.close(fd)
+
+
+def try_acquire(path, name=None):
+    """Take the lease ``path`` without waiting; returns a ``Lease`` or None if it is held."""
+    fd = _lock(path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    if fd is None:
+        return None
+    previous = _read_owner(path)
+    if previous is not None:
+        logger.info(f"Reclaimed lease {path} of process {previous['pid']} on {previous.get('host')}")
+    owner = dict(current_process(), name=name, acquired_at=time.time())
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, json.dumps(owner).encode(), 0)
+    return Lease(path, fd, owner)
+
+
+def acquire(path, name=None, poll=0.2):
+    """Take the lease ``path``, waiting for its holder to release it."""
+    while True:
+        lease = try_acquire(path, name)
+        if lease is not None:
+            return lease
+        time.sleep(poll)
+
+
+def share(path, name=None):
+    """Take the lease ``path`` along with its other shared holders.
+
+    Waits in the kernel while an exclusive holder has it.
+    """
+    fd = _lock(path, fcntl.LOCK_SH)
+    return Lease(path, fd, dict(current_process(), name=name, acquired_at=time.time()))
+
+
+def is_held(path):
+    """Whether a process holds the lease ``path``, shared or exclusive."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        # Closing drops the probe's lock
+        os.close(fd)
+    return False
+
+
+def holder(path):
+    """Owner of the lease ``path`` if a running process holds it, else None.
+
+    Reads the file without locking it, so that looking never makes an
+    acquisition fail.
+    """
+    owner = _read_owner(path)
+    if owner is None or not is_running(owner):
+        return None
+    return owner
+
+
+def reclaim(directory):
+    """Remove the lease files of ``directory`` left by processes that died."""
+    try:
+        names = [n for n in os.listdir(directory) if n.endswith(LOCK_SUFFIX)]
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            lease = try_acquire(path)
+        except OSError as e:
+            logger.warning(f"Could not check lease {path}: {e}")
+            continue
+        if lease is not None:
+            lease.release()
+            logger.info(f"Removed stale lock: {path}")
@@ -0,0 +1,57 @@
+"""Logging off the request threads, through a bounded queue.
+
+``install`` puts a ``DroppingQueueHandler`` on the root logger: emitting a
+record only formats it and puts it on a queue, and a ``QueueListener``
+thread writes it to the real handlers (rotating file, stderr). When the
+queue is full the record is dropped and counted instead of blocking the
+caller; a warning with the number of dropped records is logged once the
+queue has room again.
+"""
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import LOG_RECORDS_DROPPED
+
+QUEUE_SIZE = 10000
+
+
+class DroppingQueueHandler(QueueHandler):
+    """``QueueHandler`` that drops records instead of waiting for room.
+
+    ``Handler.handle`` already serializes ``emit`` under the handler lock.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._unreported = 0
+
+    def enqueue(self, record):
+        try:
+            if self._unreported:
+                self.queue.put_nowait(self._dropped_record(self._unreported))
+                self._unreported = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+            LOG_RECORDS_DROPPED.inc(level=record.levelname)
+
+    def _dropped_record(self, count):
+        return logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0,
+            f"Logging queue full: dropped {count} log record(s)", None, None)
+
+
+def install(*handlers, queue_size=QUEUE_SIZE, level=logging.INFO):
+    """Route the root logger through a queue to ``handlers``; returns the listener."""
+    log_queue = queue.Queue(maxsize=queue_size)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,239 @@
+"""Reading the end of log files, and the per-job render logs.
+
+``tail_lines`` reads a file backwards from its end, one block at a time,
+until it has the requested number of lines. ``read_since`` returns what
+was appended after a cursor: ``"<inode>:<offset>"`` of the last byte
+read. When ``RotatingFileHandler`` rolled the file over, the cursor's
+inode is found among the rotated files (``debug.log.1``…) and the rest of
+that file is returned, then each newer file in turn.
+
+Blender's output is written to one file per job (``JobLogs``) instead of
+the shared log, and gzipped once the job is over. Both functions read
+``.gz`` logs too, decompressing them whole: they are finished and small.
+"""
+import os
+import glob
+import gzip
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 64 * 1024
+MAX_READ = 1024 * 1024
+GZIP_SUFFIX = ".gz"
+
+
+def tail_lines(path, count, block_size=BLOCK_SIZE):
+    """The last ``count`` lines of a file, without reading the rest of it."""
+    if path.endswith(GZIP_SUFFIX):
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+        return b"".join(data.splitlines(keepends=True)[-count:] if count else []).decode("utf-8", errors="replace")
+    with open(path, "rb") as f:
+        return _tail(f, f.seek(0, os.SEEK_END), count, block_size).decode("utf-8", errors="replace")
+
+
+def _tail(f, end, count, block_size):
+    data = b""
+    position = end
+    # One more newline than lines wanted: the last line usually ends with one
+    while position > 0 and data.count(b"\n") <= count:
+        step = min(block_size, position)
+        position -= step
+        f.seek(position)
+        data = f.read(step) + data
+    lines = data.splitlines(keepends=True)
+    return b"".join(lines[-count:]) if count else b""
+
+
+def make_cursor(inode, offset):
+    return f"{inode}:{offset}"
+
+
+def parse_cursor(cursor):
+    """``(inode, offset)`` of a cursor, None when it is missing or malformed."""
+    try:
+        inode, offset = cursor.split(":")
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _rotations(path):
+    """``[(path, inode)]`` of ``path`` and its rotated copies, oldest first.
+
+    ``RotatingFileHandler`` renames ``path`` to ``path.1``, ``path.1`` to
+    ``path.2`` and so on, so higher numbers are older.
+    """
+    numbered = []
+    for candidate in glob.glob(glob.escape(path) + ".*"):
+        suffix = candidate[len(path) + 1:]
+        if suffix.isdigit():
+            numbered.append((int(suffix), candidate))
+    files = []
+    for _, candidate in sorted(numbered, reverse=True) + [(0, path)]:
+        try:
+            files.append((candidate, os.stat(candidate).st_ino))
+        except OSError:
+            continue
+    return files
+
+
+def _read_lines(path, offset, limit, final=False):
+    """Whole lines from ``offset``, at most ``limit`` bytes; returns ``(data, end, size)``.
+
+    An unfinished last line is left for the next read, unless the file is
+    ``final`` (rotated, it will not grow) or the line alone exceeds ``limit``.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset:
+            # A cursor always follows a newline; otherwise the inode was reused
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                offset = 0
+        f.seek(offset)
+        data = f.read(max(0, min(limit, size - offset)))
+    if not (final and offset + len(data) == size):
+        cut = data.rfind(b"\n") + 1
+        if cut or len(data) < limit:
+            data = data[:cut]
+    return data, offset + len(data), size
+
+
+def read_since(path, cursor=None, initial_lines=300, max_bytes=MAX_READ):
+    """Text appended to ``path`` after ``cursor``, and the cursor to use next.
+
+    Without a valid cursor the last ``initial_lines`` lines are returned.
+    Only whole lines are returned; a truncated file is read from its start,
+    and so is a file that does not exist yet once it is created.
+    """
+    if path.endswith(GZIP_SUFFIX):
+        return _read_gzip_since(path, cursor, initial_lines, max_bytes)
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            parsed = parse_cursor(cursor)
+            if parsed is None:
+                data = _tail(f, st.st_size, initial_lines, BLOCK_SIZE)
+                return data.decode("utf-8", errors="replace"), make_cursor(st.st_ino, st.st_size)
+    except FileNotFoundError:
+        return "", cursor if parse_cursor(cursor) else make_cursor(0, 0)
+
+    inode, offset = parsed
+    if inode != st.st_ino:
+        files = _rotations(path)
+        inodes = [i for _, i in files]
+        if inode in inodes[:-1]:
+            # The rest of the cursor's file first, then each newer one in turn
+            position = inodes.index(inode)
+            rotated = files[position][0]
+            data, end, size = _read_lines(rotated, offset, max_bytes, final=True)
+            cursor = make_cursor(inode, end) if end < size else make_cursor(inodes[position + 1], 0)
+            return data.decode("utf-8", errors="replace"), cursor
+        offset = 0
+    elif offset > st.st_size:
+        offset = 0
+    data, end, _ = _read_lines(path, offset, max_bytes)
+    return data.decode("utf-8", errors="replace"), make_cursor(st.st_ino, end)
+
+def _read_gzip_since(path, cursor, initial_lines, max_bytes):
+    """``read_since`` of a finished, gzipped log; cursor offsets are in the uncompressed text."""
+    with gzip.open(path, "rb") as f:
+        data = f.read()
+    inode = os.stat(path).st_ino
+    parsed = parse_cursor(cursor)
+    if parsed is None:
+        lines = data.splitlines(keepends=True)[-initial_lines:] if initial_lines else []
+        return b"".join(lines).decode("utf-8", errors="replace"), make_cursor(inode, len(data))
+    offset = parsed[1] if parsed[1] <= len(data) else 0
+    chunk = data[offset:offset + max_bytes]
+    if offset + len(chunk) < len(data):
+        chunk = chunk[:chunk.rfind(b"\n") + 1] or chunk
+    return chunk.decode("utf-8", errors="replace"), make_cursor(inode, offset + len(chunk))
+
+
+class JobLog:
+    """Log file of one render job, shared by its Blender processes.
+
+    Written as plain text while the job runs, gzipped by ``close``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def write(self, line, source=None):
+        text = f"[{source}] {line}" if source else line
+        with self._lock:
+            if self._closed:
+                # Late output of a warm worker after the job finished
+                logger.info(f"{os.path.basename(self.path)}: {text}")
+                return
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(text + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+            try:
+                compress(self.path)
+            except OSError as e:
+                logger.warning(f"Could not compress {self.path}: {e}")
+
+
+def compress(path):
+    """Replace ``path`` with ``path.gz``."""
+    tmp = f"{path}.tmp{GZIP_SUFFIX}"
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dest:
+        shutil.copyfileobj(src, dest)
+    os.replace(tmp, path + GZIP_SUFFIX)
+    os.remove(path)
+
+
+class JobLogs:
+    """Directory of per-job log files, keeping the ``keep`` most recent."""
+
+    def __init__(self, directory, keep=200):
+        self.directory = directory
+        self.keep = keep
+
+    def path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.log")
+
+    def find(self, job_id):
+        """Path of the job's log, plain while it runs and gzipped after; None if missing."""
+        path = self.path(job_id)
+        for candidate in (path, path + GZIP_SUFFIX):
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def open(self, job_id):
+        os.makedirs(self.directory, exist_ok=True)
+        self.prune()
+        return JobLog(self.path(job_id))
+
+    def prune(self):
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith((".log", ".log" + GZIP_SUFFIX))]
+        except FileNotFoundError:
+            return
+        if len(entries) < self.keep:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.keep + 1]:
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                logger.warning(f"Could not remove job log {entry.name}: {e}")
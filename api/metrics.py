@@ -0,0 +1,278 @@
+"""Counters, histograms and process gauges in the Prometheus text format.
+
+Instruments are plain objects updated in place under a lock; observing a
+value is a ``bisect`` and two additions, cheap enough for the hot paths.
+``REGISTRY.render()`` produces the ``/metrics`` page.
+
+``ProcessSampler`` follows the Blender processes the app started itself
+(never the whole process table): a background thread samples their CPU
+and memory use every ``interval`` seconds. It keeps one ``psutil.Process``
+per PID, so CPU percentages are measured between two samples instead of
+reading 0 on a first call.
+"""
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+WAIT_BUCKETS = (0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+FAST_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, "") for n in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}_total{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Distribution of observed values over fixed ``buckets`` (upper bounds)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_value(float(bound)))])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(float(state[-2]))}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {state[-1]}"
+
+
+class Collected:
+    """Values read from ``collect()`` at scrape time.
+
+    ``collect`` returns ``{label values tuple: value}``; ``kind`` is
+    ``gauge`` or ``counter``.
+    """
+
+    def __init__(self, name, help, kind, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._collect = collect
+
+    def samples(self):
+        suffix = "_total" if self.kind == "counter" else ""
+        for key, value in sorted(self._collect().items()):
+            yield f"{self.name}{suffix}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, buckets, labels=()):
+        return self.register(Histogram(name, help, buckets, labels))
+
+    def collected(self, name, help, kind, collect, labels=()):
+        return self.register(Collected(name, help, kind, collect, labels))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Could not collect metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class ProcessSampler:
+    """Samples the CPU and memory use of tracked processes in the background."""
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        # pid -> {"process": psutil.Process, "kind": str, "cmdline": str, "cpu_percent": float, "rss": int}
+        self._tracked = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, pid, kind, cmdline=()):
+        try:
+            process = psutil.Process(pid)
+            # First call only sets the reference point of the next measurement
+            process.cpu_percent(None)
+        except psutil.Error:
+            return
+        with self._lock:
+            self._tracked[pid] = {
+                "process": process,
+                "kind": kind,
+                "cmdline": " ".join(cmdline),
+                "started_at": time.time(),
+                "cpu_percent": 0.0,
+                "rss": 0,
+                "threads": 0,
+            }
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="process-sampler", daemon=True)
+                self._thread.start()
+
+    def untrack(self, pid):
+        with self._lock:
+            self._tracked.pop(pid, None)
+
+    def sample(self):
+        with self._lock:
+            tracked = list(self._tracked.items())
+        for pid, entry in tracked:
+            try:
+                process = entry["process"]
+                with process.oneshot():
+                    entry["cpu_percent"] = process.cpu_percent(None)
+                    entry["rss"] = process.memory_info().rss
+                    entry["threads"] = process.num_threads()
+            except psutil.Error:
+                self.untrack(pid)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Process sampling failed: {e}")
+
+    def snapshot(self):
+        """Latest sample of each tracked process."""
+        with self._lock:
+            return [
+                dict({k: v for k, v in entry.items() if k != "process"}, pid=pid)
+                for pid, entry in sorted(self._tracked.items())
+            ]
+
+    def _collect(self, field):
+        return {(str(e["pid"]), e["kind"]): e[field] for e in self.snapshot()}
+
+    def register(self, registry):
+        registry.collected("blender_processes", "Blender processes started by the app",
+                           "gauge", lambda: _count_by_kind(self.snapshot()), labels=("kind",))
+        registry.collected("blender_process_cpu_percent", "CPU use of a Blender process over the last sample",
+                           "gauge", lambda: self._collect("cpu_percent"), labels=("pid", "kind"))
+        registry.collected("blender_process_resident_bytes", "Resident memory of a Blender process",
+                           "gauge", lambda: self._collect("rss"), labels=("pid", "kind"))
+
+
+def _count_by_kind(entries):
+    counts = {}
+    for e in entries:
+        counts[(e["kind"],)] = counts.get((e["kind"],), 0) + 1
+    return counts
+
+
+REGISTRY = Registry()
+PROCESSES = ProcessSampler()
+PROCESSES.register(REGISTRY)
+
+RENDER_SECONDS = REGISTRY.histogram(
+    "render_duration_seconds", "Time spent rendering a job, by job type and outcome",
+    DURATION_BUCKETS, labels=("type", "outcome"))
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "render_queue_wait_seconds", "Time between the submission of a job and its start", WAIT_BUCKETS)
+RENDER_JOBS = REGISTRY.counter(
+    "render_jobs", "Finished render jobs by outcome (done, failed, cancelled, cached)", labels=("outcome",))
+UPLOAD_SCAN_SECONDS = REGISTRY.histogram(
+    "upload_scan_duration_seconds", "Time to check a received upload", FAST_BUCKETS)
+UPLOADS = REGISTRY.counter("uploads", "Uploads by result (accepted, rejected)", labels=("result",))
+UPLOAD_BYTES = REGISTRY.counter("upload_bytes", "Bytes received in uploaded files")
+DRIVE_REQUEST_SECONDS = REGISTRY.histogram(
+    "drive_request_duration_seconds", "Latency of Google Drive API requests, by operation",
+    LATENCY_BUCKETS, labels=("operation",))
+DRIVE_ERRORS = REGISTRY.counter(
+    "drive_request_errors", "Google Drive API requests that failed, by operation", labels=("operation",))
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "log_records_dropped", "Log records dropped because the logging queue was full", labels=("level",))
@@ -0,0 +1,401 @@
+"""Index of the rendered images of the output directory, with thumbnails.
+
+The directory is scanned once, on first use. After that renders add their
+outputs with ``add`` as they finish, and pages read the index, sorted by
+time, instead of listing the directory. Outputs written by the other
+processes of the app are picked up by a rescan in the background once the
+directory changed, at most every ``rescan_interval`` seconds.
+
+Thumbnails are made by a small thread pool: WebP through Pillow when it is
+installed (JPEG when its WebP support is missing), otherwise a PNG scaled
+down by ``png_stream`` with the standard library only.
+
+With ``max_bytes`` the least recently used images are removed once they
+take more than that. A file's access time records its last use (render or
+download), so the order survives restarts.
+"""
+import os
+import time
+import bisect
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from png_stream import PART_SUFFIX, part_path, thumbnail as png_thumbnail
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".png",)
+
+# Seconds after which an unfinished thumbnail is a crash's leftover
+PART_MAX_AGE = 3600
+
+
+@functools.lru_cache(maxsize=1)
+def thumbnail_format():
+    """Extension of the thumbnails: ``webp`` or ``jpg`` with Pillow, ``png`` without."""
+    try:
+        from PIL import features
+    except ImportError:
+        return "png"
+    return "webp" if features.check("webp") else "jpg"
+
+
+def make_thumbnail(path, output_path, max_size):
+    """Write a thumbnail of the image ``path``, at most ``max_size`` pixels per side."""
+    kind = thumbnail_format()
+    if kind == "png":
+        png_thumbnail(path, output_path, max_size)
+        return
+    from PIL import Image
+
+    tmp_path = part_path(output_path)
+    with Image.open(path) as image:
+        image.thumbnail((max_size, max_size))
+        # JPEG has no alpha, and neither format takes 16-bit greyscale
+        image = image.convert("RGB" if kind == "jpg" or image.mode not in ("RGBA", "LA") else "RGBA")
+        image.save(tmp_path, "WEBP" if kind == "webp" else "JPEG", quality=80)
+    os.replace(tmp_path, output_path)
+
+
+def last_used(st):
+    return max(st.st_atime, st.st_mtime)
+
+
+def mark_used(path):
+    """Record a use of ``path`` in its access time, keeping its modification time."""
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+    except OSError:
+        pass
+
+
+def trim_directory(directory, max_bytes, suffixes, in_use=None):
+    """Remove the least recently used files of ``directory`` ending with ``suffixes``
+    until they take at most ``max_bytes``; returns the removed names.
+
+    Files for which ``in_use(path)`` is true are kept.
+    """
+    files = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(suffixes) and entry.is_file(follow_symlinks=False):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((last_used(st), entry.path, st.st_size))
+    except FileNotFoundError:
+        return []
+    total = sum(size for _, _, size in files)
+    removed = []
+    for _, path, size in sorted(files):
+        if total <= max_bytes:
+            break
+        if in_use is not None and in_use(path):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed.append(os.path.basename(path))
+    if removed:
+        logger.info(f"Removed {len(removed)} least recently used file(s) from {directory}")
+    return removed
+
+
+class Output:
+    """A rendered image of the catalog."""
+
+    def __init__(self, name, size, modified_at, last_used):
+        self.name = name
+        self.size = size
+        self.modified_at = modified_at
+        self.last_used = last_used
+        # File name in the thumbnail directory, None until it is made
+        self.thumbnail = None
+        self.indexed_at = time.monotonic()
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "size": self.size,
+            "modified_at": self.modified_at,
+            "thumbnail": self.thumbnail is not None,
+        }
+
+
+class OutputCatalog:
+    """Rendered images of ``directory``, newest first, thumbnails in ``thumbnail_dir``.
+
+    ``max_bytes`` of 0 keeps every image.
+    """
+
+    def __init__(self, directory, thumbnail_dir, max_bytes=0, thumbnail_size=320, workers=2,
+                 rescan_interval=30):
+        self.directory = directory
+        self.thumbnail_dir = thumbnail_dir
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.rescan_interval = rescan_interval
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="thumbnails")
+        self._lock = threading.Lock()
+        # name -> Output, and (modified_at, name) oldest first; loaded on first use
+        self._outputs = None
+        self._order = []
+        self._bytes = 0
+        self._pending = set()
+        self._failed = set()
+        self._directory_mtime = None
+        self._scanned_at = 0.0
+        self._rescanning = False
+        self.stats = {"scans": 0, "thumbnails": 0, "thumbnail_errors": 0, "evictions": 0}
+
+    # --- index ---
+
+    def _load(self):
+        # Called with the lock held
+        if self._outputs is None:
+            self._replace(*self._scan())
+            logger.info(f"Output catalog: {len(self._outputs)} image(s) in {self.directory}")
+
+    def _scan(self):
+        """``(outputs, directory mtime, start time)`` read from the directory in one pass."""
+        started = time.monotonic()
+        wall_started = time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        os.makedirs(self.thumbnail_dir, exist_ok=True)
+        # Before listing, so that changes made meanwhile trigger another rescan
+        directory_mtime = os.stat(self.directory).st_mtime_ns
+        thumbnails, stale = {}, []
+        with os.scandir(self.thumbnail_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(PART_SUFFIX):
+                    # Being written by this or another process, unless left by a crash
+                    try:
+                        if entry.stat().st_mtime < wall_started - PART_MAX_AGE:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                name, _, kind = entry.name.rpartition(".")
+                if kind == thumbnail_format():
+                    thumbnails[name] = entry
+                else:
+                    stale.append(entry)
+        outputs = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                output = Output(entry.name, st.st_size, st.st_mtime, last_used(st))
+                thumb = thumbnails.pop(entry.name, None)
+                try:
+                    if thumb is not None and thumb.stat().st_mtime >= st.st_mtime:
+                        output.thumbnail = thumb.name
+                except FileNotFoundError:
+                    pass
+                outputs[entry.name] = output
+        for thumb in stale + list(thumbnails.values()):
+            # Thumbnails of removed images and unfinished ones; newer files may
+            # belong to images added since
+            try:
+                if thumb.stat().st_mtime < wall_started:
+                    os.remove(thumb.path)
+            except FileNotFoundError:
+                pass
+        self.stats["scans"] += 1
+        return outputs, directory_mtime, started
+
+    def _replace(self, outputs, directory_mtime, started):
+        # Called with the lock held: install a scan, keeping the images added while it ran
+        # and the entries (thumbnail, last use) of the unchanged ones
+        for name, output in (self._outputs or {}).items():
+            scanned = outputs.get(name)
+            if scanned is None and output.indexed_at >= started:
+                outputs[name] = output
+            elif scanned is not None and scanned.modified_at == output.modified_at and scanned.size == output.size:
+                outputs[name] = output
+        self._outputs = outputs
+        self._order = sorted((o.modified_at, o.name) for o in outputs.values())
+        self._bytes = sum(o.size for o in outputs.values())
+        self._directory_mtime = directory_mtime
+        self._scanned_at = time.monotonic()
+        for output in outputs.values():
+            self._queue_thumbnail(output)
+
+    def _maybe_rescan(self):
+        # One stat: the directory's mtime changes whenever a file is added or removed
+        if self._outputs is None or self._rescanning or time.monotonic() - self._scanned_at < self.rescan_interval:
+            return
+        try:
+            if os.stat(self.directory).st_mtime_ns == self._directory_mtime:
+                return
+        except OSError:
+            return
+        self._rescanning = True
+        try:
+            self._executor.submit(self._rescan)
+        except RuntimeError:
+            # Shut down
+            self._rescanning = False
+
+    def _rescan(self):
+        try:
+            scan = self._scan()
+            with self._lock:
+                self._replace(*scan)
+        except Exception as e:
+            logger.error(f"Output catalog rescan failed: {e}")
+        finally:
+            self._scanned_at = time.monotonic()
+            self._rescanning = False
+
+    def _put(self, output):
+        # Called with the lock held
+        self._drop(output.name)
+        self._outputs[output.name] = output
+        bisect.insort(self._order, (output.modified_at, output.name))
+        self._bytes += output.size
+
+    def _drop(self, name):
+        # Called with the lock held
+        output = self._outputs.pop(name, None)
+        if output is None:
+            return None
+        key = (output.modified_at, name)
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+        self._bytes -= output.size
+        return output
+
+    def add(self, names):
+        """Index the images among ``names``, files of the directory a render just wrote."""
+        added = []
+        for name in names:
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            added.append(Output(name, st.st_size, st.st_mtime, time.time()))
+        if not added:
+            return
+        with self._lock:
+            self._load()
+            for output in added:
+                self._put(output)
+                self._queue_thumbnail(output)
+        self._evict(keep={output.name for output in added})
+
+    def touch(self, name):
+        """Record that ``name`` was just used, it is removed last."""
+        with self._lock:
+            output = self._outputs.get(name) if self._outputs is not None else None
+            if output is None:
+                return
+            output.last_used = time.time()
+        mark_used(os.path.join(self.directory, name))
+
+    def page(self, offset=0, limit=50):
+        """``(outputs, total)``: ``limit`` images from ``offset``, newest first."""
+        self._maybe_rescan()
+        with self._lock:
+            self._load()
+            end = len(self._order) - offset
+            keys = self._order[max(0, end - limit):max(0, end)]
+            return [self._outputs[name] for _, name in reversed(keys)], len(self._order)
+
+    def status(self):
+        with self._lock:
+            self._load()
+            return dict(self.stats, images=len(self._outputs), bytes=self._bytes, max_bytes=self.max_bytes,
+                        thumbnails_pending=len(self._pending))
+
+    # --- thumbnails ---
+
+    def _queue_thumbnail(self, output):
+        # Called with the lock held
+        if (output.thumbnail is None and output.name not in self._pending
+                and (output.name, output.modified_at) not in self._failed):
+            try:
+                self._executor.submit(self._make_thumbnail, output.name)
+            except RuntimeError:
+                # Shut down
+                return
+            self._pending.add(output.name)
+
+    def _make_thumbnail(self, name):
+        with self._lock:
+            output = self._outputs.get(name)
+        try:
+            if output is None:
+                return
+            thumb = f"{name}.{thumbnail_format()}"
+            make_thumbnail(os.path.join(self.directory, name), os.path.join(self.thumbnail_dir, thumb),
+                           self.thumbnail_size)
+            output.thumbnail = thumb
+            self.stats["thumbnails"] += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.stats["thumbnail_errors"] += 1
+            logger.warning(f"No thumbnail for {name}: {e}")
+            with self._lock:
+                # Tried again once the file changes, e.g. caught half written
+                self._failed.add((name, output.modified_at))
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+                # Rendered again or rescanned meanwhile
+                current = self._outputs.get(name)
+                if current is not None and current is not output:
+                    self._queue_thumbnail(current)
+
+    def thumbnail_path(self, name):
+        """Path of the thumbnail of ``name``, None if there is none yet."""
+        with self._lock:
+            output = self._outputs.get(name) if self._outputs is not None else None
+            thumb = output.thumbnail if output is not None else None
+        if thumb is None:
+            return None
+        path = os.path.join(self.thumbnail_dir, thumb)
+        return path if os.path.isfile(path) else None
+
+    # --- retention ---
+
+    def _evict(self, keep=()):
+        if not self.max_bytes:
+            return
+        with self._lock:
+            if self._bytes <= self.max_bytes:
+                return
+            evicted = []
+            for output in sorted(self._outputs.values(), key=lambda o: o.last_used):
+                if self._bytes <= self.max_bytes:
+                    break
+                if output.name not in keep:
+                    evicted.append(self._drop(output.name))
+            self.stats["evictions"] += len(evicted)
+        for output in evicted:
+            for path in (os.path.join(self.directory, output.name),
+                         output.thumbnail and os.path.join(self.thumbnail_dir, output.thumbnail)):
+                try:
+                    if path:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        if evicted:
+            logger.info(f"Output retention: removed {len(evicted)} least recently used image(s)")
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
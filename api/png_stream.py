@@ -0,0 +1,280 @@
+"""Row-by-row PNG reading and writing with the standard library only.
+
+Used to stitch render tiles without ever holding a whole decoded image in
+memory: readers decode one scanline at a time and the writer compresses
+scanlines as they arrive. Only non-interlaced greyscale, RGB, grey+alpha
+and RGBA images with 8 or 16 bits per channel are supported, which covers
+what Blender writes.
+"""
+import os
+import zlib
+import uuid
+import struct
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Samples per pixel for each supported colour type
+CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+IDAT_SIZE = 256 * 1024
+
+# Suffix of files being written, renamed into place once complete
+PART_SUFFIX = ".part"
+
+
+class PNGError(Exception):
+    """Raised for PNG files this module cannot read or combine."""
+
+
+def part_path(path):
+    """Name to write ``path`` under, unique to the writer (thread or process)."""
+    return f"{path}.{uuid.uuid4().hex[:12]}{PART_SUFFIX}"
+
+
+def _swar_add(a, b, length):
+    """Bytewise ``(a + b) % 256`` of two byte strings, done on big integers."""
+    if not length:
+        return b""
+    high = int.from_bytes(b"\x80" * length, "big")
+    low = high ^ int.from_bytes(b"\xff" * length, "big")
+    x = int.from_bytes(a, "big")
+    y = int.from_bytes(b, "big")
+    return (((x & low) + (y & low)) ^ ((x ^ y) & high)).to_bytes(length, "big")
+
+
+def unfilter(filter_type, line, prev, bpp):
+    """Reverse the PNG filter of one scanline, ``prev`` is the previous decoded line."""
+    if filter_type == 0:
+        return bytes(line)
+    if filter_type == 2:
+        return _swar_add(line, prev, len(line))
+    row = bytearray(line)
+    n = len(row)
+    if filter_type == 1:
+        for i in range(bpp, n):
+            row[i] = (row[i] + row[i - bpp]) & 0xff
+    elif filter_type == 3:
+        for i in range(n):
+            left = row[i - bpp] if i >= bpp else 0
+            row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xff
+    elif filter_type == 4:
+        for i in range(n):
+            if i >= bpp:
+                a, c = row[i - bpp], prev[i - bpp]
+            else:
+                a = c = 0
+            b = prev[i]
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            if pa <= pb and pa <= pc:
+                predictor = a
+            elif pb <= pc:
+                predictor = b
+            else:
+                predictor = c
+            row[i] = (row[i] + predictor) & 0xff
+    else:
+        raise PNGError(f"Unknown PNG filter type {filter_type}")
+    return bytes(row)
+
+
+class PNGReader:
+    """Streams the decoded scanlines of a PNG file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            if self._file.read(8) != PNG_SIGNATURE:
+                raise PNGError(f"{path} is not a PNG file")
+            tag, data = self._read_chunk()
+            if tag != b"IHDR":
+                raise PNGError(f"{path} does not start with an IHDR chunk")
+            (self.width, self.height, self.bit_depth, self.color_type,
+             _compression, _filter, interlace) = struct.unpack(">IIBBBBB", data)
+            if self.color_type not in CHANNELS or self.bit_depth not in (8, 16):
+                raise PNGError(f"{path}: unsupported colour type {self.color_type} / depth {self.bit_depth}")
+            if interlace:
+                raise PNGError(f"{path}: interlaced PNGs are not supported")
+        except Exception:
+            self._file.close()
+            raise
+        self.bpp = CHANNELS[self.color_type] * self.bit_depth // 8
+        self.stride = self.width * self.bpp
+
+    def _read_chunk(self):
+        header = self._file.read(8)
+        if len(header) < 8:
+            raise PNGError(f"{self.path}: truncated PNG")
+        length, tag = struct.unpack(">I4s", header)
+        data = self._file.read(length)
+        self._file.read(4)  # CRC
+        if len(data) < length:
+            raise PNGError(f"{self.path}: truncated PNG")
+        return tag, data
+
+    def rows(self):
+        """Yield every scanline as raw (unfiltered) bytes, top to bottom."""
+        decompressor = zlib.decompressobj()
+        pending = bytearray()
+        prev = bytes(self.stride)
+        produced = 0
+        line_size = self.stride + 1
+        while produced < self.height:
+            tag, data = self._read_chunk()
+            if tag == b"IEND":
+                break
+            if tag != b"IDAT":
+                continue
+            pending += decompressor.decompress(data)
+            offset = 0
+            while len(pending) - offset >= line_size and produced < self.height:
+                filter_type = pending[offset]
+                line = pending[offset + 1:offset + line_size]
+                prev = unfilter(filter_type, line, prev, self.bpp)
+                produced += 1
+                offset += line_size
+                yield prev
+            del pending[:offset]
+        if produced < self.height:
+            raise PNGError(f"{self.path}: image data ends after {produced} of {self.height} rows")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PNGWriter:
+    """Writes a PNG one scanline at a time (filter type 0, streaming zlib)."""
+
+    def __init__(self, path, width, height, bit_depth=8, color_type=6, level=6):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.stride = width * CHANNELS[color_type] * bit_depth // 8
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(level)
+        self._pending = []
+        self._pending_size = 0
+        self._file = open(path, "wb")
+        self._file.write(PNG_SIGNATURE)
+        self._write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0))
+
+    def _write_chunk(self, tag, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(tag)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)) & 0xffffffff))
+
+    def _emit(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= IDAT_SIZE:
+            self._write_chunk(b"IDAT", b"".join(self._pending))
+            self._pending, self._pending_size = [], 0
+
+    def write_row(self, row):
+        if len(row) != self.stride:
+            raise PNGError(f"Row of {len(row)} bytes, expected {self.stride}")
+        self._emit(self._compressor.compress(b"\x00" + bytes(row)))
+        self.rows_written += 1
+
+    def close(self):
+        if self.rows_written != self.height:
+            self._file.close()
+            raise PNGError(f"{self.rows_written} rows written, expected {self.height}")
+        self._pending.append(self._compressor.flush())
+        self._write_chunk(b"IDAT", b"".join(self._pending))
+        self._write_chunk(b"IEND", b"")
+        self._file.close()
+
+
+def png_size(path):
+    """``(width, height)`` of a PNG, read from its header."""
+    with PNGReader(path) as reader:
+        return reader.width, reader.height
+
+
+def stitch(tile_rows, output_path, level=6):
+    """Stitch a grid of PNG tiles into ``output_path``.
+
+    ``tile_rows`` lists the tile paths row by row, top to bottom and left to
+    right. Only one scanline per open tile is decoded at any time. The
+    result is written next to ``output_path`` and renamed into place.
+    """
+    tmp_path = part_path(output_path)
+    writer = None
+    try:
+        for paths in tile_rows:
+            readers = [PNGReader(p) for p in paths]
+            try:
+                first = readers[0]
+                for r in readers:
+                    if r.height != first.height:
+                        raise PNGError(f"{r.path}: height {r.height} differs from {first.height} in the same tile row")
+                    if (r.bit_depth, r.color_type) != (first.bit_depth, first.color_type):
+                        raise PNGError(f"{r.path}: pixel format differs from the other tiles")
+                width = sum(r.width for r in readers)
+                if writer is None:
+                    total_height = sum(png_size(row[0])[1] for row in tile_rows)
+                    writer = PNGWriter(tmp_path, width, total_height, first.bit_depth, first.color_type, level)
+                elif width != writer.width:
+                    raise PNGError(f"Tile row width {width} differs from {writer.width}")
+                streams = [r.rows() for r in readers]
+                for _ in range(first.height):
+                    writer.write_row(b"".join(next(s) for s in streams))
+            finally:
+                for r in readers:
+                    r.close()
+        if writer is None:
+            raise PNGError("No tiles to stitch")
+        writer.close()
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if writer is not None and not writer._file.closed:
+            writer._file.close()
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def thumbnail(path, output_path, max_size, level=6):
+    """Write ``path`` scaled down to at most ``max_size`` pixels per side.
+
+    Nearest-neighbour sampling, one scanline decoded at a time; decoding
+    stops after the last row the thumbnail needs.
+    """
+    tmp_path = part_path(output_path)
+    with PNGReader(path) as reader:
+        scale = max(1.0, max(reader.width, reader.height) / max_size)
+        width = max(1, int(reader.width / scale))
+        height = max(1, int(reader.height / scale))
+        columns = [int(x * scale) * reader.bpp for x in range(width)]
+        bpp = reader.bpp
+        writer = PNGWriter(tmp_path, width, height, reader.bit_depth, reader.color_type, level)
+        try:
+            y = 0
+            for source_y, row in enumerate(reader.rows()):
+                if source_y == int(y * scale):
+                    writer.write_row(b"".join(row[c:c + bpp] for c in columns))
+                    y += 1
+                    if y == height:
+                        break
+            writer.close()
+        except Exception:
+            if not writer._file.closed:
+                writer._file.close()
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+    os.replace(tmp_path, output_path)
@@ -0,0 +1,216 @@
+"""Cache of finished render outputs, keyed by everything that determines them.
+
+A key is the hash of the .blend content, the effective render settings and
+the Blender version (see ``cache_key``). Each entry is a directory holding
+the outputs of one render, hard linked from the output directory so they
+take no extra space while both exist; small metadata files (``.json``) are
+copied since they are rewritten for each job. Entries are evicted least
+recently used first once they take more than ``max_bytes``.
+
+Outputs must never be modified in place once stored: renders remove their
+previous output before writing a new one.
+
+Several processes may share the directory: an entry stored by another
+process is picked up on lookup.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import functools
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ENTRY_FILE = "entry.json"
+TEMP_PREFIX = ".tmp-"
+# Entries being written are left alone for this long, they may belong to another process
+STALE_TEMP_SECONDS = 3600
+# Copied rather than linked into and out of the cache
+COPIED_EXTENSIONS = (".json",)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_digest(path, mtime_ns, size):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """SHA-256 of a file, cached until the file changes (mtime or size)."""
+    st = os.stat(path)
+    return _cached_digest(path, st.st_mtime_ns, st.st_size)
+
+
+def cache_key(content_hash, settings, blender_version, **extra):
+    """Key of a render of content ``content_hash`` with ``settings``."""
+    parts = {"content": content_hash, "settings": settings, "blender": blender_version, **extra}
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src, dest):
+    """Put ``src`` at ``dest`` atomically, as a hard link when possible."""
+    tmp = os.path.join(os.path.dirname(dest), f"{TEMP_PREFIX}{uuid.uuid4().hex[:12]}")
+    if src.endswith(COPIED_EXTENSIONS):
+        shutil.copyfile(src, tmp)
+    else:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+class RenderCache:
+    """Render outputs stored under ``directory``, at most ``max_bytes`` of them.
+
+    Outputs are identified by their name relative to the job's output base
+    (``0001.png``, ``_manifest.json``), so a hit can be restored under
+    another base name.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> size, least recently used first; loaded on first use
+        self._entries = None
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(TEMP_PREFIX):
+                if time.time() - entry.stat().st_mtime > STALE_TEMP_SECONDS:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            try:
+                with open(os.path.join(entry.path, ENTRY_FILE)) as f:
+                    meta = json.load(f)
+                last_used = os.path.getmtime(os.path.join(entry.path, ENTRY_FILE))
+            except (OSError, ValueError):
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            entries.append((last_used, entry.name, meta["bytes"]))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        logger.info(f"Render cache: {len(self._entries)} entries in {self.directory}")
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def _adopt(self, key):
+        # Called with the lock held: an entry stored by another process
+        try:
+            with open(os.path.join(self._entry_dir(key), ENTRY_FILE)) as f:
+                self._entries[key] = json.load(f)["bytes"]
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def lookup(self, key, output_base):
+        """Restore the outputs stored for ``key`` next to ``output_base``.
+
+        Returns the restored file names, or None on a miss.
+        """
+        with self._lock:
+            self._load()
+            if key not in self._entries and not self._adopt(key):
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, ENTRY_FILE)) as f:
+                meta = json.load(f)
+            base = os.path.basename(output_base)
+            outputs = []
+            for suffix in meta["files"]:
+                _link_or_copy(os.path.join(entry_dir, suffix), f"{output_base}{suffix}")
+                outputs.append(f"{base}{suffix}")
+            os.utime(os.path.join(entry_dir, ENTRY_FILE))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable render cache entry {key}: {e}")
+            self._remove(key)
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return outputs
+
+    def store(self, key, output_base, outputs):
+        """Store the files ``outputs`` (names next to ``output_base``) under ``key``."""
+        base = os.path.basename(output_base)
+        directory = os.path.dirname(output_base)
+        if not outputs or not all(name.startswith(base) for name in outputs):
+            return False
+        with self._lock:
+            self._load()
+        tmp = os.path.join(self.directory, f"{TEMP_PREFIX}{uuid.uuid4().hex[:12]}")
+        os.makedirs(tmp)
+        try:
+            files = []
+            size = 0
+            for name in outputs:
+                suffix = os.path.basename(name[len(base):])
+                _link_or_copy(os.path.join(directory, name), os.path.join(tmp, suffix))
+                size += os.path.getsize(os.path.join(tmp, suffix))
+                files.append(suffix)
+            if size > self.max_bytes:
+                logger.info(f"Not caching {base}: {size} bytes is over the cache size")
+                return False
+            with open(os.path.join(tmp, ENTRY_FILE), "w") as f:
+                json.dump({"files": files, "bytes": size, "created_at": time.time()}, f)
+            with self._lock:
+                if key in self._entries or self._adopt(key):
+                    return False
+                os.rename(tmp, self._entry_dir(key))
+                self._entries[key] = size
+                self.stats["stores"] += 1
+            logger.info(f"Render cache: stored {len(files)} file(s) of {base} ({size} bytes)")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self._evict()
+        return True
+
+    def _remove(self, key):
+        with self._lock:
+            if self._entries is not None:
+                self._entries.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            total = sum(self._entries.values())
+            while total > self.max_bytes and self._entries:
+                key, size = self._entries.popitem(last=False)
+                total -= size
+                evicted.append(key)
+            self.stats["evictions"] += len(evicted)
+        for key in evicted:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        if evicted:
+            logger.info(f"Render cache: evicted {len(evicted)} entries")
+
+    def status(self):
+        with self._lock:
+            self._load()
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                entries=len(self._entries),
+                bytes=sum(self._entries.values()),
+                max_bytes=self.max_bytes,
+                hit_rate=round(self.stats["hits"] / lookups, 3) if lookups else None,
+            )
@@ -0,0 +1,187 @@
+"""Live progress of render jobs, parsed from Blender's output as it is printed.
+
+``BlenderOutput`` consumes the output of one Blender process line by line:
+status lines (``Fra:1 Mem:… | Time:… | Remaining:… | Sample 8/128``)
+become progress updates of the job, other lines go to the job's own log
+file (the shared log when there is no job) and the last few are kept to
+report errors.
+
+Each job publishes its state changes and progress updates to an
+``EventLog``, a bounded buffer of numbered events that ``event_stream``
+serves as Server-Sent Events. Readers that fall behind miss the oldest
+events but memory stays the same however long the render.
+"""
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Events kept per job while it runs, and once it is finished
+EVENT_BUFFER = 256
+FINISHED_EVENT_BUFFER = 8
+# Output lines kept per process for error reports
+TAIL_LINES = 50
+ERROR_LINES = 20
+
+_FRAME = re.compile(r"Fra:\s*(\d+)")
+_MEMORY = re.compile(r"Mem:\s*([\d.]+)([KMG]?)\s*\(Peak\s*([\d.]+)([KMG]?)\)")
+_TIME = re.compile(r"\bTime:\s*([\d:.]+)")
+_REMAINING = re.compile(r"Remaining:\s*([\d:.]+)")
+# Cycles ("Sample 8/128") and EEVEE ("Rendering 8 / 64 samples")
+_SAMPLE = re.compile(r"Sample\s+(\d+)\s*/\s*(\d+)|Rendering\s+(\d+)\s*/\s*(\d+)\s+samples")
+_SAVED = re.compile(r"Saved:\s*'([^']+)'")
+
+_UNITS = {"K": 1 / 1024, "M": 1, "G": 1024, "": 1 / (1024 * 1024)}
+
+# Chunks and tiles of a job can render on several devices at once
+_progress_lock = threading.Lock()
+
+
+def parse_duration(value):
+    """Seconds in a Blender duration such as ``01:02.50`` or ``1:00:02.50``."""
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part or 0)
+    return seconds
+
+
+def parse_line(line):
+    """Progress fields of one Blender output line, None for other lines."""
+    saved = _SAVED.search(line)
+    if saved:
+        return {"saved": saved.group(1)}
+    frame = _FRAME.search(line)
+    if frame is None:
+        return None
+    progress = {"frame": int(frame.group(1))}
+    m = _MEMORY.search(line)
+    if m:
+        progress["mem_mb"] = round(float(m.group(1)) * _UNITS[m.group(2)], 2)
+        progress["peak_mb"] = round(float(m.group(3)) * _UNITS[m.group(4)], 2)
+    m = _TIME.search(line)
+    if m:
+        progress["elapsed"] = parse_duration(m.group(1))
+    m = _REMAINING.search(line)
+    if m:
+        progress["remaining"] = parse_duration(m.group(1))
+    m = _SAMPLE.search(line)
+    if m:
+        sample, samples = (int(v) for v in (m.group(1, 2) if m.group(1) else m.group(3, 4)))
+        progress["sample"], progress["samples"] = sample, samples
+        if samples:
+            progress["percent"] = round(100.0 * sample / samples, 1)
+    return progress
+
+
+class EventLog:
+    """Bounded log of numbered events that readers can wait on."""
+
+    def __init__(self, maxlen=EVENT_BUFFER):
+        self._events = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self.last_id = 0
+        self.closed = False
+
+    def publish(self, kind, data):
+        with self._cond:
+            self.last_id += 1
+            self._events.append((self.last_id, kind, data))
+            self._cond.notify_all()
+
+    def close(self, keep=FINISHED_EVENT_BUFFER):
+        """No more events will come; only the last ``keep`` are kept."""
+        with self._cond:
+            self.closed = True
+            self._events = deque(self._events, maxlen=keep)
+            self._cond.notify_all()
+
+    def since(self, last_id, timeout=None):
+        """Events after ``last_id``, waiting up to ``timeout`` for one.
+
+        Returns ``(events, closed)``; events are ``(id, kind, data)``.
+        """
+        with self._cond:
+            if self.last_id <= last_id and not self.closed:
+                self._cond.wait(timeout)
+            return [e for e in self._events if e[0] > last_id], self.closed
+
+
+def format_event(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(log, snapshot=None, last_id=None, heartbeat=15):
+    """Server-Sent Events for ``log``, until it is closed.
+
+    A new reader (no ``last_id``) first gets ``snapshot``, the current
+    state, as a ``state`` event, then only the events that follow it.
+    """
+    yield "retry: 3000\n\n"
+    if last_id is None:
+        last_id = log.last_id
+        if snapshot is not None:
+            yield format_event(last_id, "state", snapshot)
+    while True:
+        events, closed = log.since(last_id, timeout=heartbeat)
+        for event_id, kind, data in events:
+            yield format_event(event_id, kind, data)
+            last_id = event_id
+        if closed:
+            return
+        if not events:
+            yield ": keep-alive\n\n"
+
+
+def record_progress(job, progress, source=None):
+    """Merge parsed ``progress`` into ``job.progress`` and publish it."""
+    with _progress_lock:
+        current = dict(job.progress or {})
+        if "saved" in progress:
+            current["frames_done"] = current.get("frames_done", 0) + 1
+            current["saved"] = progress["saved"]
+        else:
+            current.update(progress)
+            current["peak_mb"] = max(current.get("peak_mb", 0), progress.get("peak_mb", 0))
+        if source is not None:
+            current["source"] = source
+        current["updated_at"] = time.time()
+        job.progress = current
+        job.events.publish("progress", current)
+
+
+class BlenderOutput:
+    """Handles the output lines of one Blender process rendering ``job``."""
+
+    def __init__(self, job=None, source=None, pid=None):
+        self.job = job
+        self.source = source
+        self.pid = pid
+        self.lines = deque(maxlen=TAIL_LINES)
+        self.error_lines = deque(maxlen=ERROR_LINES)
+
+    def feed(self, line):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            return
+        self.lines.append(line)
+        if "Error:" in line:
+            self.error_lines.append(line)
+        progress = parse_line(line)
+        if progress is None or "saved" in progress:
+            job_log = getattr(self.job, "log", None)
+            if job_log is not None:
+                job_log.write(line, self.source)
+            else:
+                logger.info(f"Blender[{self.pid}]: {line}")
+        if progress is not None and self.job is not None:
+            record_progress(self.job, progress, self.source)
+
+    def errors(self):
+        return "\n".join(self.error_lines)
+
+    def tail(self):
+        return "\n".join(self.lines)
@@ -0,0 +1,488 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from render_progress import EventLog
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINAL_STATES = {DONE, FAILED, CANCELLED}
+
+# Count of a batch's jobs that were finished and forgotten since
+EXPIRED = "expired"
+
+# Higher runs first; single renders from the page go before batches, and the
+# quick drafts of progressive renders before everything
+PRIORITY_BATCH = 0
+PRIORITY_INTERACTIVE = 10
+PRIORITY_PREVIEW = 20
+
+# Settings a progressive render's draft differs in from its full render
+DRAFT_SETTINGS = ("quality", "tiles")
+
+
+class JobCancelled(Exception):
+    """Raised by a runner when the job it is executing has been cancelled."""
+
+
+class RenderJob:
+    """A single render request and its lifecycle state."""
+
+    def __init__(self, filename, blend_path, output_base, settings=None,
+                 priority=PRIORITY_INTERACTIVE, batch_id=None, idempotency_key=None, deadline=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.filename = filename
+        self.blend_path = blend_path
+        self.output_base = output_base
+        self.settings = dict(settings or {})
+        self.priority = priority
+        self.batch_id = batch_id
+        # Submitting again with the same key returns this job instead of a new one
+        self.idempotency_key = idempotency_key
+        # Timestamp by which the job must be done, it fails once it is passed
+        self.deadline = deadline
+        self.deadline_exceeded = False
+        self.state = QUEUED
+        self.error = None
+        self.outputs = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Name of the device slot the job rendered on
+        self.device = None
+        # Expected output size and cost read from the .blend file, if known
+        self.estimate = None
+        # Render cache key once computed, True when the outputs came from the cache
+        self.cache_key = None
+        self.cached = False
+        # Latest progress parsed from Blender's output, and the job's event log
+        self.progress = None
+        self.events = EventLog()
+        # Per-job log file receiving Blender's output while the job runs
+        self.log = None
+        self.cancel_event = threading.Event()
+        # Blender processes (Popen) currently running for this job
+        self.processes = set()
+        # Progressive renders: the draft rendered first (``preview``) and the
+        # job queued once the draft is over (``followup``). Both are replaced
+        # by the next submission of their file.
+        self.preview = None
+        self.followup = None
+        self.progressive = False
+        # Running jobs this one superseded, it starts once they stopped
+        self.superseded = []
+
+    @property
+    def finished(self):
+        return self.state in FINAL_STATES
+
+    def render_key(self, ignore=()):
+        """What the job renders: its file, output and effective settings but ``ignore``.
+
+        Active jobs with equal keys are duplicates, like render cache entries.
+        """
+        settings = {k: v for k, v in self.settings.items() if k not in ignore}
+        output_base = None if ignore else self.output_base
+        return json.dumps([self.blend_path, output_base, settings], sort_keys=True, default=str)
+
+    @property
+    def group(self):
+        """Jobs of a group share their priority level fairly with other groups."""
+        return self.batch_id or self.id
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "state": self.state,
+            "error": self.error,
+            "outputs": list(self.outputs),
+            "settings": dict(self.settings),
+            "priority": self.priority,
+            "batch_id": self.batch_id,
+            "deadline": self.deadline,
+            "device": self.device,
+            "estimate": self.estimate,
+            "progress": self.progress,
+            "cached": self.cached,
+            "progressive": self.progressive,
+            "preview": self.preview.preview_dict() if self.preview is not None else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def preview_dict(self):
+        """What the final job of a progressive render shows of its draft."""
+        return {"id": self.id, "state": self.state, "outputs": list(self.outputs)}
+
+
+class RenderBatch:
+    """Jobs submitted together through the batch API."""
+
+    def __init__(self, job_ids, idempotency_key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.job_ids = list(job_ids)
+        self.idempotency_key = idempotency_key
+        self.created_at = time.time()
+
+
+def batch_summary(batch_id, created_at, job_ids, jobs):
+    """Status of a batch from the dicts of its known ``jobs``, with the aggregate state.
+
+    Jobs no longer known were forgotten once finished (see ``RenderQueue._trim``);
+    they are counted as ``expired`` and do not keep the batch running.
+    """
+    counts = {}
+    for job in jobs:
+        counts[job["state"]] = counts.get(job["state"], 0) + 1
+    if len(jobs) < len(job_ids):
+        counts[EXPIRED] = len(job_ids) - len(jobs)
+    if not all(state in FINAL_STATES or state == EXPIRED for state in counts):
+        state = RUNNING if set(counts) - {QUEUED} else QUEUED
+    else:
+        state = DONE if set(counts) <= {DONE, EXPIRED} else FAILED
+    return {
+        "id": batch_id,
+        "state": state,
+        "counts": counts,
+        "created_at": created_at,
+        "jobs": jobs,
+    }
+
+
+class RenderQueue:
+    """Priority render queue served by a fixed pool of worker threads.
+
+    Jobs run highest ``priority`` first. Within a priority level the job
+    groups (a batch, or a job on its own) take turns, so a large batch
+    does not hold back the jobs submitted after it.
+
+    ``runner`` is called with the job and does the actual work; it returns
+    normally on success, raises ``JobCancelled`` when it noticed a
+    cancellation and any other exception on failure. ``on_finish`` is
+    called with each job once it reached a final state, ``on_change``
+    after each state change of a job (with the queue's lock held).
+    """
+
+    def __init__(self, runner, workers=1, history=200, on_finish=None, on_change=None):
+        self._runner = runner
+        self._on_finish = on_finish
+        self._on_change = on_change
+        self._workers = max(1, int(workers))
+        self._history = history
+        # priority -> {group: deque of jobs}, groups in turn order
+        self._lanes = {}
+        self._jobs = OrderedDict()
+        self._keys = {}
+        self._batches = OrderedDict()
+        self._batch_keys = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._threads = []
+        # Jobs taken out of their lane until the jobs they superseded stop
+        self._held = []
+
+    def _ensure_started(self):
+        # Threads are started on first use so that importing the app (e.g. in
+        # the Flask reloader parent process) does not spawn idle workers.
+        if self._threads:
+            return
+        for i in range(self._workers):
+            t = threading.Thread(target=self._work, name=f"render-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"Started {self._workers} render worker(s)")
+
+    def submit(self, job, preview=None):
+        """Queue a job, or return the job it duplicates.
+
+        That is the job submitted before with the same idempotency key, or
+        the active job rendering the same file with the same settings; the
+        latter is moved up to ``job``'s priority if it was lower. Active jobs
+        of a progressive render of the file with the same settings, draft or
+        full quality, are cancelled instead and ``job`` starts once they
+        stopped. Other renders of the file are queued as separate jobs.
+
+        With ``preview``, a draft of the same render, the render is
+        progressive: the draft is queued (or recorded, when ``cached``)
+        and ``job`` only queued once the draft is over.
+        """
+        with self._lock:
+            self._ensure_started()
+            if preview is None:
+                existing = self._submit(job)
+            else:
+                existing = self._submit_progressive(job, preview)
+        if existing is None:
+            logger.info(f"Queued render job {job.id} for {job.filename} (priority {job.priority})")
+            return job
+        return existing
+
+    def submit_batch(self, jobs, idempotency_key=None):
+        """Queue ``jobs`` as one batch; returns ``(batch, created)``.
+
+        Jobs already ``cached`` are recorded as done. A batch with the same
+        idempotency key is returned as is.
+        """
+        with self._lock:
+            self._ensure_started()
+            batch = self._batches.get(self._batch_keys.get(idempotency_key))
+            if batch is not None:
+                return batch, False
+            batch = RenderBatch([], idempotency_key)
+            for job in jobs:
+                job.batch_id = batch.id
+                existing = self._jobs.get(self._keys.get(job.idempotency_key))
+                if existing is None and job.cached:
+                    self._add_finished(job)
+                elif existing is None:
+                    existing = self._submit(job)
+                batch.job_ids.append((existing or job).id)
+            self._batches[batch.id] = batch
+            if idempotency_key is not None:
+                self._batch_keys[idempotency_key] = batch.id
+            self._trim()
+        logger.info(f"Queued render batch {batch.id} of {len(jobs)} job(s)")
+        return batch, True
+
+    def _submit(self, job):
+        # Called with the lock held; returns the existing job, None once queued
+        existing = self._duplicate(job)
+        if existing is None:
+            self._add(job)
+        return existing
+
+    def _submit_progressive(self, job, preview):
+        # Called with the lock held, like _submit
+        existing = self._duplicate(job)
+        if existing is not None:
+            return existing
+        job.preview, preview.followup = preview, job
+        preview.superseded = list(job.superseded)
+        job.progressive = preview.progressive = True
+        # Queued by _publish once the draft is over
+        self._add(job, enqueue=False)
+        if preview.cached:
+            self._add_finished(preview)
+        else:
+            self._add(preview)
+        return None
+
+    def _duplicate(self, job):
+        # Called with the lock held: the job that ``job`` duplicates, if any
+        existing = self._jobs.get(self._keys.get(job.idempotency_key))
+        if existing is not None:
+            return existing
+        key = job.render_key()
+        progressive_key = job.render_key(ignore=DRAFT_SETTINGS)
+        for existing in list(self._jobs.values()):
+            if existing.blend_path != job.blend_path or existing.finished:
+                continue
+            if existing.progressive:
+                if existing.render_key(ignore=DRAFT_SETTINGS) == progressive_key:
+                    logger.info(f"Render job {existing.id} superseded by a new render of {job.filename}")
+                    self._cancel(existing)
+                    if not existing.finished:
+                        # Still stopping, and writing the same outputs
+                        job.superseded.append(existing)
+                continue
+            if existing.render_key() != key:
+                continue
+            if existing.state == QUEUED and job.priority > existing.priority:
+                existing.priority = job.priority
+                self._enqueue(existing)
+            return existing
+        return None
+
+    def _add(self, job, enqueue=True):
+        # Called with the lock held
+        self._jobs[job.id] = job
+        if job.idempotency_key is not None:
+            self._keys[job.idempotency_key] = job.id
+        self._trim()
+        self._publish(job)
+        if enqueue:
+            self._enqueue(job)
+
+    def _enqueue(self, job):
+        # Called with the lock held. A job moved to another priority stays in
+        # its old lane too, and is skipped there.
+        self._lanes.setdefault(job.priority, OrderedDict()).setdefault(job.group, deque()).append(job)
+        self._ready.notify()
+
+    def _next(self):
+        # Called with the lock held: the next job to run, None if there is none
+        for priority in sorted(self._lanes, reverse=True):
+            groups = self._lanes[priority]
+            while groups:
+                group, jobs = next(iter(groups.items()))
+                job = jobs.popleft()
+                if jobs:
+                    groups.move_to_end(group)
+                else:
+                    del groups[group]
+                if job.state != QUEUED or job.priority != priority:
+                    continue
+                if any(not superseded.finished for superseded in job.superseded):
+                    self._held.append(job)
+                    continue
+                return job
+            del self._lanes[priority]
+        return None
+
+    def add_finished(self, job):
+        """Record a job completed without running, e.g. served from a cache."""
+        with self._lock:
+            self._add_finished(job)
+        logger.info(f"Render job {job.id} for {job.filename} completed without rendering")
+        return job
+
+    def _add_finished(self, job):
+        # Called with the lock held
+        now = time.time()
+        job.state = DONE
+        job.started_at = job.finished_at = now
+        self._jobs[job.id] = job
+        if job.idempotency_key is not None:
+            self._keys[job.idempotency_key] = job.id
+        self._trim()
+        self._publish(job)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def batch(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def batch_for_key(self, idempotency_key):
+        with self._lock:
+            return self._batches.get(self._batch_keys.get(idempotency_key))
+
+    def batch_status(self, batch):
+        """The batch's jobs and their aggregate state."""
+        with self._lock:
+            dicts = [self._jobs[job_id].to_dict() for job_id in batch.job_ids if job_id in self._jobs]
+        return batch_summary(batch.id, batch.created_at, batch.job_ids, dicts)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            self._cancel(job)
+        logger.info(f"Cancellation requested for render job {job_id}")
+        return job
+
+    def _cancel(self, job):
+        # Called with the lock held
+        job.cancel_event.set()
+        if job.state == QUEUED:
+            job.state = CANCELLED
+            job.finished_at = time.time()
+            self._publish(job)
+        for process in list(job.processes):
+            if process.poll() is None:
+                process.terminate()
+
+    def _expire(self, job):
+        # Deadline timer of a running job
+        job.deadline_exceeded = True
+        logger.warning(f"Render job {job.id} missed its deadline")
+        self.cancel(job.id)
+
+    def _publish(self, job):
+        # Called with the lock held, right after a state change
+        job.events.publish("state", job.to_dict())
+        if self._on_change is not None:
+            try:
+                self._on_change(job)
+            except Exception as e:
+                logger.error(f"Render job change handler failed: {e}")
+        if job.finished:
+            followup = job.followup
+            if followup is not None and followup.state == QUEUED:
+                # The draft is over, shown by the final job; its render can start
+                self._publish(followup)
+                self._enqueue(followup)
+            # Held jobs go back to their lanes, _next checks them again
+            held, self._held = self._held, []
+            for waiting in held:
+                self._enqueue(waiting)
+            job.events.close()
+            if self._on_finish is not None:
+                try:
+                    self._on_finish(job)
+                except Exception as e:
+                    logger.error(f"Render job finish handler failed: {e}")
+
+    def _trim(self):
+        # Forget the oldest finished jobs and batches once the history limit is exceeded
+        excess = len(self._jobs) - self._history
+        if excess > 0:
+            for job in [j for j in self._jobs.values() if j.finished][:excess]:
+                del self._jobs[job.id]
+                self._keys.pop(job.idempotency_key, None)
+        while len(self._batches) > self._history:
+            _, batch = self._batches.popitem(last=False)
+            self._batch_keys.pop(batch.idempotency_key, None)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                job = self._next()
+                while job is None:
+                    self._ready.wait()
+                    job = self._next()
+                job.started_at = time.time()
+                if job.deadline is not None and job.started_at >= job.deadline:
+                    job.state = FAILED
+                    job.error = "Deadline passed before the job could start"
+                    job.finished_at = job.started_at
+                    self._publish(job)
+                    logger.info(f"Render job {job.id} expired in the queue")
+                    continue
+                job.state = RUNNING
+                self._publish(job)
+            timer = None
+            if job.deadline is not None:
+                timer = threading.Timer(job.deadline - time.time(), self._expire, args=(job,))
+                timer.daemon = True
+                timer.start()
+            try:
+                self._runner(job)
+                state, error = DONE, None
+            except JobCancelled:
+                state, error = CANCELLED, None
+            except Exception as e:
+                logger.exception(f"Render job {job.id} failed")
+                state, error = FAILED, str(e)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            with self._lock:
+                if job.cancel_event.is_set() and state != DONE:
+                    state, error = CANCELLED, None
+                    if job.deadline_exceeded:
+                        state, error = FAILED, "Deadline exceeded"
+                job.state = state
+                job.error = error
+                job.finished_at = time.time()
+                self._publish(job)
+            logger.info(f"Render job {job.id} finished: {state}")
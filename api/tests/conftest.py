@@ -0,0 +1,26 @@
+"""Shared fixtures: the fake Blender and synthetic .blend files of ``benchmarks/``."""
+import os
+import sys
+
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(API_DIR, "benchmarks")
+sys.path[:0] = [API_DIR, BENCH_DIR]
+
+from synthetic_blend import write_blend_file  # noqa: E402
+
+FAKE_BLENDER = os.path.join(BENCH_DIR, "fake_blender.py")
+
+
+@pytest.fixture
+def fake_blender(monkeypatch):
+    """Path of the fake Blender, set to start at once and render a frame in 0.05 s."""
+    monkeypatch.setenv("FAKE_BLENDER_STARTUP", "0")
+    monkeypatch.setenv("FAKE_BLENDER_RENDER", "0.05")
+    return FAKE_BLENDER
+
+
+@pytest.fixture
+def blend_file(tmp_path):
+    return write_blend_file(str(tmp_path / "scene.blend"))
@@ -0,0 +1,126 @@
+import os
+import time
+import importlib
+
+import pytest
+
+from conftest import FAKE_BLENDER, write_blend_file
+from render_queue import DONE, EXPIRED, FAILED, QUEUED, RUNNING, batch_summary
+
+JSON = {"Accept": "application/json"}
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    """The app on a fresh workdir, rendering with the fake Blender on two GPU slots."""
+    workdir = tmp_path_factory.mktemp("workdir")
+    os.makedirs(workdir / "uploads")
+    for name in ("scene.blend", "other.blend"):
+        write_blend_file(str(workdir / "uploads" / name))
+    environ = dict(os.environ)
+    for key in [k for k in os.environ if k.startswith("GOOGLE_")]:
+        del os.environ[key]
+    os.environ.update(
+        WORKDIR=str(workdir), BLENDER_BIN=FAKE_BLENDER, AUTH_TOKEN="test", RENDER_DEVICES="0,1",
+        RENDER_CPU_SLOT="false", RENDER_CACHE_MB="0", GDRIVE_API_ENDPOINT="http://127.0.0.1:9/drive/v3/",
+        FAKE_BLENDER_STARTUP="0", FAKE_BLENDER_RENDER="0.2",
+    )
+    try:
+        app = importlib.import_module("app").app
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    app.config["WTF_CSRF_ENABLED"] = False
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["authenticated"] = True
+    return client
+
+
+def wait_batch(client, batch_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        batch = client.get(f"/batches/{batch_id}", headers=JSON).get_json()
+        if batch["state"] not in (QUEUED, RUNNING) or time.monotonic() > deadline:
+            return batch
+        time.sleep(0.05)
+
+
+def test_batch_renders_every_file(client):
+    body = {"jobs": [{"filename": "scene.blend", "frame": 1}, {"filename": "other.blend", "frame": 3}]}
+    response = client.post("/render_batch", json=body, headers=JSON)
+    assert response.status_code == 202
+    batch = wait_batch(client, response.get_json()["id"])
+    assert batch["state"] == DONE
+    assert sorted(output for job in batch["jobs"] for output in job["outputs"]) == [
+        "other0003.png", "scene0001.png"]
+
+
+def test_idempotency_key_returns_the_first_batch(client):
+    body = {"jobs": [{"filename": "scene.blend", "frame": 2}]}
+    headers = dict(JSON, **{"Idempotency-Key": "batch-1"})
+    first = client.post("/render_batch", json=body, headers=headers)
+    again = client.post("/render_batch", json=body, headers=headers)
+    assert (first.status_code, again.status_code) == (202, 200)
+    assert again.get_json()["id"] == first.get_json()["id"]
+    assert wait_batch(client, first.get_json()["id"])["state"] == DONE
+
+
+def test_frames_of_one_file_are_separate_jobs(client):
+    body = {"jobs": [{"filename": "scene.blend", "frame": 1}, {"filename": "scene.blend", "frame": 5}]}
+    batch = client.post("/render_batch", json=body, headers=JSON).get_json()
+    assert len({job["id"] for job in batch["jobs"]}) == 2
+
+    batch = wait_batch(client, batch["id"])
+    assert batch["state"] == DONE
+    assert sorted(output for job in batch["jobs"] for output in job["outputs"]) == [
+        "scene0001.png", "scene0005.png"]
+
+
+def test_renders_of_one_file_overlap(client):
+    body = {"jobs": [{"filename": "scene.blend", "frame": 3}, {"filename": "scene.blend", "frame": 4}]}
+    batch = client.post("/render_batch", json=body, headers=JSON).get_json()
+    batch = wait_batch(client, batch["id"])
+    assert batch["state"] == DONE
+    first, second = sorted(batch["jobs"], key=lambda job: job["started_at"])
+    assert second["started_at"] < first["finished_at"]
+    assert {first["device"], second["device"]} == {"gpu0", "gpu1"}
+
+
+@pytest.mark.parametrize("item", [
+    {"filename": "scene.blend", "animation": True, "start": 1, "end": 2},
+    {"filename": "scene.blend", "frame": 6, "tiles": "2"},
+])
+def test_parallel_render_reports_its_slots(client, item):
+    batch = client.post("/render_batch", json={"jobs": [item]}, headers=JSON).get_json()
+    batch = wait_batch(client, batch["id"])
+    assert batch["state"] == DONE, batch
+    assert batch["jobs"][0]["device"] == "gpu0, gpu1"
+
+
+def test_same_render_twice_is_one_job(client):
+    body = {"jobs": [{"filename": "scene.blend", "frame": 2}, {"filename": "scene.blend", "frame": 2}]}
+    batch = client.post("/render_batch", json=body, headers=JSON).get_json()
+    assert len({job["id"] for job in batch["jobs"]}) == 1
+    assert wait_batch(client, batch["id"])["state"] == DONE
+
+
+@pytest.mark.parametrize("body, status", [
+    ({}, 400),
+    ({"jobs": []}, 400),
+    ({"jobs": [{"frame": 1}]}, 400),
+    ({"jobs": [{"filename": "scene.blend", "priority": "high"}]}, 400),
+    ({"jobs": [{"filename": "missing.blend"}]}, 404),
+])
+def test_invalid_batches_are_refused(client, body, status):
+    assert client.post("/render_batch", json=body, headers=JSON).status_code == status
+
+
+def test_forgotten_jobs_count_as_expired():
+    done, failed, running = {"state": DONE}, {"state": FAILED}, {"state": RUNNING}
+    summary = batch_summary("b", 0, ["a", "b", "c"], [done])
+    assert summary["state"] == DONE
+    assert summary["counts"] == {DONE: 1, EXPIRED: 2}
+    assert batch_summary("b", 0, ["a", "b"], [])["state"] == DONE
+    assert batch_summary("b", 0, ["a", "b"], [failed])["state"] == FAILED
+    assert batch_summary("b", 0, ["a", "b"], [running])["state"] == RUNNING
@@ -0,0 +1,155 @@
+import io
+import gzip
+import struct
+
+import pytest
+
+from conftest import write_blend_file
+from synthetic_blend import write_blend
+from blend_reader import BlendFeeder, BlendFile, BlendReadError, estimate_render, read_blend_info
+
+SCENE = {"name": "Shot", "resolution_x": 1280, "resolution_y": 720, "resolution_percentage": 50,
+         "frame_start": 10, "frame_end": 40, "fps": 25, "samples": 64}
+
+
+def blend_bytes(**kwargs):
+    out = io.BytesIO()
+    write_blend(out, **kwargs)
+    return out.getvalue()
+
+
+def large_bhead(data):
+    """The classic 64-bit file ``data`` rewritten with the large-BHead header and block headers."""
+    classic, large = struct.Struct("<4siQii"), struct.Struct("<4siQqq")
+    out = [b"BLENDER17-01v0500"]
+    pos = 12
+    while pos < len(data):
+        code, length, old, sdna_index, count = classic.unpack_from(data, pos)
+        pos += classic.size
+        out.append(large.pack(code, sdna_index, old, length, count) + data[pos:pos + length])
+        pos += length
+    return b"".join(out)
+
+
+def test_scene_settings_and_texts(tmp_path):
+    path = write_blend_file(str(tmp_path / "a.blend"), scene=SCENE, texts={"setup.py": "import bpy\nprint(1)"})
+    info = read_blend_info(path)
+    assert info["version"] == "4.4" and info["compression"] is None
+    assert info["texts"] == ["setup.py"]
+    scene = info["scene"]
+    assert scene["name"] == "Shot" and scene["engine"] == "CYCLES"
+    assert (scene["resolution_x"], scene["resolution_y"], scene["resolution_percentage"]) == (1280, 720, 50)
+    assert (scene["frame_start"], scene["frame_end"], scene["fps"], scene["samples"]) == (10, 40, 25, 64)
+    assert BlendFile(path).texts() == {"setup.py": "import bpy\nprint(1)"}
+    assert estimate_render(scene) == {"width": 640, "height": 360, "frames": 31, "samples": 64,
+                                      "cost": 640 * 360 * 64 * 31}
+
+
+def test_32_bit_pointers(tmp_path):
+    path = write_blend_file(str(tmp_path / "a.blend"), scene=SCENE, pointer_size=4)
+    assert read_blend_info(path)["scene"]["resolution_x"] == 1280
+
+
+def test_large_bhead_header(tmp_path):
+    path = tmp_path / "a.blend"
+    path.write_bytes(large_bhead(blend_bytes(scene=SCENE, texts={"t": "x"})))
+    info = read_blend_info(str(path))
+    assert info["version"] == "5.0"
+    assert info["scene"]["frame_end"] == 40 and info["texts"] == ["t"]
+
+
+def test_gzip_members(tmp_path):
+    data = blend_bytes(scene=SCENE, filler_bytes=200_000)
+    path = tmp_path / "a.blend"
+    # Blender may write several gzip members, decoded as one stream
+    path.write_bytes(gzip.compress(data[:100_000]) + gzip.compress(data[100_000:]))
+    info = read_blend_info(str(path))
+    assert info["compression"] == "gzip" and info["scene"]["samples"] == 64
+
+
+def test_zstd_frames(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    data = blend_bytes(scene=SCENE, filler_bytes=200_000)
+    compressor = zstandard.ZstdCompressor()
+    path = tmp_path / "a.blend"
+    # One zstd frame per chunk of the file, like Blender writes them
+    path.write_bytes(b"".join(compressor.compress(data[i:i + 65536]) for i in range(0, len(data), 65536)))
+    info = read_blend_info(str(path))
+    assert info["compression"] == "zstd" and info["scene"]["samples"] == 64
+
+
+@pytest.mark.parametrize("compress", [None, "gzip"])
+def test_truncated_file(tmp_path, compress):
+    data = blend_bytes(scene=SCENE, filler_bytes=100_000)
+    path = tmp_path / "a.blend"
+    cut = data[:60_000]
+    path.write_bytes(gzip.compress(cut) if compress else cut)
+    with pytest.raises(BlendReadError):
+        read_blend_info(str(path))
+
+
+def test_not_a_blend_file(tmp_path):
+    path = tmp_path / "a.blend"
+    path.write_bytes(b"PK\x03\x04 not a blend")
+    with pytest.raises(BlendReadError):
+        read_blend_info(str(path))
+
+
+def test_kept_blocks_are_bounded(tmp_path):
+    path = write_blend_file(str(tmp_path / "a.blend"), scene=SCENE, texts={"big": "x" * 4096})
+    assert BlendFile(path).texts() == {"big": "x" * 4096}
+    # The line past the limit is dropped, the smaller blocks before it are kept
+    blend = BlendFile(path, max_kept=2048)
+    assert blend.texts() == {"big": ""}
+    assert blend.truncated and not BlendFile(path).truncated
+    assert [s["name"] for s in blend.scenes()] == ["Shot"]
+
+
+def feed(data, chunk_size, **kwargs):
+    feeder = BlendFeeder(**kwargs)
+    for i in range(0, len(data), chunk_size):
+        feeder.feed(data[i:i + chunk_size])
+    return feeder.close()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 17, 4096, 1 << 20])
+def test_feeder_chunk_sizes(chunk_size):
+    data = blend_bytes(scene=SCENE, texts={"t": "a\nb"}, filler_bytes=30_000)
+    blend = feed(data, chunk_size)
+    assert blend.texts() == {"t": "a\nb"}
+    assert blend.active_scene()["frame_end"] == 40 and blend.compression is None
+
+
+def test_feeder_large_bhead():
+    blend = feed(large_bhead(blend_bytes(scene=SCENE)), 100)
+    assert blend.version == 500 and blend.active_scene()["fps"] == 25
+
+
+def test_feeder_gzip_members():
+    data = blend_bytes(scene=SCENE, filler_bytes=200_000)
+    blend = feed(gzip.compress(data[:100_000]) + gzip.compress(data[100_000:]), 8192)
+    assert blend.compression == "gzip" and blend.active_scene()["samples"] == 64
+
+
+def test_feeder_zstd_frames():
+    zstandard = pytest.importorskip("zstandard")
+    data = blend_bytes(scene=SCENE, filler_bytes=200_000)
+    compressor = zstandard.ZstdCompressor()
+    frames = b"".join(compressor.compress(data[i:i + 65536]) for i in range(0, len(data), 65536))
+    blend = feed(frames, 10_000)
+    assert blend.compression == "zstd" and blend.active_scene()["samples"] == 64
+
+
+def test_feeder_truncated():
+    data = blend_bytes(scene=SCENE, filler_bytes=100_000)
+    feeder = BlendFeeder()
+    feeder.feed(data[:60_000])
+    with pytest.raises(BlendReadError, match="Truncated"):
+        feeder.close()
+    with pytest.raises(BlendReadError):
+        BlendFeeder().feed(b"PK\x03\x04 not a blend")
+
+
+def test_feeder_kept_blocks_are_bounded():
+    blend = feed(blend_bytes(texts={"big": "x" * 4096}), 1000, max_kept=2048)
+    assert blend.truncated and blend.texts() == {"big": ""}
@@ -0,0 +1,77 @@
+import io
+import gzip
+
+import pytest
+
+from conftest import write_blend_file
+from blend_reader import BlendFile
+from blend_scanner import StreamScanner, scan_blend_texts, scan_file, scan_stream, scan_texts
+
+DATA = b"\x00" * 1000 + b"x = __import__('subprocess')" + b"\x00" * 1000
+
+
+def test_pattern_in_one_chunk():
+    scanner = StreamScanner()
+    assert scanner.feed(DATA) == b"__import__"
+    assert scanner.match_offset == 1004
+    assert scanner.result() == (True, "Suspicious pattern found: __import__")
+
+
+@pytest.mark.parametrize("split", range(1005, 1014))
+def test_pattern_across_chunks(split):
+    scanner = StreamScanner()
+    assert scanner.feed(DATA[:split]) is None
+    assert scanner.feed(DATA[split:]) == b"__import__"
+    assert scanner.match_offset == 1004
+
+
+def test_byte_by_byte():
+    scanner = StreamScanner()
+    for i in range(len(DATA)):
+        scanner.feed(DATA[i:i + 1])
+    assert scanner.match == b"__import__" and scanner.match_offset == 1004
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 1003, 4096])
+def test_scan_stream_chunk_sizes(chunk_size):
+    assert scan_stream(io.BytesIO(DATA), chunk_size=chunk_size).match == b"__import__"
+    assert scan_stream(io.BytesIO(b"\x00" * 5000), chunk_size=chunk_size).result() == (
+        False, "No suspicious scripts detected")
+
+
+def test_only_texts_are_scanned(tmp_path):
+    # Pattern in binary filler: a block-aware scan ignores it, a full scan does not
+    path = write_blend_file(str(tmp_path / "a.blend"), filler_bytes=100_000, filler_text=b"subprocess")
+    assert scan_file(path) == (False, "No suspicious scripts detected")
+    assert scan_file(path, block_aware=False) == (True, "Suspicious pattern found: subprocess")
+
+
+def test_suspicious_text(tmp_path):
+    path = write_blend_file(str(tmp_path / "a.blend"), texts={"run": "import bpy\nos.system('x')"})
+    assert scan_texts(path) == (True, "Suspicious pattern found: system( (text 'run')")
+
+
+def test_truncated_texts_need_a_full_scan(tmp_path):
+    path = write_blend_file(str(tmp_path / "a.blend"), texts={"big": "x" * 4096})
+    assert scan_blend_texts(BlendFile(path)) == (False, "No suspicious scripts detected")
+    assert scan_blend_texts(BlendFile(path, max_kept=2048)) is None
+
+
+@pytest.mark.parametrize("compress", ["gzip", "zstd"])
+def test_compressed_full_scan(tmp_path, compress):
+    if compress == "zstd":
+        pytest.importorskip("zstandard")
+    path = write_blend_file(str(tmp_path / "a.blend"), compress=compress,
+                            filler_bytes=300_000, filler_text=b"eval(")
+    assert scan_file(path) == (False, "No suspicious scripts detected")
+    assert scan_file(path, block_aware=False) == (True, "Suspicious pattern found: eval(")
+
+
+def test_unreadable_file_scanned_whole(tmp_path):
+    path = tmp_path / "a.blend"
+    path.write_bytes(gzip.compress(b"not a blend file, but eval( in it"))
+    assert scan_texts(str(path)) is None
+    assert scan_file(str(path)) == (True, "Suspicious pattern found: eval(")
+    empty = tmp_path / "empty.blend"
+    empty.write_bytes(b"")
+    assert scan_file(str(empty)) == (False, "No suspicious scripts detected")
@@ -0,0 +1,87 @@
+import os
+import time
+import threading
+
+import pytest
+
+from blender_pool import WarmWorkerPool
+from blender_runner import RenderError
+from render_queue import RenderJob
+
+
+def render_job(blend_file, tmp_path, frame=1):
+    job = RenderJob("scene.blend", blend_file, str(tmp_path / "scene"), {"frame": frame})
+    request = {"blend_path": blend_file, "output_base": job.output_base, "frame": frame}
+    return job, request
+
+
+def running_process(job, timeout=10):
+    """The Blender process rendering ``job``, once it has started."""
+    deadline = time.monotonic() + timeout
+    while not job.processes:
+        assert time.monotonic() < deadline, "render did not start"
+        time.sleep(0.02)
+    return next(iter(job.processes))
+
+
+@pytest.fixture
+def pool(fake_blender):
+    pool = WarmWorkerPool(fake_blender, startup_timeout=10)
+    yield pool
+    pool.shutdown()
+
+
+def test_worker_renders_and_is_reused(pool, blend_file, tmp_path):
+    job, request = render_job(blend_file, tmp_path)
+    assert pool.render(job, request, timeout=10) == [str(tmp_path / "scene0001.png")]
+    assert os.path.isfile(tmp_path / "scene0001.png")
+    worker = pool._idle[0]
+    assert worker.version == "4.4.3 (fake)"
+
+    job, request = render_job(blend_file, tmp_path, frame=2)
+    pool.render(job, request, timeout=10)
+    assert pool._idle == [worker]
+    assert worker.jobs == 2
+
+
+def test_failed_render_keeps_the_worker(pool, blend_file, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_BLENDER_FAIL", "scene")
+    job, request = render_job(blend_file, tmp_path)
+    with pytest.raises(RenderError, match="Cannot read file"):
+        pool.render(job, request, timeout=10)
+    assert len(pool._idle) == 1
+
+
+def test_crashed_worker_is_replaced(pool, blend_file, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_BLENDER_RENDER", "5")
+    job, request = render_job(blend_file, tmp_path)
+    errors = []
+
+    def run():
+        try:
+            pool.render(job, request, timeout=30)
+        except RenderError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    crashed = running_process(job)
+    crashed.kill()
+    thread.join(10)
+    assert [str(e) for e in errors] == ["Blender worker exited unexpectedly"]
+    assert pool._idle == []
+
+    monkeypatch.setenv("FAKE_BLENDER_RENDER", "0.05")
+    job, request = render_job(blend_file, tmp_path, frame=2)
+    assert pool.render(job, request, timeout=10) == [str(tmp_path / "scene0002.png")]
+    assert pool._idle[0].proc.pid != crashed.pid
+
+
+def test_worker_recycled_after_max_jobs(fake_blender, blend_file, tmp_path):
+    pool = WarmWorkerPool(fake_blender, max_jobs=1, startup_timeout=10)
+    try:
+        job, request = render_job(blend_file, tmp_path)
+        pool.render(job, request, timeout=10)
+        assert pool._idle == []
+    finally:
+        pool.shutdown()
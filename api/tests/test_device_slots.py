@@ -0,0 +1,114 @@
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+from blender_runner import build_command, device_setup_expr, run_blender
+from device_slots import ANY, CPU, GPU, DeviceScheduler, parse_inventory
+from conftest import API_DIR
+from render_queue import JobCancelled, RenderJob
+
+# Holds the lease of slot gpu0 of a scheduler sharing the directory, until killed
+HOLD_SLOT = """
+import sys, time
+from device_slots import DeviceScheduler, parse_inventory
+scheduler = DeviceScheduler(parse_inventory("0", cpu_slot=False), lease_dir=sys.argv[1])
+scheduler.acquire()
+print("held", flush=True)
+time.sleep(60)
+"""
+
+
+def test_parse_inventory():
+    slots = parse_inventory("0+1,2")
+    assert [(s.name, s.kind, s.devices) for s in slots] == [
+        ("gpu0+1", GPU, ("0", "1")), ("gpu2", GPU, ("2",)), ("cpu", CPU, None)]
+    assert [s.name for s in parse_inventory(None, cpu_slot=False)] == ["gpu"]
+
+
+def test_slot_environ_isolates_devices():
+    gpu01, gpu2, cpu = parse_inventory("0+1,2")
+    base = {"CUDA_VISIBLE_DEVICES": "0,1,2", "PATH": "/bin"}
+    assert gpu01.environ(base)["CUDA_VISIBLE_DEVICES"] == "0,1"
+    assert gpu2.environ(base)["CUDA_VISIBLE_DEVICES"] == "2"
+    assert cpu.environ(base)["CUDA_VISIBLE_DEVICES"] == ""
+    assert gpu2.environ(base)["PATH"] == "/bin"
+    assert parse_inventory(None)[0].environ(base)["CUDA_VISIBLE_DEVICES"] == "0,1,2"
+
+
+@pytest.mark.parametrize("spec,visible", [("0+1", "0,1"), ("2", "2"), ("", "")])
+def test_blender_sees_only_its_slot(fake_blender, blend_file, tmp_path, spec, visible):
+    slot = parse_inventory(spec)[0]
+    job = RenderJob("scene.blend", blend_file, str(tmp_path / "scene"))
+    request = {"blend_path": blend_file, "output_base": job.output_base, "frame": 1}
+    cmd = build_command(fake_blender, request, device_setup_expr(slot.cycles_device))
+    output = run_blender(cmd, job, timeout=30, env=slot.environ())
+    assert f"Devices: CUDA_VISIBLE_DEVICES={visible}" in output.splitlines()
+
+
+def test_concurrent_renders_take_distinct_slots():
+    scheduler = DeviceScheduler(parse_inventory("0,1"))
+    held, lock = [], threading.Lock()
+
+    def render():
+        with scheduler.slot(GPU) as slot:
+            with lock:
+                assert slot.name not in held
+                held.append(slot.name)
+            time.sleep(0.05)
+            with lock:
+                held.remove(slot.name)
+
+    threads = [threading.Thread(target=render) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert held == []
+    assert [s["busy"] for s in scheduler.status()] == [False, False, False]
+
+
+def test_preferences():
+    scheduler = DeviceScheduler(parse_inventory("0"))
+    gpu = scheduler.acquire(GPU)
+    assert gpu.name == "gpu0"
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(GPU, timeout=0)
+    assert scheduler.acquire(ANY).name == "cpu"
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(CPU, timeout=0)
+    scheduler.release(gpu)
+    assert scheduler.acquire(GPU, timeout=0) is gpu
+
+
+def test_cancelled_while_waiting():
+    scheduler = DeviceScheduler(parse_inventory("0", cpu_slot=False))
+    scheduler.acquire()
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(JobCancelled):
+        scheduler.acquire(cancel_event=cancel)
+
+
+def test_lease_excludes_other_processes(tmp_path):
+    lease_dir = str(tmp_path / "leases")
+    scheduler = DeviceScheduler(parse_inventory("0", cpu_slot=False), lease_dir=lease_dir)
+    holder = subprocess.Popen([sys.executable, "-c", HOLD_SLOT, lease_dir], cwd=API_DIR,
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "held"
+        with pytest.raises(TimeoutError):
+            scheduler.acquire(timeout=0)
+        status = scheduler.status()[0]
+        assert status["busy"] and status["pid"] == holder.pid
+    finally:
+        # The kernel releases the lease of a killed process
+        holder.kill()
+        holder.wait()
+        holder.stdout.close()
+    slot = scheduler.acquire(timeout=5)
+    assert slot.lease.owner["pid"] != holder.pid
+    scheduler.release(slot)
+    assert scheduler.status()[0]["busy"] is False
@@ -0,0 +1,83 @@
+import pytest
+
+import drive_catalog
+import gdrive_manager
+from drive_catalog import DriveCatalog
+from drive_stub import DriveStub
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """A Drive stub the catalog talks to anonymously, two files per page."""
+    stub = DriveStub()
+    monkeypatch.setenv("GDRIVE_API_ENDPOINT", stub.start())
+    for key in ("GOOGLE_SERVICE_ACCOUNT_B64", "GOOGLE_CLIENT_EMAIL"):
+        monkeypatch.delenv(key, raising=False)
+    monkeypatch.setattr(drive_catalog, "PAGE_SIZE", 2)
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def changes():
+    """Files passed to the catalog's ``on_change``."""
+    return []
+
+
+@pytest.fixture
+def catalog(stub, changes):
+    # A service of its own: the per-thread one of drive_service keeps the first stub's endpoint
+    return DriveCatalog(gdrive_manager._build_service, ttl=60, on_change=changes.extend)
+
+
+def names(catalog):
+    return sorted(f["name"] for f in catalog.files(max_age=0))
+
+
+def test_full_listing_reads_every_page(stub, catalog, changes):
+    for i in range(5):
+        stub.add_file(f"scene{i}.blend", b"BLENDER-v404")
+    stub.add_file("notes.txt", b"text", mime_type="text/plain")
+    stub.add_file("untitled", b"BLENDER-v404", mime_type="application/x-blender")
+    assert names(catalog) == ["scene0.blend", "scene1.blend", "scene2.blend", "scene3.blend", "scene4.blend",
+                              "untitled"]
+    assert catalog.stats["full_listings"] == 1 and stub.requests["/drive/v3/files"] == 3
+    assert len(changes) == 6
+    assert catalog.find("scene3.blend")["size"] == "12"
+
+
+def test_changes_are_applied_incrementally(stub, catalog, changes):
+    kept = stub.add_file("kept.blend", b"BLENDER-v404")
+    modified = stub.add_file("modified.blend", b"BLENDER-v404")
+    removed = stub.add_file("removed.blend", b"BLENDER-v404")
+    trashed = stub.add_file("trashed.blend", b"BLENDER-v404")
+    renamed = stub.add_file("renamed.blend", b"BLENDER-v404")
+    names(catalog)
+    changes.clear()
+
+    # Five changes: three pages of the changes feed
+    stub.add_file("modified.blend", b"BLENDER-v405", file_id=modified["id"])
+    stub.remove_file(removed["id"])
+    stub.trash_file(trashed["id"])
+    stub.add_file("renamed.txt", b"BLENDER-v404", file_id=renamed["id"])
+    added = stub.add_file("added.blend", b"BLENDER-v404")
+    listed = stub.requests["/drive/v3/files"]
+    assert names(catalog) == ["added.blend", "kept.blend", "modified.blend"]
+    assert stub.requests["/drive/v3/files"] == listed and stub.requests["/drive/v3/changes"] == 3
+    assert catalog.stats["incremental"] == 1
+    assert sorted(f["id"] for f in changes) == sorted([modified["id"], added["id"]])
+    assert catalog.get(modified["id"])["md5Checksum"] != modified["md5Checksum"]
+    assert catalog.get(kept["id"]) == kept
+
+
+def test_expired_token_lists_everything_again(stub, catalog):
+    stub.add_file("old.blend", b"BLENDER-v404")
+    names(catalog)
+    stub.add_file("new.blend", b"BLENDER-v404")
+    stub.expire_changes()
+
+    # The failed refresh keeps serving the previous list
+    assert names(catalog) == ["old.blend"]
+    assert "410" in catalog.last_error and catalog.stats["errors"] == 1
+    assert names(catalog) == ["new.blend", "old.blend"]
+    assert catalog.last_error is None and catalog.stats["full_listings"] == 2
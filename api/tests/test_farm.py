@@ -0,0 +1,185 @@
+import io
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import pytest
+
+from conftest import API_DIR, write_blend_file
+from blender_runner import RenderError
+from farm import LEASED, Farm, FarmError
+from render_cache import file_digest
+from render_queue import DONE, JobCancelled, RenderJob
+import farm_local
+
+
+class Execution:
+    """``Farm.execute`` of a job running in a thread, with its outcome."""
+
+    def __init__(self, farm, job):
+        self.job = job
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(farm,), daemon=True)
+        self.thread.start()
+
+    def _run(self, farm):
+        try:
+            farm.execute(self.job, file_digest(self.job.blend_path))
+        except Exception as e:
+            self.error = e
+
+    def join(self):
+        self.thread.join(10)
+        assert not self.thread.is_alive()
+
+
+@pytest.fixture
+def job(blend_file, tmp_path):
+    return RenderJob("scene.blend", blend_file, str(tmp_path / "output" / "scene"), {"frame": 1})
+
+
+@pytest.fixture
+def farm(tmp_path):
+    os.makedirs(tmp_path / "output")
+    return Farm(str(tmp_path / "output"), worker_timeout=0.3, max_attempts=2)
+
+
+def lease(farm, worker_id):
+    task = farm.lease(worker_id, wait=5)
+    assert task is not None
+    return task
+
+
+def test_task_rendered_by_a_worker(farm, job):
+    execution = Execution(farm, job)
+    task = lease(farm, "w1")
+    assert task["attempt"] == 1 and task["settings"] == {"frame": 1}
+    assert farm.blob_path(task["blob"]) == job.blend_path
+    farm.write_output(task["id"], "w1", 1, "scene0001.png", io.BytesIO(b"png"))
+    farm.complete(task["id"], "w1", 1, DONE, outputs=["scene0001.png"])
+    execution.join()
+    assert execution.error is None
+    assert job.outputs == ["scene0001.png"] and job.device == "w1"
+
+
+def test_lease_of_a_silent_worker_expires(farm, job):
+    execution = Execution(farm, job)
+    first = lease(farm, "w1")
+    assert farm.status()["leased"] == 1
+    # w1 was killed: no heartbeat, w2 gets the task once w1 is silent for too long
+    second = lease(farm, "w2")
+    assert second["id"] == first["id"] and second["attempt"] == 2
+    assert [w["alive"] for w in farm.status()["workers"]] == [False, True]
+
+    # The late worker's reports are refused
+    assert farm.heartbeat("w1", running={first["id"]: {"attempt": 1}}) == [first["id"]]
+    with pytest.raises(FarmError):
+        farm.complete(first["id"], "w1", 1, DONE, outputs=[])
+    farm.write_output(second["id"], "w2", 2, "scene0001.png", io.BytesIO(b"png"))
+    farm.complete(second["id"], "w2", 2, DONE, outputs=["scene0001.png"])
+    execution.join()
+    assert execution.error is None and job.device == "w2"
+
+
+def test_heartbeat_keeps_the_lease(farm, job):
+    execution = Execution(farm, job)
+    task = lease(farm, "w1")
+    for _ in range(4):
+        time.sleep(0.15)
+        assert farm.heartbeat("w1", running={task["id"]: {"attempt": 1}}) == []
+    assert farm.status()["tasks"][0]["state"] == LEASED
+    job.cancel_event.set()
+    execution.join()
+    assert isinstance(execution.error, JobCancelled)
+
+
+def test_task_fails_after_max_attempts(farm, job):
+    execution = Execution(farm, job)
+    lease(farm, "w1")
+    lease(farm, "w2")
+    time.sleep(0.4)
+    farm.reap()
+    execution.join()
+    assert isinstance(execution.error, RenderError)
+    assert "Worker lost 2 time(s)" in str(execution.error)
+    assert farm.status()["pending"] == 0
+
+
+def test_unknown_outputs_refused(farm, job):
+    execution = Execution(farm, job)
+    task = lease(farm, "w1")
+    with pytest.raises(FarmError):
+        farm.write_output(task["id"], "w1", 1, "../other0001.png", io.BytesIO(b"png"))
+    farm.complete(task["id"], "w1", 1, DONE, outputs=["scene0001.png"])
+    execution.join()
+    assert "Outputs not uploaded" in str(execution.error)
+    assert farm.status()["tasks"] == []
+
+
+@pytest.fixture(scope="module")
+def coordinator():
+    """An app in coordinator mode on two files of ``uploads/``: its client and workdir."""
+    workdir = tempfile.mkdtemp(prefix="farm-test-")
+    for sub in ("uploads", "output"):
+        os.makedirs(os.path.join(workdir, "coordinator", sub))
+    for i in range(2):
+        write_blend_file(os.path.join(workdir, "coordinator", "uploads", f"farm{i:03d}.blend"), seed=i)
+    port = farm_local.free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = farm_local.base_env(
+        WORKDIR=os.path.join(workdir, "coordinator"), JOB_LOG_DIR=os.path.join(workdir, "coordinator", "logs"),
+        FARM_MODE="coordinator", FARM_TOKEN=farm_local.FARM_TOKEN, AUTH_TOKEN=farm_local.AUTH_TOKEN,
+        FARM_WORKER_TIMEOUT="2", RENDER_CACHE_MB="0",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-c", f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        farm_local.wait_for(url)
+        yield farm_local.Client(url), workdir
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@pytest.fixture
+def workers(coordinator):
+    """Two ``farm_worker.py`` processes of the coordinator and their ids, stopped after the test."""
+    client, workdir = coordinator
+    known = {w["id"] for w in client.json("/farm")["workers"]}
+    workers = [farm_local.start_worker(client.url, workdir, f"node{i}", 1.0) for i in range(2)]
+    try:
+        yield workers, farm_local.wait_for_workers(client, known, 2) - known
+    finally:
+        for worker in workers:
+            worker.kill()
+            worker.wait()
+
+
+def test_frames_of_one_file_render_on_two_workers(coordinator, workers):
+    client, workdir = coordinator
+    _, batch = farm_local.run_batch(client, workers[0], 2, frames=2, timeout=60)
+    assert batch["state"] == DONE, batch
+    assert {job["device"] for job in batch["jobs"]} == {"node0", "node1"}
+    # Written together, not one render after the other
+    output = os.path.join(workdir, "coordinator", "output")
+    first, second = (os.path.getmtime(os.path.join(output, f"farm000{frame:04d}.png")) for frame in (1, 2))
+    assert abs(first - second) < 0.5
+
+
+def test_killed_worker_process_job_reassigned(coordinator, workers):
+    """One of two workers is killed while it renders; the batch has two frames of each of two files."""
+    client, _ = coordinator
+    processes, ids = workers
+    _, batch = farm_local.run_batch(client, processes, 4, frames=2, kill=0, timeout=60)
+    assert processes[0].poll() is not None
+    assert batch["state"] == DONE, batch
+    assert sorted(o for job in batch["jobs"] for o in job["outputs"]) == [
+        f"farm{i:03d}{frame:04d}.png" for i in range(2) for frame in (1, 2)]
+    farm = [w for w in client.json("/farm")["workers"] if w["id"] in ids]
+    assert [w["alive"] for w in sorted(farm, key=lambda w: w["name"])] == [False, True]
@@ -0,0 +1,19 @@
+import os
+
+from leases import is_held, share, try_acquire
+
+
+def test_shared_lease_keeps_out_an_exclusive_holder(tmp_path):
+    path = str(tmp_path / "scene.blend.lock")
+    first, second = share(path, name="render"), share(path, name="render")
+    assert is_held(path)
+    assert try_acquire(path, name="upload") is None
+    first.release()
+    assert try_acquire(path, name="upload") is None
+    # The last holder removes the file
+    second.release()
+    assert not os.path.exists(path) and not is_held(path)
+    with try_acquire(path, name="upload"):
+        assert is_held(path)
+    assert not os.path.exists(path)
+
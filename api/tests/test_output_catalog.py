@@ -0,0 +1,39 @@
+import os
+import time
+
+from output_catalog import OutputCatalog, thumbnail_format
+from png_stream import PNGWriter, part_path
+
+
+def write_png(path, width=64, height=32):
+    writer = PNGWriter(str(path), width, height, 8, 2)
+    for y in range(height):
+        writer.write_row(bytes([y * 8 % 256, 0, 255]) * width)
+    writer.close()
+
+
+def test_scan_keeps_thumbnails_being_written(tmp_path):
+    output, thumbnails = tmp_path / "output", tmp_path / "thumbnails"
+    os.makedirs(output)
+    os.makedirs(thumbnails)
+    write_png(output / "scene0001.png")
+    thumb = thumbnails / f"scene0001.png.{thumbnail_format()}"
+    # One written by another process right now, one left by a crash
+    writing, leftover = part_path(str(thumb)), part_path(str(thumb))
+    assert writing != leftover
+    for path in (writing, leftover):
+        open(path, "wb").close()
+    hours_ago = time.time() - 2 * 3600
+    os.utime(leftover, (hours_ago, hours_ago))
+
+    catalog = OutputCatalog(str(output), str(thumbnails))
+    try:
+        outputs, total = catalog.page()
+        assert [o.name for o in outputs] == ["scene0001.png"] and total == 1
+        deadline = time.monotonic() + 10
+        while catalog.thumbnail_path("scene0001.png") is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+    finally:
+        catalog.shutdown()
+    assert sorted(os.listdir(thumbnails)) == sorted([thumb.name, os.path.basename(writing)])
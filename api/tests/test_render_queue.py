@@ -0,0 +1,44 @@
+import time
+import threading
+
+from render_queue import CANCELLED, DONE, RenderJob, RenderQueue
+
+
+def progressive(frame=1):
+    """The full render of ``frame`` and its draft, for ``RenderQueue.submit``."""
+    job = RenderJob("scene.blend", "/uploads/scene.blend", "/output/scene", {"frame": frame})
+    draft = RenderJob("scene.blend", "/uploads/scene.blend", "/output/scene_draft",
+                      {"frame": frame, "quality": "draft"})
+    return job, draft
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_superseding_render_starts_once_the_old_one_stopped():
+    started = threading.Event()
+
+    old, old_draft = progressive()
+
+    def run(job):
+        if job is old_draft:
+            started.set()
+            job.cancel_event.wait(10)
+            # Blender takes a while to stop
+            time.sleep(0.3)
+            raise RuntimeError("terminated")
+
+    queue = RenderQueue(run, workers=2)
+    queue.submit(old, preview=old_draft)
+    assert started.wait(10)
+
+    new, new_draft = progressive()
+    queue.submit(new, preview=new_draft)
+    wait_for(lambda: old.finished and new.finished)
+    assert (old_draft.state, old.state) == (CANCELLED, CANCELLED)
+    assert (new_draft.state, new.state) == (DONE, DONE)
+    assert new_draft.started_at >= old_draft.finished_at
@@ -0,0 +1,96 @@
+import os
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from blender_runner import RenderError, frame_path, render_on_slot, slot_names
+from png_stream import stitch
+from render_queue import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+
+def parse_tiles(spec):
+    """``"4"`` -> 4 horizontal bands, ``"3x2"`` -> 3 columns by 2 rows."""
+    spec = str(spec).lower()
+    try:
+        if "x" in spec:
+            cols, rows = (int(v) for v in spec.split("x", 1))
+        else:
+            cols, rows = 1, int(spec)
+    except ValueError:
+        raise ValueError(f"Invalid tile layout: {spec}")
+    if cols < 1 or rows < 1 or cols * rows > 64:
+        raise ValueError(f"Invalid tile layout: {spec}")
+    return cols, rows
+
+
+def tile_borders(cols, rows):
+    """Render borders of a ``cols`` x ``rows`` grid, as ``(row, col, border)``.
+
+    Rows are numbered from the top of the image while Blender's border
+    origin is the bottom left corner. Adjacent tiles share their edge value
+    so Blender rounds them to the same pixel and no seam or overlap appears.
+    """
+    tiles = []
+    for row in range(rows):
+        ymax = (rows - row) / rows
+        ymin = (rows - row - 1) / rows
+        for col in range(cols):
+            tiles.append((row, col, (col / cols, (col + 1) / cols, ymin, ymax)))
+    return tiles
+
+
+def render_tiled(backend, scheduler, job, retries=1):
+    """Render one frame as concurrent border tiles and stitch them together.
+
+    Tiles are written to a scratch directory next to the output and stitched
+    row by row into ``<base><frame>.png``. They run on at most as many slots
+    as the job's device has, so ``render_job`` renders the frame whole when
+    there is only one.
+    """
+    cols, rows = job.settings["tiles"]
+    frame = int(job.settings.get("frame", 1))
+    tile_dir = f"{job.output_base}.tiles-{job.id}"
+    os.makedirs(tile_dir, exist_ok=True)
+
+    tiles, records = [], []
+    for row, col, border in tile_borders(cols, rows):
+        tile_base = os.path.join(tile_dir, f"r{row:02d}c{col:02d}_")
+        request = {"blend_path": job.blend_path, "output_base": tile_base, "frame": frame, "border": border}
+        tiles.append((row, col, request, frame_path(tile_base, frame)))
+        records.append({})
+
+    parallel = max(1, min(len(scheduler.candidates(job.settings.get("device"))), len(tiles)))
+    logger.info(f"Rendering {job.filename} frame {frame} as {cols}x{rows} tiles")
+    try:
+        with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix=f"tile-{job.id}") as executor:
+            futures = [
+                executor.submit(
+                    render_on_slot, backend, scheduler, job, request, [path],
+                    retries=retries, label=f"tile {row},{col} of {job.filename}", record=record,
+                )
+                for (row, col, request, path), record in zip(tiles, records)
+            ]
+            errors = []
+            for (row, col, _, _), future in zip(tiles, futures):
+                try:
+                    future.result()
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    errors.append(f"tile {row},{col}: {e}")
+                    for other in futures:
+                        other.cancel()
+        job.device = slot_names(records) or job.device
+        if errors:
+            raise RenderError("; ".join(errors))
+
+        output_image = frame_path(job.output_base, frame)
+        grid = [[path for r, _, _, path in tiles if r == row] for row in range(rows)]
+        stitch(grid, output_image)
+    finally:
+        shutil.rmtree(tile_dir, ignore_errors=True)
+
+    logger.info(f"Stitched {len(tiles)} tiles into {output_image}")
+    job.outputs = [os.path.basename(output_image)]
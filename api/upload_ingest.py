@@ -0,0 +1,155 @@
+"""Checks uploaded .blend files while they are being received.
+
+``IngestStream`` is handed to the multipart form parser as the file object
+of an upload. Every chunk is counted against the size limit, hashed,
+parsed by a ``BlendFeeder`` and appended to a hidden temporary file in the
+destination directory. Once the request is parsed the upload is accepted or
+rejected without reading it back, and an accepted file is renamed into
+place so a half-written file never shows up under a .blend name.
+"""
+import os
+import time
+import hashlib
+import logging
+import tempfile
+
+from blend_reader import BlendFeeder, BlendReadError
+from blend_scanner import scan_blend_texts, scan_file
+
+logger = logging.getLogger(__name__)
+
+TEMP_PREFIX = ".upload-"
+
+
+class IngestStream:
+    """Writable file object receiving one uploaded file.
+
+    Problems are recorded in ``error`` rather than raised: the form parser
+    would swallow the exception. Once an upload is rejected the remaining
+    data is only counted.
+    """
+
+    def __init__(self, directory, max_size):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX, suffix=".part")
+        self._file = os.fdopen(fd, "w+b")
+        self.max_size = max_size
+        self.size = 0
+        self.error = None
+        self.published = None
+        self._hash = hashlib.sha256()
+        self._feeder = BlendFeeder()
+        self._parse_error = None
+        # Seconds spent parsing and scanning, while receiving and in check()
+        self.scan_seconds = 0.0
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.error is not None:
+            return len(data)
+        if self.size > self.max_size:
+            self._reject(f"Invalid file: File too large (max {self.max_size // (1024 * 1024)}MB)")
+            return len(data)
+        self._hash.update(data)
+        self._file.write(data)
+        if self._feeder is not None:
+            started = time.perf_counter()
+            try:
+                self._feeder.feed(data)
+            except BlendReadError as e:
+                if not self._feeder.header_read:
+                    self._reject("Invalid file: Invalid .blend file signature")
+                    return len(data)
+                # Valid header but unusual block structure: scan the bytes at the end
+                self._parse_error = str(e)
+                self._feeder = None
+            finally:
+                self.scan_seconds += time.perf_counter() - started
+        return len(data)
+
+    def _reject(self, message):
+        self.error = message
+        self._discard()
+
+    def check(self):
+        """Finish checking the received file, returns ``(ok, message)``."""
+        started = time.perf_counter()
+        try:
+            return self._check()
+        finally:
+            self.scan_seconds += time.perf_counter() - started
+
+    def _check(self):
+        if self.error is None:
+            result = None
+            if self._feeder is not None:
+                try:
+                    result = scan_blend_texts(self._feeder.close())
+                except BlendReadError as e:
+                    if not self._feeder.header_read:
+                        self._reject(f"Invalid file: {e}")
+                        return False, self.error
+                    self._parse_error = str(e)
+            if self.error is None and result is None:
+                logger.info(f"Scanning every byte of {self.temp_path}: {self._parse_error or 'texts not kept'}")
+                self._file.flush()
+                result = scan_file(self.temp_path, block_aware=False)
+            if result[0]:
+                self._reject(f"File rejected: {result[1]}")
+        if self.error is not None:
+            return False, self.error
+        return True, "Valid"
+
+    def publish(self, path):
+        """Atomically move the checked upload to ``path``."""
+        self._file.close()
+        os.replace(self.temp_path, path)
+        self.published = path
+
+    def _discard(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+    # --- file object interface used by werkzeug's FileStorage ---
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if self._file.closed:
+            return 0
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        """Called when the request ends: removes the file unless it was published."""
+        if self.published is None:
+            self._discard()
+
+
+def remove_stale_uploads(directory):
+    """Remove temporary files left behind by an interrupted process."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith(TEMP_PREFIX) and name.endswith(".part"):
+            try:
+                os.remove(os.path.join(directory, name))
+                logger.info(f"Removed stale upload: {name}")
+            except OSError as e:
+                logger.warning(f"Could not remove stale upload {name}: {e}")